@@ -0,0 +1,233 @@
+"""
+批量模拟：在进程池中无界面地跑大量对局，收集每局结果并统计胜率。
+
+用法示例：
+    python batch_sim.py --games 1000 --players 5 --workers 8 --output results.jsonl
+    python batch_sim.py --games 200 --word-option 用户提供 --normal-word 苹果 --spy-word 梨子
+    # 先录制，再零成本回放（第i局使用种子 seed+i，名字和卧底位置可复现）
+    python batch_sim.py --games 50 --seed 1 --cache llm_cache.sqlite3 --cache-mode record
+    python batch_sim.py --games 50 --seed 1 --cache llm_cache.sqlite3 --cache-mode replay
+    # 从预取词库取词（先用 word_pool.py --fill 填充），词库为空时才请求GM生词
+    python batch_sim.py --games 100 --word-pool word_pool.sqlite3 --word-difficulty hard
+    # 逐局展开为列式记录（Parquet），之后用 transcript_export.py query 统计
+    python batch_sim.py --games 1000 --transcripts transcripts/
+"""
+import argparse
+import json
+import sys
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import game_engine
+from game_engine import SPEECH_MODES, VOTE_MODES, Game
+from llm_cache import LLMCache
+from game_log import GameLog
+from llm_client import LLMClient, load_openai
+from word_pool import CATEGORIES, DIFFICULTIES, WordPool
+from transcript_export import FORMATS, TranscriptWriter, game_rows
+import metrics
+from context_policy import WindowPolicy
+
+# 单局最多进行的轮数（连续平票/无效投票时防止死循环）
+DEFAULT_MAX_ROUNDS = 20
+
+# 当前进程注册的调用记录导出器
+_metrics_exporter = None
+
+# 当前进程打开的预取词库
+_word_pool = None
+
+# 当前进程打开的对局事件日志
+_game_log = None
+
+
+def play_one_game(config):
+    """
+    按 config 跑完一局游戏，返回 Game.outcome()；config 中 transcript 为真时附带 "transcript"（game_rows 的行列表）。
+    config 字段：num_players, word_option, normal_word, spy_word, params, vote_concurrency, vote_mode, vote_short_circuit, speech_mode, max_rounds,
+    seed, cache_path, cache_mode, keep_rounds, context_fold, process_rate_limit, metrics_jsonl,
+    word_pool_path, word_category, word_difficulty, game_log_path, transcript
+    （必须是模块级函数，才能被进程池序列化调用）
+    """
+    global _metrics_exporter, _word_pool, _game_log
+    if config.get("game_log_path") and _game_log is None:
+        # 每个工作进程打开一次事件日志文件，逐局写入全部事件（之后可用 Game.load 重放任意一局）
+        _game_log = GameLog(config["game_log_path"])
+    if config.get("word_pool_path") and _word_pool is None:
+        # 每个工作进程打开一次词库文件（取词是原子操作，多进程不会取到同一组）
+        _word_pool = WordPool(config["word_pool_path"])
+    if config.get("metrics_jsonl") and _metrics_exporter is None:
+        # 每个工作进程注册一次，逐次调用追加到同一个JSONL文件
+        _metrics_exporter = metrics.add_exporter(metrics.JsonlExporter(config["metrics_jsonl"]))
+    if config.get("process_rate_limit") and game_engine._client.bucket.rate is None:
+        # 每个工作进程分到总限速的一份
+        game_engine.configure_client(LLMClient(rate=config["process_rate_limit"]))
+    if config.get("cache_path") and game_engine._cache is None:
+        # 每个工作进程打开一次缓存文件
+        game_engine.configure_cache(LLMCache(config["cache_path"], mode=config.get("cache_mode", "record")))
+    game = Game(
+        params=config.get("params"),
+        vote_concurrency=config.get("vote_concurrency", 5),
+        vote_mode=config.get("vote_mode", "text"),
+        vote_short_circuit=config.get("vote_short_circuit", False),
+        speech_mode=config.get("speech_mode", "sequential"),
+        seed=config.get("seed"),
+        context_policy=WindowPolicy(config["keep_rounds"], config.get("context_fold", "digest")) if config.get("keep_rounds") else None,
+        word_pool=_word_pool,
+        event_log=_game_log,
+    )
+    game.setup_game(
+        config["num_players"],
+        config.get("word_option", "AI GM自动"),
+        config.get("normal_word", ""),
+        config.get("spy_word", ""),
+        config.get("word_category"),
+        config.get("word_difficulty"),
+    )
+    max_rounds = config.get("max_rounds", DEFAULT_MAX_ROUNDS)
+    while not game.game_over and game.round_index < max_rounds:
+        game.run_one_round()
+    outcome = game.outcome()
+    if config.get("transcript"):
+        outcome["transcript"] = game_rows(game)
+    return outcome
+
+
+def run_batch(num_games, config, workers=4, output=None, transcripts=None):
+    """
+    在进程池中跑 num_games 局，按完成顺序收集结果。
+    若 config 中给出 seed，第 i 局使用种子 seed+i；给出 rate_limit（每秒请求数）时平均分给各进程。
+    若给出 output（文件对象），每局结束后立即写入一行JSON。
+    若给出 transcripts（TranscriptWriter），各局的列式记录在主进程中统一写出（不出现在返回结果和 output 中）。
+    返回全部结果列表；单局抛出的异常记录为 {"error": ...}，不会中断整批。
+    """
+    results = []
+    if not (config.get("cache_path") and config.get("cache_mode") == "replay"):
+        # 要请求接口：先在主进程导入 openai，fork 出的工作进程直接继承，不必各自再花几百毫秒导入
+        load_openai()
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = []
+        for i in range(num_games):
+            game_config = dict(config)
+            game_config["transcript"] = transcripts is not None
+            if config.get("rate_limit"):
+                game_config["process_rate_limit"] = config["rate_limit"] / workers
+            if config.get("seed") is not None:
+                game_config["seed"] = config["seed"] + i
+            futures.append(executor.submit(play_one_game, game_config))
+        for future in as_completed(futures):
+            try:
+                result = future.result()
+            except Exception as e:
+                result = {"error": str(e)}
+            rows = result.pop("transcript", None)
+            if rows:
+                transcripts.add_rows(rows)
+            results.append(result)
+            if output is not None:
+                output.write(json.dumps(result, ensure_ascii=False) + "\n")
+                output.flush()
+    return results
+
+
+def summarize(results):
+    """
+    汇总批量结果：局数、各方胜率、平均轮数、卧底存活率、无人淘汰的轮次占比。
+    """
+    finished = [r for r in results if "error" not in r]
+    total = len(finished)
+    summary = {"games": len(results), "errors": len(results) - total}
+    if not total:
+        return summary
+    spy_wins = sum(1 for r in finished if r["winner"] == "卧底")
+    civilian_wins = sum(1 for r in finished if r["winner"] == "平民")
+    # 平票或全部无效投票、无人淘汰的轮次（白白花掉一整轮的发言和投票请求）
+    dead_rounds = sum(1 for r in finished for record in r["votes"] if record["eliminated"] is None)
+    summary.update({
+        "spy_win_rate": spy_wins / total,
+        "civilian_win_rate": civilian_wins / total,
+        "unfinished_rate": (total - spy_wins - civilian_wins) / total,
+        "avg_rounds": sum(r["rounds"] for r in finished) / total,
+        "spy_survival_rate": sum(1 for r in finished if r["spy_survived"]) / total,
+        "dead_round_rate": dead_rounds / max(1, sum(len(r["votes"]) for r in finished)),
+    })
+    return summary
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="谁是卧底 批量模拟")
+    parser.add_argument("--games", type=int, default=100, help="对局数")
+    parser.add_argument("--players", type=int, default=5, help="玩家数量(不含GM)")
+    parser.add_argument("--workers", type=int, default=4, help="进程数")
+    parser.add_argument("--word-option", default="AI GM自动", choices=["用户提供", "AI GM自动"])
+    parser.add_argument("--normal-word", default="苹果")
+    parser.add_argument("--spy-word", default="梨子")
+    parser.add_argument("--temperature", type=float, default=0.7)
+    parser.add_argument("--top-p", type=float, default=1.0)
+    parser.add_argument("--presence-penalty", type=float, default=0.0)
+    parser.add_argument("--frequency-penalty", type=float, default=0.0)
+    parser.add_argument("--vote-concurrency", type=int, default=5)
+    parser.add_argument("--vote-mode", default="text", choices=VOTE_MODES, help="投票方式：text(###Vote行) / json(结构化+追问)")
+    parser.add_argument("--vote-short-circuit", action="store_true", help="本轮结果确定后停止收集剩余投票")
+    parser.add_argument("--speech-mode", default="sequential", choices=SPEECH_MODES,
+                        help="发言方式：sequential(依次) / pipelined(依次，流水线请求) / simultaneous(同时发言规则)")
+    parser.add_argument("--max-rounds", type=int, default=DEFAULT_MAX_ROUNDS)
+    parser.add_argument("--seed", type=int, help="种子模式：第i局使用种子 seed+i")
+    parser.add_argument("--cache", help="LLM回答缓存文件(SQLite)路径")
+    parser.add_argument("--cache-mode", default="record", choices=["record", "replay"])
+    parser.add_argument("--rate-limit", type=float, help="全部进程合计的每秒最大请求数")
+    parser.add_argument("--keep-rounds", type=int, default=0, help="上下文只保留最近N轮原文(0=完整历史)")
+    parser.add_argument("--context-fold", default="digest", choices=["digest", "drop"], help="更早轮次折叠为摘要或丢弃")
+    parser.add_argument("--output", help="逐局结果输出的JSONL文件路径")
+    parser.add_argument("--metrics-jsonl", help="逐次LLM调用性能记录的JSONL文件路径")
+    parser.add_argument("--game-log", help="对局事件日志文件(SQLite)路径，记录每局的全部事件")
+    parser.add_argument("--word-pool", help="预取词库文件(SQLite)路径，AI GM模式下优先从中取词")
+    parser.add_argument("--word-category", choices=CATEGORIES, help="只从词库中取该类别的词对")
+    parser.add_argument("--word-difficulty", choices=DIFFICULTIES, help="只从词库中取该难度的词对")
+    parser.add_argument("--transcripts", help="列式对局记录的数据集目录（每次运行追加一个分片）")
+    parser.add_argument("--transcript-format", default="parquet", choices=list(FORMATS))
+    args = parser.parse_args(argv)
+
+    config = {
+        "num_players": args.players,
+        "word_option": args.word_option,
+        "normal_word": args.normal_word,
+        "spy_word": args.spy_word,
+        "params": {
+            "temperature": args.temperature,
+            "top_p": args.top_p,
+            "presence_penalty": args.presence_penalty,
+            "frequency_penalty": args.frequency_penalty,
+        },
+        "vote_concurrency": args.vote_concurrency,
+        "vote_mode": args.vote_mode,
+        "vote_short_circuit": args.vote_short_circuit,
+        "speech_mode": args.speech_mode,
+        "max_rounds": args.max_rounds,
+        "seed": args.seed,
+        "cache_path": args.cache,
+        "cache_mode": args.cache_mode,
+        "rate_limit": args.rate_limit,
+        "keep_rounds": args.keep_rounds,
+        "context_fold": args.context_fold,
+        "metrics_jsonl": args.metrics_jsonl,
+        "word_pool_path": args.word_pool,
+        "game_log_path": args.game_log,
+        "word_category": args.word_category,
+        "word_difficulty": args.word_difficulty,
+    }
+
+    output = open(args.output, "a", encoding="utf-8") if args.output else None
+    transcripts = TranscriptWriter(args.transcripts, format=args.transcript_format) if args.transcripts else None
+    try:
+        results = run_batch(args.games, config, workers=args.workers, output=output, transcripts=transcripts)
+    finally:
+        if output is not None:
+            output.close()
+        if transcripts is not None:
+            transcripts.close()
+    json.dump(summarize(results), sys.stdout, ensure_ascii=False, indent=2)
+    print()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,188 @@
+"""
+端到端延迟压测：对本地模拟服务（或任意兼容接口）跑完整对局，统计
+- setup_game 与 run_one_round 的 p50/p99 耗时
+- 每局请求数、每轮平均耗时
+玩家数默认覆盖 2~10。
+--speech-modes 给出多种发言方式时逐一压测，并输出第1轮平均耗时相对 sequential（依次发言）的加速比；
+--render-delay 模拟界面展示一条完整回答的耗时（流水线发言可以把它移出关键路径）。
+
+用法示例：
+    python benchmark.py --games 5 --latency fixed:0.2 --token-rate 80
+    python benchmark.py --players 3,6,10 --stream --vote-concurrency 10 --output bench.json
+    python benchmark.py --api-base http://127.0.0.1:8765/v1   # 使用已启动的服务
+    python benchmark.py --players 5,8 --speech-modes sequential,pipelined,simultaneous --render-delay 0.1
+"""
+import argparse
+import json
+import statistics
+import sys
+import time
+
+import game_engine
+from game_engine import SPEECH_MODES, VOTE_MODES, Game, NullReporter, NullStreamSink
+from metrics import MetricsCollector, percentile
+from mock_llm_server import MockLLM, MockLLMServer
+
+DEFAULT_MAX_ROUNDS = 20
+
+
+class RenderDelayReporter(NullReporter):
+    """模拟界面渲染：每展示一条完整回答（reply，或流式回答结束时的 close）耗时 delay 秒。"""
+
+    def __init__(self, delay):
+        self.delay = delay
+
+    def reply(self, title, text):
+        time.sleep(self.delay)
+
+    def stream_reply(self, title):
+        return RenderDelaySink(self.delay)
+
+
+class RenderDelaySink(NullStreamSink):
+    def __init__(self, delay):
+        self.delay = delay
+
+    def close(self, full_text):
+        time.sleep(self.delay)
+
+
+def bench_player_count(num_players, games, game_kwargs, max_rounds=DEFAULT_MAX_ROUNDS):
+    """
+    以 num_players 位玩家顺序跑 games 局，返回耗时和请求数统计（含按阶段的调用耗时汇总）。
+    """
+    collector = MetricsCollector()
+    setup_times = []
+    round_times = []
+    first_round_times = []
+    calls_per_game = []
+    rounds_per_game = []
+    for _ in range(games):
+        game = Game(**game_kwargs)
+        start = time.perf_counter()
+        game.setup_game(num_players, "AI GM自动")
+        setup_times.append(time.perf_counter() - start)
+        while not game.game_over and game.round_index < max_rounds:
+            start = time.perf_counter()
+            game.run_one_round()
+            round_times.append(time.perf_counter() - start)
+            if game.round_index == 1:
+                first_round_times.append(round_times[-1])
+        calls_per_game.append(len(game.metrics.records))
+        rounds_per_game.append(game.round_index)
+        for record in game.metrics.records:
+            collector.add(record)
+    return {
+        "players": num_players,
+        "games": games,
+        "calls_per_game": statistics.mean(calls_per_game),
+        "rounds_per_game": statistics.mean(rounds_per_game),
+        "setup_p50": percentile(setup_times, 50),
+        "setup_p99": percentile(setup_times, 99),
+        "round_p50": percentile(round_times, 50),
+        "round_p99": percentile(round_times, 99),
+        "round_mean": statistics.mean(round_times) if round_times else 0.0,
+        # 第1轮全部玩家都存活，不同发言方式之间可直接比较
+        "first_round_mean": statistics.mean(first_round_times) if first_round_times else 0.0,
+        "phases": collector.summary(by=("phase",)),
+    }
+
+
+def speech_mode_speedups(rows):
+    """
+    每个玩家数下各发言方式的第1轮平均耗时（全部玩家存活，轮次长度一致）相对 sequential 的加速比：
+    [{"players", "speech_mode", "first_round_mean", "speedup"}, ...]（没有 sequential 结果的玩家数不计算）。
+    """
+    baseline = {row["players"]: row["first_round_mean"] for row in rows if row["speech_mode"] == "sequential"}
+    return [
+        {"players": row["players"], "speech_mode": row["speech_mode"], "first_round_mean": row["first_round_mean"],
+         "speedup": baseline[row["players"]] / row["first_round_mean"] if row["first_round_mean"] else None}
+        for row in rows if row["players"] in baseline
+    ]
+
+
+def parse_players(spec):
+    """'2-10' 或 '3,6,10' → 玩家数列表"""
+    if "-" in spec:
+        low, high = spec.split("-", 1)
+        return list(range(int(low), int(high) + 1))
+    return [int(value) for value in spec.split(",") if value]
+
+
+def print_table(rows, out=sys.stdout):
+    header = f"{'mode':>12} {'players':>7} {'calls/game':>10} {'rounds':>6} {'setup p50':>9} {'setup p99':>9} {'round p50':>9} {'round p99':>9}"
+    print(header, file=out)
+    for row in rows:
+        print(
+            f"{row['speech_mode']:>12} {row['players']:>7} {row['calls_per_game']:>10.1f} {row['rounds_per_game']:>6.1f} "
+            f"{row['setup_p50']:>9.3f} {row['setup_p99']:>9.3f} {row['round_p50']:>9.3f} {row['round_p99']:>9.3f}",
+            file=out,
+        )
+        for phase in row["phases"]:
+            print(
+                f"{'':>12} {'':>7} {phase['phase']:>10} calls={phase['calls']} p50={phase['latency_p50']:.3f}s "
+                f"p95={phase['latency_p95']:.3f}s ttft={phase['ttft_mean']:.3f}s retries={phase['retries']}",
+                file=out,
+            )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="谁是卧底 端到端延迟压测")
+    parser.add_argument("--players", default="2-10", help="玩家数，如 2-10 或 3,6,10")
+    parser.add_argument("--games", type=int, default=3, help="每个玩家数跑的局数")
+    parser.add_argument("--max-rounds", type=int, default=DEFAULT_MAX_ROUNDS)
+    parser.add_argument("--stream", action="store_true", help="使用流式请求")
+    parser.add_argument("--vote-concurrency", type=int, default=5)
+    parser.add_argument("--vote-mode", default="text", choices=VOTE_MODES, help="投票方式")
+    parser.add_argument("--vote-short-circuit", action="store_true", help="本轮结果确定后停止收集剩余投票")
+    parser.add_argument("--speech-modes", default="sequential",
+                        help=f"发言方式，逗号分隔，可选 {','.join(SPEECH_MODES)}（多种时输出相对 sequential 的加速比）")
+    parser.add_argument("--render-delay", type=float, default=0.0, help="模拟界面展示一条完整回答的耗时(秒)")
+    parser.add_argument("--api-base", help="使用已有的接口地址，不启动内置模拟服务")
+    parser.add_argument("--model", default=None)
+    parser.add_argument("--latency", default="fixed:0.2", help="内置模拟服务的首token延迟分布")
+    parser.add_argument("--token-rate", type=float, default=50.0, help="内置模拟服务的生成速度(token/秒)")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="内置模拟服务的错误注入概率")
+    parser.add_argument("--bad-vote-rate", type=float, default=0.0, help="内置模拟服务的不规范投票注入概率")
+    parser.add_argument("--output", help="结果JSON输出路径")
+    args = parser.parse_args(argv)
+    speech_modes = [mode.strip() for mode in args.speech_modes.split(",") if mode.strip()]
+    for mode in speech_modes:
+        if mode not in SPEECH_MODES:
+            parser.error(f"未知的发言方式: {mode}，可选 {SPEECH_MODES}")
+
+    game_kwargs = {"stream": args.stream, "vote_concurrency": args.vote_concurrency,
+                   "vote_mode": args.vote_mode, "vote_short_circuit": args.vote_short_circuit}
+    if args.render_delay:
+        game_kwargs["reporter"] = RenderDelayReporter(args.render_delay)
+    server = None
+    if args.api_base:
+        game_engine.configure_api(api_base=args.api_base, model=args.model)
+    else:
+        server = MockLLMServer(MockLLM(latency=args.latency, token_rate=args.token_rate, error_rate=args.error_rate,
+                                       bad_vote_rate=args.bad_vote_rate)).start()
+        game_engine.configure_api(api_base=server.api_base, model=args.model or "mock-chat", api_key="mock")
+
+    try:
+        rows = []
+        for speech_mode in speech_modes:
+            for num_players in parse_players(args.players):
+                row = bench_player_count(num_players, args.games, {**game_kwargs, "speech_mode": speech_mode}, args.max_rounds)
+                rows.append({"speech_mode": speech_mode, **row})
+                print_table(rows[-1:], out=sys.stderr)
+    finally:
+        if server is not None:
+            server.stop()
+
+    print_table(rows)
+    speedups = speech_mode_speedups(rows) if len(speech_modes) > 1 else []
+    for row in speedups:
+        print(f"{row['speech_mode']:>12} {row['players']:>7} players: first round {row['first_round_mean']:.3f}s, "
+              f"speedup x{row['speedup']:.2f}")
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({"config": vars(args), "results": rows, "speedups": speedups}, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,120 @@
+"""
+每个AI角色的上下文策略：决定每次请求实际发送哪些历史消息。
+
+对话历史（Game.conversations）始终完整保存，供界面查看；策略只影响发给模型的消息。
+- FullHistoryPolicy ：原样发送全部历史（默认，与原先行为一致）
+- WindowPolicy      ：保留 system prompt 和最近 N 轮原文，更早的轮次折叠成一段结构化摘要
+                      （谁说了什么、谁投了谁、谁被淘汰），或直接丢弃
+
+每条历史消息带有 "round" 字段（0 表示开局阶段），策略据此划分轮次；
+发送出去的消息只保留 role/content。
+"""
+import re
+
+# 中日韩字符大致按1个token计，其余字符大致按4个字符1个token计
+_CJK_PATTERN = re.compile(r"[　-〿㐀-鿿＀-￯]")
+
+
+def estimate_tokens(text):
+    """
+    粗略估算一段文本的token数（不依赖分词器，用于比较不同策略的相对开销）。
+    """
+    cjk = len(_CJK_PATTERN.findall(text))
+    return cjk + (len(text) - cjk + 3) // 4
+
+
+def count_message_tokens(messages):
+    """
+    估算一组消息的token数（每条消息额外计4个token的格式开销）。
+    """
+    return sum(estimate_tokens(m["content"]) + 4 for m in messages)
+
+
+def strip_message(message):
+    """只保留接口需要的 role/content 字段。"""
+    return {"role": message["role"], "content": message["content"]}
+
+
+class FullHistoryPolicy:
+    """原样发送全部历史。"""
+
+    name = "full"
+
+    def build(self, conversation, game):
+        return [strip_message(m) for m in conversation]
+
+
+class WindowPolicy:
+    """
+    保留开局阶段（round 0，含 system prompt）和最近 keep_rounds 轮的原文；
+    更早的轮次：
+    - fold="digest"：折叠为一条结构化摘要（由 Game 的公开记录生成，不额外调用模型）
+    - fold="drop"  ：直接丢弃
+    speech_chars 限制摘要中每条发言保留的字数。
+    """
+
+    def __init__(self, keep_rounds=2, fold="digest", speech_chars=60):
+        if fold not in ("digest", "drop"):
+            raise ValueError(f"未知的折叠方式: {fold}")
+        self.keep_rounds = keep_rounds
+        self.fold = fold
+        self.speech_chars = speech_chars
+
+    @property
+    def name(self):
+        return f"window{self.keep_rounds}-{self.fold}"
+
+    def build(self, conversation, game):
+        first_kept_round = game.round_index - self.keep_rounds + 1
+        head = [strip_message(m) for m in conversation if m.get("round", 0) == 0]
+        recent = [strip_message(m) for m in conversation if m.get("round", 0) >= max(first_kept_round, 1)]
+        folded_rounds = list(range(1, first_kept_round))
+        if not folded_rounds or self.fold == "drop":
+            return head + recent
+        digest = build_round_digest(game, folded_rounds, self.speech_chars)
+        return head + [{"role": "user", "content": digest}] + recent
+
+
+def build_round_digest(game, rounds, speech_chars=60):
+    """
+    把若干已结束轮次的公开信息整理成一段紧凑摘要：每轮的发言、投票和淘汰结果。
+    """
+    votes_by_round = {record["round"]: record for record in game.vote_history}
+    lines = ["【早前轮次摘要】"]
+    for round_no in rounds:
+        lines.append(f"第{round_no}轮")
+        speeches = game.transcripts.speeches(round_no)
+        if speeches:
+            lines.append("发言: " + " | ".join(
+                f"{speaker}: {_shorten(text, speech_chars)}" for speaker, text in speeches
+            ))
+        record = votes_by_round.get(round_no)
+        if record:
+            lines.append("投票: " + ", ".join(
+                f"{voter}->{target or '无效'}" for voter, target in record["votes"].items()
+            ))
+            lines.append(f"淘汰: {record['eliminated'] or '无'}")
+    return "\n".join(lines)
+
+
+def _shorten(text, limit):
+    text = " ".join(text.split())
+    return text if len(text) <= limit else text[:limit] + "…"
+
+
+def compare_policies(game, policies):
+    """
+    按当前对局状态，估算每种策略下“所有角色下一次请求”的总token数以及相对完整历史节省的数量。
+    返回 {策略名: {"tokens": ..., "saved": ..., "saved_ratio": ...}}。
+    """
+    full_tokens = sum(count_message_tokens(conv) for conv in game.conversations.values())
+    report = {}
+    for policy in policies:
+        tokens = sum(count_message_tokens(policy.build(conv, game)) for conv in game.conversations.values())
+        saved = full_tokens - tokens
+        report[policy.name] = {
+            "tokens": tokens,
+            "saved": saved,
+            "saved_ratio": saved / full_tokens if full_tokens else 0.0,
+        }
+    return report
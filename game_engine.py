@@ -0,0 +1,1327 @@
+"""
+谁是卧底 游戏引擎（不依赖Streamlit）。
+
+Game 对象持有一局游戏的全部状态和流程；界面相关的输出全部通过 reporter 回调，
+因此既可以由 Streamlit 界面驱动，也可以在批量模拟等无界面场景下直接运行。
+"""
+import difflib
+import json
+import os
+import queue
+import re
+import random
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from context_policy import FullHistoryPolicy, count_message_tokens
+from llm_cache import CacheMiss
+from llm_client import LLMClient, LLMError, classify_error
+from metrics import MetricsCollector
+from scheduler import RequestCancelled
+import names
+import prompts
+
+# 本模块不在导入时加载 openai / requests / faker：openai 在第一次真正请求接口时才导入
+# （见 llm_client.load_openai），名字默认来自 names 中的名字表，批量模拟的工作进程和回放都能快速启动。
+
+# 如果你在环境变量里设了OPENAI_API_KEY，此处留空或省略即可
+API_KEY = os.getenv("OPENAI_API_KEY", "xxxxxxx")
+# (可选) 如果需要走代理/自定义 Endpoint，设置环境变量 OPENAI_API_BASE / OPENAI_MODEL，或调用 configure_api
+API_BASE = os.getenv("OPENAI_API_BASE", "https://api.deepseek.com/v1")
+MODEL = os.getenv("OPENAI_MODEL", "deepseek-chat")
+
+# 默认生成参数
+DEFAULT_GENERATION_PARAMS = {
+    "temperature": 0.7,
+    "top_p": 1.0,
+    "presence_penalty": 0.0,
+    "frequency_penalty": 0.0,
+}
+
+def configure_api(api_base=None, model=None, api_key=None):
+    """
+    修改接口地址、模型名和API Key（为 None 的参数保持不变）。
+    例如指向本地的 mock_llm_server 做离线压测。
+    """
+    global API_BASE, MODEL, API_KEY
+    if api_base:
+        API_BASE = api_base.rstrip("/")
+    if model:
+        MODEL = model
+    if api_key:
+        API_KEY = api_key
+
+# 请求客户端（连接池 + 重试 + 限速），所有游戏和角色共用
+_client = LLMClient(
+    rate=float(os.getenv("LLM_RATE_LIMIT")) if os.getenv("LLM_RATE_LIMIT") else None,
+).install()
+
+def configure_client(client):
+    """
+    替换 generate_reply 使用的请求客户端（例如调整重试次数、限速或截止时间）。
+    """
+    global _client
+    _client = client.install()
+
+# 回答缓存（llm_cache.LLMCache），为 None 时不使用缓存
+_cache = None
+
+def configure_cache(cache):
+    """
+    设置 generate_reply 使用的回答缓存；传入 None 关闭缓存。
+    """
+    global _cache
+    _cache = cache if cache is not None and cache.enabled else None
+
+# 请求调度器（scheduler.RequestScheduler），为 None 时不排队，直接请求
+_scheduler = None
+
+def configure_scheduler(scheduler):
+    """
+    设置 generate_reply 使用的请求调度器（全局并发上限 + 会话间轮询）；传入 None 关闭。
+    """
+    global _scheduler
+    _scheduler = scheduler
+
+# on_token 返回该值表示接收被外部条件打断（如本轮投票结果已确定）：回答不完整，不写入缓存
+STREAM_CANCELLED = "cancelled"
+
+# ========== 全局工具函数 ==========
+
+def generate_reply(messages, params=None, on_token=None, on_call=None, session_id=None, model=None, cache=None):
+    """
+    调用OpenAI ChatCompletion接口，返回生成文本。
+    params 为生成参数字典: temperature, top_p, presence_penalty, frequency_penalty（可选 max_tokens）；
+    为 None 时使用 DEFAULT_GENERATION_PARAMS。model 为 None 时使用 configure_api 设置的 MODEL。
+    若给出 on_token，则以流式(stream=True)请求，每收到一段文本就调用 on_token(text)；
+    on_token 返回 True 表示后续内容已不需要，提前停止接收（已收到的部分仍是可复用的回答）；
+    返回 STREAM_CANCELLED 表示被外部打断，同样停止接收，但这条不完整的回答不写入缓存。
+    cache 为本次调用使用的回答缓存（如每局/每个会话自己的缓存），为 None 时使用 configure_cache 设置的缓存。
+    有缓存时：命中则直接返回缓存内容（流式模式下一次性交给 on_token），
+    未命中时在 replay 模式下抛出 CacheMiss（也是 LLMError），否则请求接口并把成功的回答写入缓存。
+    若给出 on_call，每次调用结束（成功、缓存命中或失败）后调用 on_call(call)，call 包含：
+    status(ok/cached/error) / latency / ttft / prompt_tokens / completion_tokens / cache_hit_tokens / retries /
+    queue_wait（在调度器中排队的秒数，已计入 latency）。
+    若已通过 configure_scheduler 设置调度器，缓存未命中的请求先以 session_id 排队，拿到名额后才发出；
+    排队时间计入请求客户端的 call_deadline，排队到期时抛出 LLMTimeoutError。
+    请求经 llm_client 重试后仍失败时抛出 LLMError 的子类（失败的回答不会写入缓存）；
+    会话被调度器取消时抛出 scheduler.RequestCancelled（也是 LLMError，但 Game 不把它当作失败的请求：
+    它会一直抛出到 run_one_round 之外，本轮保持未结束，之后可以继续）。
+    """
+    params = {**DEFAULT_GENERATION_PARAMS, **(params or {})}
+    model = model or MODEL
+    call = {
+        "status": "ok", "latency": 0.0, "ttft": None,
+        "prompt_tokens": 0, "completion_tokens": 0, "cache_hit_tokens": 0, "retries": 0, "queue_wait": 0.0,
+    }
+    start = time.perf_counter()
+    try:
+        cache = cache or _cache
+        if cache is not None and not cache.enabled:
+            cache = None
+        cache_key = None
+        if cache is not None:
+            cache_key = cache.make_key(model, messages, params)
+            cached = cache.get(cache_key)
+            if cached is not None:
+                call["status"] = "cached"
+                if on_token is not None:
+                    on_token(cached)
+                return cached
+            if cache.mode == "replay":
+                call["status"] = "error"
+                raise CacheMiss(f"回放模式下缓存未命中: {cache_key}")
+        scheduler = _scheduler
+        ticket = None
+        # 截止时间从排队开始计算（含排队、限流等待和全部重试）
+        deadline = time.monotonic() + _client.call_deadline
+        try:
+            if scheduler is not None:
+                ticket = scheduler.acquire(session_id, deadline)
+                call["queue_wait"] = time.perf_counter() - start
+            reply_text, cancelled = _request_reply(messages, params, model, on_token, call, start, deadline)
+        except LLMError as e:
+            call["status"] = "error"
+            call["retries"] = e.retries
+            raise
+        finally:
+            if ticket is not None:
+                scheduler.release(ticket)
+        if cache is not None and not cancelled:
+            cache.put(cache_key, reply_text)
+        return reply_text
+    finally:
+        call["latency"] = time.perf_counter() - start
+        if call["ttft"] is None:
+            # 非流式请求（以及缓存命中/失败）的首token时间即整体耗时
+            call["ttft"] = call["latency"]
+        if on_call is not None:
+            on_call(call)
+
+def _request_reply(messages, params, model, on_token, call, start, deadline=None):
+    """
+    实际请求ChatCompletion接口，返回 (去掉首尾空白的回答文本, 是否被 on_token 以 STREAM_CANCELLED 打断)；
+    deadline 为整个调用的截止时间。
+    用量、重试次数和首token时间写入 call。
+    """
+    extra_kwargs = {}
+    if params.get("max_tokens"):
+        extra_kwargs["max_tokens"] = params["max_tokens"]
+    if on_token is not None:
+        # 流式模式下请接口在最后一个分片中附带用量
+        extra_kwargs.update(stream=True, stream_options={"include_usage": True})
+    response, retries = _client.create(
+        deadline=deadline,
+        model=model,
+        api_base=API_BASE,
+        api_key=API_KEY,
+        messages=messages,
+        temperature=params["temperature"],
+        top_p=params["top_p"],
+        presence_penalty=params["presence_penalty"],
+        frequency_penalty=params["frequency_penalty"],
+        **extra_kwargs,
+    )
+    call["retries"] = retries
+    if on_token is None:
+        if response.get("usage"):
+            call.update(normalize_usage(response["usage"]))
+        return response.choices[0].message.content.strip(), False
+    pieces = []
+    cancelled = False
+    chunks = iter(response)
+    while True:
+        # 只把接收分片时的异常当作请求失败；on_token（解析器、界面）本身的异常原样抛出
+        try:
+            chunk = next(chunks, None)
+        except Exception as e:
+            # 已经开始输出的流无法透明重试，直接交给上层处理
+            error = classify_error(e)
+            error.retries = retries
+            raise error from e
+        if chunk is None:
+            break
+        if chunk.get("usage"):
+            call.update(normalize_usage(chunk["usage"]))
+        if not chunk.get("choices"):
+            continue
+        text = chunk["choices"][0]["delta"].get("content") or ""
+        if not text:
+            continue
+        if not pieces:
+            call["ttft"] = time.perf_counter() - start
+        pieces.append(text)
+        stop = on_token(text)
+        if stop:
+            cancelled = stop == STREAM_CANCELLED
+            break
+    return "".join(pieces).strip(), cancelled
+
+def normalize_usage(usage):
+    """
+    统一接口返回的用量字段：prompt_tokens / completion_tokens / cache_hit_tokens。
+    DeepSeek 使用 prompt_cache_hit_tokens，OpenAI 使用 prompt_tokens_details.cached_tokens。
+    """
+    cache_hit = usage.get("prompt_cache_hit_tokens")
+    if cache_hit is None:
+        cache_hit = (usage.get("prompt_tokens_details") or {}).get("cached_tokens", 0)
+    return {
+        "prompt_tokens": usage.get("prompt_tokens", 0) or 0,
+        "completion_tokens": usage.get("completion_tokens", 0) or 0,
+        "cache_hit_tokens": cache_hit or 0,
+    }
+
+def extract_think_and_public(text):
+    """
+    从文本中提取 <think>...</think> (私有思考) 和公开部分。
+    若未匹配到<think>，则返回 (None, text)。
+    """
+    pattern = r"<think>(.*?)</think>"
+    match = re.search(pattern, text, re.DOTALL)
+    if match:
+        private_thoughts = match.group(1).strip()
+        public_text = re.sub(pattern, "", text, count=1, flags=re.DOTALL).strip()
+        return private_thoughts, public_text
+    else:
+        return None, text
+
+def parse_vote_from_text(public_text):
+    """
+    固定投票格式: 在公开文本中使用 `###Vote: 某某玩家` 或 `###Vote: None`
+    若没找到则返回 None
+    """
+    pattern = r"^###Vote:\s*(.+)$"
+    lines = public_text.splitlines()
+    for line in lines:
+        line = line.strip()
+        m = re.match(pattern, line, re.IGNORECASE)
+        if m:
+            return m.group(1)
+    return None
+
+# 投票模式："text" 解析 `###Vote:` 行；"json" 为结构化投票（JSON + 姓名模糊匹配 + 解析失败时追问一次）
+VOTE_MODES = ("text", "json")
+# 结构化投票追问时的最大生成长度（只需要一行JSON）
+VOTE_REASK_MAX_TOKENS = 64
+# 表示弃权的投票值（不区分大小写）
+ABSTAIN_VOTES = {"none", "null", "弃权", "无", ""}
+
+def parse_vote_json(public_text):
+    """
+    结构化投票：从公开文本中找出最后一个含 "vote" 的JSON对象，返回其中的投票值（字符串）；
+    {"vote": null} 返回 "None"（与 `###Vote: None` 一致，表示弃权）。
+    JSON不合法时（如单引号、缺引号）按 vote: xxx 宽松匹配；都没找到则返回 None。
+    """
+    for candidate in reversed(re.findall(r"\{[^{}]*\}", public_text)):
+        if "vote" not in candidate.lower():
+            continue
+        try:
+            data = json.loads(candidate)
+        except ValueError:
+            m = re.search(r"vote['\"]?\s*[:：]\s*['\"“]?([^'\"”},]*)", candidate, re.IGNORECASE)
+            if m:
+                return m.group(1).strip() or "None"
+            continue
+        if isinstance(data, dict):
+            vote = next((value for key, value in data.items() if key.lower() == "vote"), None)
+            return "None" if vote is None else str(vote).strip()
+    return None
+
+# 投票文本中要去掉的引号、括号和Markdown标记
+_VOTE_MARKUP = re.compile(r"[`*_\"'“”‘’「」《》()（）\[\]【】]")
+# 角色名的固定前缀（已按上面的规则规范化），模糊匹配拼写错误时不参与比较
+_ROLE_PREFIX = re.compile(r"^(player|gm)")
+
+def resolve_vote_target(raw, candidates):
+    """
+    把模型写出的投票对象模糊匹配到 candidates（存活玩家姓名）中的一个，匹配不到返回 None：
+    1) 去掉引号、括号、Markdown标记和末尾标点后精确匹配（忽略大小写和空白）
+    2) 唯一一个候选姓名出现在投票文本中（如 “我投给张伟”），或投票文本是唯一一个候选姓名的一部分（如只写了名）
+    3) 字形最相近且足够相似（difflib，相似度 ≥ 0.75）的候选（拼写错误）；比较时去掉 Player_/GM_ 前缀，
+       否则所有姓名共有的前缀会抬高相似度，把投给已淘汰玩家的票匹配到名字相近的存活玩家
+    """
+    if not raw:
+        return None
+    text = _VOTE_MARKUP.sub("", raw).strip().rstrip("。.，,！!")
+    if text.lower() in ABSTAIN_VOTES:
+        return None
+    # 候选姓名按同样的规则去掉标记字符（Player_ 中的下划线也会被去掉），两边才能精确比较
+    normalized = {re.sub(r"\s+", "", _VOTE_MARKUP.sub("", name)).casefold(): name for name in candidates}
+    key = re.sub(r"\s+", "", text).casefold()
+    if key in normalized:
+        return normalized[key]
+    contained = [name for norm, name in normalized.items() if norm in key]
+    if len(contained) == 1:
+        return contained[0]
+    if len(key) >= 2:
+        partial = [name for norm, name in normalized.items() if key in norm]
+        if len(partial) == 1:
+            return partial[0]
+    bare = {_ROLE_PREFIX.sub("", norm): name for norm, name in normalized.items()}
+    close = difflib.get_close_matches(_ROLE_PREFIX.sub("", key), list(bare), n=1, cutoff=0.75)
+    return bare[close[0]] if close else None
+
+def is_abstain_vote(raw):
+    """投票值表示明确弃权（而不是解析失败）。"""
+    return raw is not None and raw.strip().strip("`*").lower() in ABSTAIN_VOTES
+
+# ========== 流式解析 ==========
+
+class ThinkStreamParser:
+    """
+    流式输出的增量解析器：
+    - <think>...</think> 之内的文本实时交给 on_private，其余文本实时交给 on_public；
+    - 公开部分中一旦出现完整的 `###Vote: ...` 行，立即调用一次 on_vote(目标)。
+    标签可能被拆在多个片段之间，因此可能是标签前缀的尾部会先缓存，确定后再输出。
+    实时路由只用于展示；最终的思考/公开文本仍以 extract_think_and_public 对全文的解析为准。
+    stop_on_vote=True 时，feed 在解析到投票行后返回 True，通知调用方提前结束接收。
+    parse_vote 为逐行解析投票的函数（默认 `###Vote:` 行，结构化投票时为 parse_vote_json）。
+    """
+
+    OPEN_TAG = "<think>"
+    CLOSE_TAG = "</think>"
+
+    def __init__(self, on_private=None, on_public=None, on_vote=None, stop_on_vote=False, parse_vote=None):
+        self.on_private = on_private
+        self.on_public = on_public
+        self.on_vote = on_vote
+        self.stop_on_vote = stop_on_vote
+        self.parse_vote = parse_vote or parse_vote_from_text
+        self.text = ""
+        self.vote = None
+        self._pending = ""
+        self._in_think = False
+        self._think_done = False
+        self._line = ""
+
+    def feed(self, chunk):
+        """
+        输入一段新文本。返回 True 表示可以提前结束接收。
+        """
+        self.text += chunk
+        self._pending += chunk
+        while self._pending:
+            tag = self.CLOSE_TAG if self._in_think else self.OPEN_TAG
+            if self._think_done:
+                self._emit(self._pending)
+                self._pending = ""
+                break
+            pos = self._pending.find(tag)
+            if pos >= 0:
+                self._emit(self._pending[:pos])
+                self._pending = self._pending[pos + len(tag):]
+                if self._in_think:
+                    self._think_done = True
+                self._in_think = not self._in_think
+                continue
+            # 保留可能是标签开头的尾部，其余部分可以安全输出
+            keep = 0
+            for n in range(min(len(tag) - 1, len(self._pending)), 0, -1):
+                if tag.startswith(self._pending[-n:]):
+                    keep = n
+                    break
+            self._emit(self._pending[:len(self._pending) - keep])
+            self._pending = self._pending[len(self._pending) - keep:]
+            break
+        return self.stop_on_vote and self.vote is not None
+
+    def close(self):
+        """
+        输入结束：输出缓存的尾部，并检查最后一行（没有换行结尾）是否为投票行。
+        """
+        if self._pending:
+            self._emit(self._pending)
+            self._pending = ""
+        self._check_vote_line(self._line)
+        self._line = ""
+
+    def _emit(self, text):
+        if not text:
+            return
+        if self._in_think:
+            if self.on_private:
+                self.on_private(text)
+            return
+        if self.on_public:
+            self.on_public(text)
+        self._line += text
+        while "\n" in self._line:
+            line, self._line = self._line.split("\n", 1)
+            self._check_vote_line(line)
+
+    def _check_vote_line(self, line):
+        if self.vote is not None:
+            return
+        target = self.parse_vote(line)
+        if target:
+            self.vote = target
+            if self.on_vote:
+                self.on_vote(target)
+
+# ========== 界面回调 ==========
+
+class NullReporter:
+    """
+    默认的界面回调：什么都不显示。
+    界面层（如Streamlit）可实现同名方法来展示游戏过程。
+    """
+
+    def reply(self, title, text):
+        """展示一条完整的AI回答（含<think>）"""
+
+    def stream_reply(self, title):
+        """
+        开始展示一条流式回答，返回一个接收器：
+        需提供 private(text) / public(text) / vote(target) / close(full_text) 四个方法。
+        """
+        return NullStreamSink()
+
+    def markdown(self, text):
+        """展示一条普通说明"""
+
+    def info(self, text):
+        """展示提示信息"""
+
+    def warning(self, text):
+        """展示警告信息"""
+
+    def success(self, text):
+        """展示成功信息"""
+
+class NullStreamSink:
+    """默认的流式接收器：丢弃所有内容。"""
+
+    def private(self, text):
+        """追加一段私有思考"""
+
+    def public(self, text):
+        """追加一段公开发言"""
+
+    def vote(self, target):
+        """解析到投票目标"""
+
+    def close(self, full_text):
+        """流式输出结束，full_text 为完整回答"""
+
+class QueuedReporter:
+    """
+    把界面回调排进队列，由主线程（Streamlit 只能在主线程渲染）调用 drain 时按原顺序交给 reporter。
+    工作线程通过它输出时不必等待界面渲染；工作线程调用 close 后，drain 处理完剩余回调即返回。
+    """
+
+    _CLOSED = object()
+
+    def __init__(self, reporter):
+        self.reporter = reporter
+        self._queue = queue.Queue()
+
+    def reply(self, title, text):
+        self._queue.put(lambda: self.reporter.reply(title, text))
+
+    def stream_reply(self, title):
+        sink = QueuedStreamSink(self._queue)
+        self._queue.put(lambda: sink.attach(self.reporter.stream_reply(title)))
+        return sink
+
+    def markdown(self, text):
+        self._queue.put(lambda: self.reporter.markdown(text))
+
+    def info(self, text):
+        self._queue.put(lambda: self.reporter.info(text))
+
+    def warning(self, text):
+        self._queue.put(lambda: self.reporter.warning(text))
+
+    def success(self, text):
+        self._queue.put(lambda: self.reporter.success(text))
+
+    def close(self):
+        """不再有新的回调（由工作线程在结束时调用）。"""
+        self._queue.put(self._CLOSED)
+
+    def drain(self):
+        """在主线程中依次执行排队的回调，直到 close。"""
+        while True:
+            callback = self._queue.get()
+            if callback is self._CLOSED:
+                return
+            callback()
+
+class QueuedStreamSink:
+    """QueuedReporter.stream_reply 返回的接收器：各方法排队，到主线程后交给真正的接收器。"""
+
+    def __init__(self, callbacks):
+        self._callbacks = callbacks
+        self._sink = None
+
+    def attach(self, sink):
+        self._sink = sink
+
+    def private(self, text):
+        self._callbacks.put(lambda: self._sink.private(text))
+
+    def public(self, text):
+        self._callbacks.put(lambda: self._sink.public(text))
+
+    def vote(self, target):
+        self._callbacks.put(lambda: self._sink.vote(target))
+
+    def close(self, full_text):
+        self._callbacks.put(lambda: self._sink.close(full_text))
+
+# ========== 游戏引擎 ==========
+
+# 发言方式（见 Game.do_speak_all）："sequential" 依次发言；"pipelined" 规则相同，下一位的请求不等上一位的界面展示；
+# "simultaneous" 为规则变体：所有玩家同时发言，只能看到之前轮次的内容
+SPEECH_MODES = ("sequential", "pipelined", "simultaneous")
+
+class Game:
+    """
+    一局谁是卧底游戏。
+    状态字段与原先 st.session_state 中的同名字段一一对应：
+    agent_names / conversations / public_messages / active_players / round_index /
+    spy_index / normal_word / spy_word / winner / public_chat_history。
+
+    所有状态变化都通过 emit(事件) 完成：先追加写入事件日志（game_log.GameLog，可选），
+    再由 apply_event 更新内存中的状态。Game.load 按顺序重放事件即可重建一局。
+    """
+
+    def __init__(self, params=None, vote_concurrency=5, reporter=None, stream=False, seed=None,
+                 context_policy=None, word_pool=None, event_log=None, seat_configs=None,
+                 vote_mode="text", vote_short_circuit=False, speech_mode="sequential", cache=None,
+                 model=None, owner=None):
+        if vote_mode not in VOTE_MODES:
+            raise ValueError(f"未知的投票模式: {vote_mode}，可选 {VOTE_MODES}")
+        if speech_mode not in SPEECH_MODES:
+            raise ValueError(f"未知的发言方式: {speech_mode}，可选 {SPEECH_MODES}")
+        self.game_id = uuid.uuid4().hex
+        # 事件日志（game_log.GameLog），为 None 时只在内存中运行
+        self.event_log = event_log
+        # 所有者标识（如创建该局的页面），开局时记入事件日志的对局摘要
+        self.owner = owner
+        self._event_seq = 0
+        self._event_lock = threading.Lock()
+        # 种子模式：固定 seed 时，玩家名字和卧底位置都由 seed 决定（配合缓存回放可完整复现一局）
+        self.seed = seed
+        self.rng = random.Random(seed) if seed is not None else None
+        # 上下文策略：默认发送完整历史；context_policies 可按角色名单独覆盖
+        self.context_policy = context_policy or FullHistoryPolicy()
+        self.context_policies = {}
+        # 上下文统计：{角色名: {"calls", "full_tokens", "sent_tokens"}}
+        self.context_stats = {}
+        self.params = {**DEFAULT_GENERATION_PARAMS, **(params or {})}
+        # 本局使用的模型，为 None 时使用 configure_api 设置的全局模型
+        self.model = model
+        # 按座位（玩家下标 1~N）覆盖的设置：{idx: {"model", "params", "prompt_variant"}}，用于锦标赛对比
+        self.seat_configs = seat_configs or {}
+        # 并发请求数：投票，以及同时发言（speech_mode="simultaneous"）时的发言
+        self.vote_concurrency = vote_concurrency
+        # 投票模式（见 VOTE_MODES）；vote_short_circuit：本轮结果已确定后不再收集剩余投票
+        self.vote_mode = vote_mode
+        self.vote_short_circuit = vote_short_circuit
+        # 发言方式（见 SPEECH_MODES）
+        self.speech_mode = speech_mode
+        self.reporter = reporter or NullReporter()
+        # 本局使用的回答缓存（llm_cache.LLMCache），为 None 时使用 configure_cache 设置的全局缓存
+        self.cache = cache
+        # 调度器中的会话标识（Streamlit 会话ID）：同一会话的请求在调度器中排同一个队列
+        self.session_id = None
+        # 流式模式：发言/生成词时边生成边展示，投票时解析到投票行即停止接收
+        self.stream = stream
+        # 预取词库（word_pool.WordPool）：AI GM模式下优先从中取词，为空时才请求GM生成
+        # 注意：词库的内容随使用变化，需要完整复现一局（种子+缓存回放）时不要传入
+        self.word_pool = word_pool
+
+        # 游戏控制
+        self.game_inited = False
+        self.game_over = False
+        self.num_players = 0
+
+        # 人员 & 对话
+        self.agent_names = []
+        self.conversations = {}      # {name: [ {role, content, round}, ...], ...}
+        self.public_messages = {}     # {name: "上一轮公开发言"}
+        self.active_players = []      # 当前存活玩家（仅玩家，下标 1~N）
+        self.round_index = 0
+
+        # 卧底/词汇
+        self.spy_index = None
+        self.normal_word = ""
+        self.spy_word = ""
+        # 词的来源："user" / "pool" / "gm" / "fallback"（解析失败使用默认词）
+        self.word_source = None
+
+        # 结果
+        self.winner = None
+
+        # 公共聊天记录（跨轮累积，列表[(speaker, public_text), ...]）
+        self.public_chat_history = []
+
+        # 每轮公开发言（全局共享、只追加，各玩家的对话引用其中的提示文本）
+        self.transcripts = prompts.RoundTranscripts()
+
+        # 每次请求的性能记录（耗时、token、前缀缓存命中、重试），见 call_recorder
+        self.metrics = MetricsCollector()
+
+        # 每轮投票记录，列表[{"round", "votes": {投票者: 目标或None}, "eliminated": 姓名或None}, ...]
+        self.vote_history = []
+
+    @classmethod
+    def load(cls, event_log, game_id, **kwargs):
+        """
+        从事件日志重放出一局游戏（kwargs 同构造函数，如 params / reporter / stream）；
+        日志中没有该局时返回 None。重放只重建状态，不会输出到界面，也不会再次导出性能记录。
+        """
+        events = event_log.events(game_id)
+        if not events:
+            return None
+        game = cls(event_log=event_log, **kwargs)
+        game.game_id = game_id
+        for seq, event_type, payload in events:
+            game.apply_event(event_type, payload, replay=True)
+        game._event_seq = events[-1][0] + 1
+        return game
+
+    def emit(self, event_type, **payload):
+        """
+        产生一条事件：先追加写入事件日志（若有），再更新内存中的状态。可在工作线程中调用。
+        另一个实例已推进同一局（序号冲突）时抛出 game_log.EventConflict，内存中的状态保持不变，
+        调用方应重新从日志加载。
+        """
+        with self._event_lock:
+            if self.event_log is not None:
+                if event_type == "round_start":
+                    round_no = payload["round"]
+                else:
+                    round_no = 0 if event_type == "setup" else self.round_index
+                self.event_log.append(self.game_id, self._event_seq, event_type, round_no, payload, owner=self.owner)
+            self.apply_event(event_type, payload)
+            self._event_seq += 1
+
+    def apply_event(self, event_type, payload, replay=False):
+        """
+        把一条事件应用到状态上（实时运行和从日志重放共用）：
+        - setup      ：{num_players, agent_names, seed} 重置状态并创建各角色
+        - message    ：{name, role, content} 向角色对话追加一条消息（归入当前轮）
+        - discard    ：{name} 撤回角色对话中最后一条未得到回答的User消息
+        - words      ：{normal_word, spy_word, word_source, spy_index}
+        - ready      ：{} 开局完成，全部玩家存活
+        - round_start：{round}
+        - speech     ：{speaker, text} 一条公开发言
+        - votes      ：{votes: {投票者: 目标或None}, eliminated: 姓名或None, skipped: [结果确定后未收集的投票者]}
+        - game_end   ：{winner}
+        - context    ：{name, full_tokens, sent_tokens} 一次请求的上下文token估算
+        - call       ：{record} 一次请求的性能记录（重放时不再转发给导出器）
+        """
+        if event_type == "setup":
+            self.game_inited = False
+            self.game_over = False
+            self.round_index = 0
+            self.num_players = payload["num_players"]
+            self.seed = payload.get("seed")
+            self.winner = None
+            self.public_chat_history = []
+            self.transcripts = prompts.RoundTranscripts()
+            self.vote_history = []
+            self.context_stats = {}
+            self.metrics = MetricsCollector()
+            self.agent_names = list(payload["agent_names"])
+            self.conversations = {name: [] for name in self.agent_names}
+            self.public_messages = {name: "" for name in self.agent_names}
+            self.spy_index = None
+            self.normal_word = ""
+            self.spy_word = ""
+            self.word_source = None
+            self.active_players = []
+        elif event_type == "message":
+            self.conversations[payload["name"]].append(
+                {"role": payload["role"], "content": payload["content"], "round": self.round_index}
+            )
+        elif event_type == "discard":
+            self.conversations[payload["name"]].pop()
+        elif event_type == "words":
+            self.normal_word = payload["normal_word"]
+            self.spy_word = payload["spy_word"]
+            self.word_source = payload["word_source"]
+            self.spy_index = payload["spy_index"]
+        elif event_type == "ready":
+            self.active_players = list(range(1, self.num_players + 1))
+            self.game_inited = True
+        elif event_type == "round_start":
+            self.round_index = payload["round"]
+            self.transcripts.start_round(self.round_index)
+        elif event_type == "speech":
+            speaker, text = payload["speaker"], payload["text"]
+            self.transcripts.add(self.round_index, speaker, text)
+            self.public_messages[speaker] = text
+            self.add_chat_record(speaker, text)
+        elif event_type == "votes":
+            self.vote_history.append({"round": self.round_index, "votes": payload["votes"], "eliminated": payload["eliminated"],
+                                      "skipped": payload.get("skipped", [])})
+            if payload["eliminated"] is not None:
+                self.active_players.remove(self.agent_names.index(payload["eliminated"]))
+        elif event_type == "game_end":
+            self.game_over = True
+            self.winner = payload["winner"]
+        elif event_type == "context":
+            stats = self.context_stats.setdefault(payload["name"], {"calls": 0, "full_tokens": 0, "sent_tokens": 0})
+            stats["calls"] += 1
+            stats["full_tokens"] += payload["full_tokens"]
+            stats["sent_tokens"] += payload["sent_tokens"]
+        elif event_type == "call":
+            self.metrics.add(payload["record"], export=not replay)
+        else:
+            raise ValueError(f"未知的事件类型: {event_type}")
+
+    def setup_game(self, num_players, word_option, user_normal_word="", user_spy_word="",
+                   word_category=None, word_difficulty=None):
+        """
+        初始化游戏逻辑：
+        1) 重置状态
+        2) 根据 word_option 使用用户提供词汇；AI GM模式下先从预取词库取词
+           （可按 word_category / word_difficulty 筛选），词库为空时才让AI GM生成(含<think>)
+        3) 随机指定1位玩家为卧底（注意：active_players只包含玩家，下标 1~num_players）
+        4) 给GM、卧底玩家、普通玩家分别下发 system prompt
+        5) 初始化 active_players
+        """
+        # 生成角色：GM + num_players个玩家，并重置状态、清空旧数据
+        # 一次抽取互不相同的名字（第一个给GM）
+        gm_raw_name, *player_names = names.sample_names(num_players + 1, self.rng)
+        gm_name = "GM_" + gm_raw_name
+        agent_names = [gm_name] + ["Player_" + name for name in player_names]
+        self.emit("setup", num_players=num_players, agent_names=agent_names, seed=self.seed)
+
+        # 处理词汇来源
+        pooled_pair = None
+        if word_option != "用户提供" and self.word_pool is not None:
+            pooled_pair = self.word_pool.take(word_category, word_difficulty)
+        if word_option == "用户提供":
+            normal_word, spy_word, word_source = user_normal_word.strip(), user_spy_word.strip(), "user"
+        elif pooled_pair is not None:
+            normal_word, spy_word, word_source = pooled_pair["normal_word"], pooled_pair["spy_word"], "pool"
+        else:
+            # AI GM自动生成词汇
+            self.append_message(gm_name, "system", prompts.GM_WORD_PROMPT.format(agent_name=gm_name))
+            self.append_message(gm_name, "user", prompts.GM_WORD_REQUEST)
+            try:
+                gm_reply_text = self.generate_shown(self.build_messages(gm_name), "[GM自动生成词] 完整回答(含<think>)", gm_name, "word-gen")
+                self.append_message(gm_name, "assistant", gm_reply_text)
+            except LLMError as e:
+                self.discard_pending_request(gm_name, "生成词", e)
+                gm_reply_text = ""
+            _, gm_public_text = extract_think_and_public(gm_reply_text)
+            pattern = r"normal_word\s*=\s*(.*?),\s*spy_word\s*=\s*(.*)$"
+            match = re.search(pattern, gm_public_text, re.IGNORECASE)
+            if match:
+                normal_word, spy_word, word_source = match.group(1).strip(), match.group(2).strip(), "gm"
+            else:
+                self.reporter.warning("未能解析出normal_word/spy_word，使用默认示例：苹果/梨子。")
+                normal_word, spy_word, word_source = "苹果", "梨子", "fallback"
+
+        # 随机指定一位玩家为卧底（注意：active_players只包含玩家，下标 1~num_players）
+        self.emit("words", normal_word=normal_word, spy_word=spy_word, word_source=word_source,
+                  spy_index=(self.rng or random).randint(1, num_players))
+
+        # 下发各角色的最终 system prompt（只追加：GM的生词对话保持在前，前缀不变）
+        # 玩家：先是全员相同的规则，再是各自的身份和词
+        rules_prompt = prompts.PLAYER_RULES_PROMPT.format(num_players=num_players,
+                                                          vote_format=prompts.VOTE_FORMATS[self.vote_mode])
+        for idx, name in enumerate(self.agent_names):
+            if idx == 0:
+                self.append_message(name, "system", prompts.GM_PROMPT.format(
+                    agent_name=name, num_players=num_players,
+                    spy_word=self.spy_word, normal_word=self.normal_word,
+                ))
+            else:
+                self.append_message(name, "system", rules_prompt)
+                variant = prompts.PROMPT_VARIANTS[self.seat_configs.get(idx, {}).get("prompt_variant", "default")]
+                if idx == self.spy_index:
+                    self.append_message(name, "system", variant["spy"].format(agent_name=name, word=self.spy_word))
+                else:
+                    self.append_message(name, "system", variant["normal"].format(agent_name=name, word=self.normal_word))
+
+        # 初始化 active_players（仅玩家，下标 1~num_players），可以开始第一轮
+        self.emit("ready")
+
+        self.reporter.success(f"游戏已创建：1位GM + {num_players}位玩家，其中1位是卧底。")
+
+    def run_one_round(self):
+        """
+        每一轮游戏流程：
+        1) 存活玩家发言（默认依次发言、本轮发言的上下文累积；见 do_speak_all）
+        2) 存活玩家统一投票（基于本轮所有发言）
+        3) 根据投票结果淘汰一人，并检查游戏是否结束
+        会话被调度器取消（页面关闭）时 RequestCancelled 直接抛出：本轮不记为结束，之后可从中断处继续。
+        """
+        if not self.game_inited:
+            self.reporter.warning("游戏尚未初始化，请先点击“开始游戏(重置)”")
+            return
+        if self.game_over:
+            self.reporter.warning("游戏已结束，请点击“开始游戏(重置)”重新开始")
+            return
+
+        spoken = set()
+        if self.round_index > 0 and not self.is_round_finished(self.round_index):
+            # 上次中断的一轮（页面刷新/服务重启后恢复）：撤回没有得到回答的请求，从尚未发言的玩家继续
+            for name in self.agent_names:
+                conversation = self.conversations[name]
+                if conversation and conversation[-1]["role"] == "user" and conversation[-1]["round"] == self.round_index:
+                    self.emit("discard", name=name)
+            spoken = {speaker for speaker, _ in self.transcripts.speeches(self.round_index)}
+            self.reporter.info(f"继续进行中断的第{self.round_index}轮")
+        else:
+            # 本轮发言记录在共享的 transcripts 中，后面的玩家可看到前面玩家的发言
+            self.emit("round_start", round=self.round_index + 1)
+
+        # 让所有存活玩家发言（请求失败的玩家本轮不发言）
+        self.do_speak_all([idx for idx in self.active_players if self.agent_names[idx] not in spoken])
+
+        # 让所有存活玩家基于本轮全部发言并发投票（结果按存活顺序展示）
+        votes_map = self.do_vote_all(self.active_players)
+
+        # 根据投票结果进行淘汰
+        eliminated = self.do_elimination(votes_map)
+        self.emit(
+            "votes",
+            votes={self.agent_names[idx]: target for idx, target in votes_map.items()},
+            eliminated=self.agent_names[eliminated] if eliminated is not None else None,
+            skipped=[self.agent_names[idx] for idx in self.active_players if idx not in votes_map],
+        )
+        self.check_game_end(eliminated)
+
+    def do_speak_all(self, player_indices):
+        """
+        让多位玩家发言，并把每条公开发言记入本轮记录。发言方式由 speech_mode 决定：
+        - sequential   ：依次发言，每位玩家看到本轮前面玩家的发言
+        - pipelined    ：规则同 sequential，请求在工作线程中依次发出：上一位的回答一结束（公开发言已确定）
+                         下一位的请求就发出，上一位的界面展示由主线程同时进行，不在关键路径上
+        - simultaneous ：所有玩家同时发言，只看到之前轮次的内容（并发数由 vote_concurrency 限制）
+        """
+        if self.speech_mode == "simultaneous":
+            self.do_speak_simultaneous(player_indices)
+            return
+        if self.speech_mode == "sequential":
+            for idx in player_indices:
+                self.speak_and_record(idx)
+            return
+
+        queued = QueuedReporter(self.reporter)
+        # 主线程的展示中断时（如 Streamlit 在界面调用中抛出 RerunException/StopException）置位：
+        # 工作线程不再让后面的玩家发言，退出 with 时不必等整个发言阶段结束，也不再发出请求
+        abandoned = threading.Event()
+
+        def speak_all():
+            try:
+                for idx in player_indices:
+                    if abandoned.is_set():
+                        break
+                    self.speak_and_record(idx, queued)
+            finally:
+                queued.close()
+
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            future = executor.submit(speak_all)
+            try:
+                queued.drain()
+            finally:
+                abandoned.set()
+            future.result()
+
+    def speak_and_record(self, player_idx, reporter=None):
+        """发言并保存到本轮记录（同时更新该玩家的最新公开发言和公共聊天记录）；请求失败时本轮不发言。"""
+        public_msg = self.do_speak(player_idx, reporter)
+        if public_msg is not None:
+            self.emit("speech", speaker=self.agent_names[player_idx], text=public_msg)
+
+    def do_speak(self, player_idx, reporter=None):
+        """
+        让编号 player_idx 的角色发言 (含<think>)。
+        其User消息中包含本轮已发言玩家的公开发言（来自共享的 transcripts）。
+        reporter 默认为 self.reporter（流水线发言时为工作线程使用的 QueuedReporter）。
+        返回公开发言；请求最终失败时返回 None。
+        """
+        name = self.agent_names[player_idx]
+        self.append_message(name, "user", self.transcripts.speak_prompt(self.round_index))
+        try:
+            reply_text = self.generate_shown(self.build_messages(name), f"{name} 发言 (含<think>) - 第{self.round_index}轮",
+                                             name, "speak", reporter)
+        except LLMError as e:
+            self.discard_pending_request(name, "发言", e, reporter)
+            return None
+        self.append_message(name, "assistant", reply_text)
+
+        private_thoughts, public_text = extract_think_and_public(reply_text)
+        return public_text
+
+    def do_speak_simultaneous(self, player_indices):
+        """
+        同时发言（规则变体）：所有玩家收到同一条发言提示（不含本轮任何发言），请求并发发出；
+        全部结束后按座位顺序写回对话、展示并记入本轮记录（不使用流式展示）。
+        """
+        prompt = self.transcripts.simultaneous_speak_prompt(self.round_index)
+        speak_requests = {}
+        for idx in player_indices:
+            name = self.agent_names[idx]
+            self.append_message(name, "user", prompt)
+            speak_requests[idx] = self.build_messages(name)
+
+        def speak_worker(idx):
+            name = self.agent_names[idx]
+            model, params = self.agent_settings(name)
+            try:
+                return generate_reply(speak_requests[idx], params, on_call=self.call_recorder(name, "speak"),
+                                      session_id=self.session_id, model=model, cache=self.cache)
+            except RequestCancelled:
+                raise
+            except LLMError as e:
+                return e
+
+        max_workers = max(1, min(self.vote_concurrency, len(player_indices)))
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            replies = dict(zip(player_indices, executor.map(speak_worker, player_indices)))
+
+        for idx in player_indices:
+            name = self.agent_names[idx]
+            reply_text = replies[idx]
+            if isinstance(reply_text, LLMError):
+                self.discard_pending_request(name, "发言", reply_text)
+                continue
+            self.append_message(name, "assistant", reply_text)
+            self.reporter.reply(f"{name} 发言 (含<think>) - 第{self.round_index}轮", reply_text)
+            _, public_text = extract_think_and_public(reply_text)
+            self.emit("speech", speaker=name, text=public_text)
+
+    def generate_shown(self, messages, title, agent_name, phase, reporter=None):
+        """
+        生成一条需要展示的回答并交给界面（reporter 默认为 self.reporter）：
+        流式模式下通过 reporter.stream_reply 边生成边展示，否则生成完毕后整体展示。
+        """
+        reporter = reporter or self.reporter
+        on_call = self.call_recorder(agent_name, phase)
+        model, params = self.agent_settings(agent_name)
+        if not self.stream:
+            reply_text = generate_reply(messages, params, on_call=on_call, session_id=self.session_id, model=model,
+                                        cache=self.cache)
+            reporter.reply(title, reply_text)
+            return reply_text
+
+        sink = reporter.stream_reply(title)
+        parser = ThinkStreamParser(on_private=sink.private, on_public=sink.public, on_vote=sink.vote)
+        try:
+            reply_text = generate_reply(messages, params, on_token=parser.feed, on_call=on_call,
+                                        session_id=self.session_id, model=model, cache=self.cache)
+        except LLMError as e:
+            sink.close(f"(请求失败: {e})")
+            raise
+        parser.close()
+        sink.close(reply_text)
+        return reply_text
+
+    def do_vote(self, player_idx):
+        """
+        让存活玩家投票 (含<think>)，投票前的上下文为本轮全部公开发言。
+        返回投票目标（玩家姓名），若未解析到或请求失败则返回 None。
+        """
+        messages = self.prepare_vote(player_idx)
+        return self.finish_vote(player_idx, self.collect_vote(messages, self.agent_names[player_idx], self.vote_candidates()))
+
+    def do_vote_all(self, player_indices):
+        """
+        让多位玩家并发投票。
+        每个投票请求只依赖本轮全部发言和投票者自己的对话历史，因此可以同时发出；
+        并发数由 vote_concurrency 限制。
+        vote_short_circuit 为 True 时，一旦已收到的票决定了结果（见 votes_decided），
+        还没发出的投票请求不再发出，流式接收中的投票提前结束。
+        请求全部结束后，再按 player_indices 的固定顺序写回对话并展示，保证结果可复现。
+        返回 {player_idx: 投票目标或None}（结果确定后未收集的投票不在其中）。
+        """
+        candidates = self.vote_candidates()
+        vote_requests = {idx: self.prepare_vote(idx) for idx in player_indices}
+        decided = threading.Event()
+
+        def vote_worker(idx):
+            if decided.is_set():
+                return None
+            return self.collect_vote(vote_requests[idx], self.agent_names[idx], candidates, decided)
+
+        results = {}
+        max_workers = max(1, min(self.vote_concurrency, len(player_indices)))
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = {executor.submit(vote_worker, idx): idx for idx in player_indices}
+            for future in as_completed(futures):
+                results[futures[future]] = future.result()
+                if self.vote_short_circuit and not decided.is_set() and self.votes_decided(results, len(player_indices)):
+                    decided.set()
+
+        votes_map = {}
+        for idx in player_indices:
+            vote_target = self.finish_vote(idx, results[idx])
+            if results[idx] is not None:
+                votes_map[idx] = vote_target
+        return votes_map
+
+    def votes_decided(self, results, total):
+        """
+        已收到的票是否已经决定了本轮的淘汰结果：最高票领先第二名的票数多于还没收到的票数，
+        剩余的票全部投给第二名也追不上。results 为 {player_idx: collect_vote 的结果}，total 为投票人数。
+        """
+        alive = {self.agent_names[idx] for idx in self.active_players}
+        counts = {}
+        for result in results.values():
+            target = result["target"] if result else None
+            if target in alive:
+                counts[target] = counts.get(target, 0) + 1
+        ranked = sorted(counts.values(), reverse=True) + [0, 0]
+        return ranked[0] - ranked[1] > total - len(results)
+
+    def generate_vote(self, messages, params, agent_name, model=None, stop=None):
+        """
+        生成一条投票回答（可在工作线程中调用，不触碰界面）。
+        流式模式下解析到完整的投票行后立即停止接收，省去其后的生成时间；
+        stop（threading.Event）被置位时也立即停止接收（这条不完整的回答不写入缓存）。
+        """
+        on_call = self.call_recorder(agent_name, "vote")
+        if not self.stream:
+            return generate_reply(messages, params, on_call=on_call, session_id=self.session_id, model=model,
+                                  cache=self.cache)
+        parser = ThinkStreamParser(stop_on_vote=True,
+                                   parse_vote=parse_vote_json if self.vote_mode == "json" else parse_vote_from_text)
+
+        def on_token(chunk):
+            # 解析到投票行时回答已经完整可用；被 stop 打断时回答不完整，不能写入缓存
+            if parser.feed(chunk):
+                return True
+            return STREAM_CANCELLED if stop is not None and stop.is_set() else False
+
+        return generate_reply(messages, params, on_token=on_token, on_call=on_call, session_id=self.session_id,
+                              model=model, cache=self.cache)
+
+    def collect_vote(self, messages, agent_name, candidates, stop=None):
+        """
+        发出一个投票请求并解析投票目标（可在工作线程中调用，不触碰界面，也不写对话），返回
+        {"reply": 回答文本或LLMError, "target": 投票目标或None, "reask": None 或 (追问文本, 回答文本或LLMError)}；
+        stop 已置位（本轮结果已确定）且没有解析到投票时返回 None，表示这一票未收集。
+        结构化投票（vote_mode="json"）时投票目标模糊匹配到 candidates 中的存活玩家，
+        没有投票或匹配不到时带着原回答追问一次（低温度、限制长度，只要一行JSON）。
+        """
+        model, params = self.agent_settings(agent_name)
+        try:
+            reply_text = self.generate_vote(messages, params, agent_name, model, stop)
+        except RequestCancelled:
+            raise
+        except LLMError as e:
+            return {"reply": e, "target": None, "reask": None}
+        _, public_text = extract_think_and_public(reply_text)
+        if self.vote_mode == "text":
+            raw = target = parse_vote_from_text(public_text)
+        else:
+            raw = parse_vote_json(public_text)
+            target = resolve_vote_target(raw, candidates)
+        if target is not None or is_abstain_vote(raw):
+            return {"reply": reply_text, "target": target, "reask": None}
+        if stop is not None and stop.is_set():
+            return None
+        if self.vote_mode == "text":
+            return {"reply": reply_text, "target": None, "reask": None}
+
+        problem = prompts.VOTE_REASK_UNKNOWN.format(target=raw) if raw else prompts.VOTE_REASK_MISSING
+        reask = prompts.VOTE_REASK.format(problem=problem, candidates="、".join(candidates))
+        reask_messages = messages + [{"role": "assistant", "content": reply_text}, {"role": "user", "content": reask}]
+        reask_params = {**params, "temperature": 0.0, "max_tokens": VOTE_REASK_MAX_TOKENS}
+        try:
+            reask_reply = generate_reply(reask_messages, reask_params, on_call=self.call_recorder(agent_name, "vote-reask"),
+                                         session_id=self.session_id, model=model, cache=self.cache)
+        except RequestCancelled:
+            raise
+        except LLMError as e:
+            return {"reply": reply_text, "target": None, "reask": (reask, e)}
+        _, reask_public = extract_think_and_public(reask_reply)
+        target = resolve_vote_target(parse_vote_json(reask_public) or parse_vote_from_text(reask_public), candidates)
+        return {"reply": reply_text, "target": target, "reask": (reask, reask_reply)}
+
+    def agent_settings(self, name):
+        """
+        返回该角色请求使用的 (model, params)：座位设置覆盖本局设置（model 为 None 表示全局模型）。
+        返回的 params 是新字典，可安全交给工作线程。
+        """
+        seat = self.seat_configs.get(self.agent_names.index(name), {})
+        return seat.get("model") or self.model, {**self.params, **seat.get("params", {})}
+
+    def vote_candidates(self):
+        """本轮可投的玩家（存活玩家姓名，按座位顺序）。"""
+        return [self.agent_names[idx] for idx in self.active_players]
+
+    def prepare_vote(self, player_idx):
+        """
+        追加投票用的User消息（本轮全部公开发言，所有投票者共用同一份文本），
+        返回本次请求要发送的消息列表（快照，可安全交给工作线程）。
+        结构化投票时提示中附上可投的玩家名单。
+        """
+        name = self.agent_names[player_idx]
+        candidates = self.vote_candidates() if self.vote_mode == "json" else None
+        self.append_message(name, "user", self.transcripts.vote_prompt(self.round_index, candidates))
+        return self.build_messages(name)
+
+    def finish_vote(self, player_idx, result):
+        """
+        写回投票回答（及追问）、展示投票结果，返回投票目标（玩家姓名），若未解析到则返回 None。
+        result 为 collect_vote 的结果：reply 为 LLMError 时表示请求失败，按弃权处理；
+        result 为 None 时表示结果确定后这一票未收集，撤回投票提示。
+        """
+        name = self.agent_names[player_idx]
+        if result is None:
+            self.emit("discard", name=name)
+            self.reporter.markdown(f"**{name} 的投票未收集（本轮结果已确定）**")
+            return None
+        if isinstance(result["reply"], LLMError):
+            self.discard_pending_request(name, "投票", result["reply"])
+            return None
+        self.append_message(name, "assistant", result["reply"])
+        self.reporter.reply(f"{name} 投票 (含<think>) - 第{self.round_index}轮", result["reply"])
+        if result["reask"] is not None:
+            reask, reask_reply = result["reask"]
+            self.append_message(name, "user", reask)
+            if isinstance(reask_reply, LLMError):
+                self.discard_pending_request(name, "追问投票", reask_reply)
+            else:
+                self.append_message(name, "assistant", reask_reply)
+                self.reporter.reply(f"{name} 追问投票 - 第{self.round_index}轮", reask_reply)
+
+        vote_target = result["target"]
+        if vote_target:
+            self.reporter.markdown(f"**{name} 投给了：{vote_target}**")
+        else:
+            self.reporter.markdown(f"**{name} 未给出有效投票**")
+        return vote_target
+
+    def do_elimination(self, votes_map):
+        """
+        根据 votes_map ( {player_idx: "投给了某某玩家" 或 None} ) 统计票数：
+        - 找到票数最高的玩家
+        - 若出现平票则无人淘汰
+        - 否则淘汰票数最高者
+        返回被淘汰的 player_idx（若无人淘汰则返回 None；从存活列表中移除由 "votes" 事件完成）。
+        """
+        # 将存活玩家姓名映射到下标
+        name_to_idx = {self.agent_names[i]: i for i in self.active_players}
+        count_map = {}
+        for voter_idx, target_name in votes_map.items():
+            if not target_name:
+                continue
+            if target_name in name_to_idx:
+                target_idx = name_to_idx[target_name]
+                count_map[target_idx] = count_map.get(target_idx, 0) + 1
+
+        if not count_map:
+            self.reporter.info("本轮无人有效投票 => 无人淘汰")
+            return None
+
+        sorted_items = sorted(count_map.items(), key=lambda x: x[1], reverse=True)
+        top_idx, top_votes = sorted_items[0]
+        if len(sorted_items) > 1 and sorted_items[1][1] == top_votes:
+            self.reporter.info(f"出现平票，最高票数 {top_votes} 不是唯一 => 无人淘汰")
+            return None
+
+        eliminated_idx = top_idx
+        eliminated_name = self.agent_names[eliminated_idx]
+        self.reporter.warning(f"**{eliminated_name} 被淘汰** (获得最高票数 {top_votes})")
+        return eliminated_idx
+
+    def check_game_end(self, eliminated_idx):
+        """
+        检查游戏是否结束：
+        - 若淘汰者是卧底，则平民胜利；
+        - 若存活玩家只剩2人（且卧底仍在），则卧底胜利；
+        否则游戏继续。
+        """
+        if eliminated_idx is not None and eliminated_idx == self.spy_index:
+            self.reporter.success("卧底被淘汰！平民胜利！")
+            self.emit("game_end", winner="平民")
+            return
+
+        if len(self.active_players) == 2:
+            if self.spy_index in self.active_players:
+                self.reporter.warning("只剩2人存活(含卧底)，卧底胜利！")
+                self.emit("game_end", winner="卧底")
+            else:
+                self.reporter.success("只剩2人存活(卧底已被淘汰)，平民胜利！")
+                self.emit("game_end", winner="平民")
+
+    def append_message(self, name, role, content):
+        """
+        向角色的对话历史追加一条消息，并标记所属轮次（开局阶段为0）。
+        """
+        self.emit("message", name=name, role=role, content=content)
+
+    def build_messages(self, name):
+        """
+        按该角色的上下文策略构造本次请求要发送的消息列表（新列表，可安全交给工作线程），
+        同时累计完整历史与实际发送的token估算值。
+        """
+        conversation = self.conversations[name]
+        policy = self.context_policies.get(name, self.context_policy)
+        messages = policy.build(conversation, self)
+        self.emit("context", name=name, full_tokens=count_message_tokens(conversation),
+                  sent_tokens=count_message_tokens(messages))
+        return messages
+
+    def context_savings(self):
+        """
+        汇总本局上下文策略节省的token（估算值）：
+        返回 {"calls", "full_tokens", "sent_tokens", "saved", "saved_ratio"}。
+        """
+        totals = {"calls": 0, "full_tokens": 0, "sent_tokens": 0}
+        for stats in self.context_stats.values():
+            for key in totals:
+                totals[key] += stats[key]
+        totals["saved"] = totals["full_tokens"] - totals["sent_tokens"]
+        totals["saved_ratio"] = totals["saved"] / totals["full_tokens"] if totals["full_tokens"] else 0.0
+        return totals
+
+    def discard_pending_request(self, name, action, error, reporter=None):
+        """
+        请求最终失败：撤回刚追加的User消息（它是对话的最后一条，撤回不影响历史前缀），并提示界面。
+        会话被取消（RequestCancelled）不算失败：原样抛出，不撤回也不跳过，本轮留待继续。
+        """
+        if isinstance(error, RequestCancelled):
+            raise error
+        conversation = self.conversations[name]
+        if conversation and conversation[-1]["role"] == "user":
+            self.emit("discard", name=name)
+        (reporter or self.reporter).warning(f"{name} {action}请求失败（{error.__class__.__name__}: {error}，已重试{error.retries}次），本轮跳过")
+
+    def call_recorder(self, agent_name, phase):
+        """
+        返回一个 on_call 回调：给该次调用的性能数据打上 game_id/round/agent/phase 标签后记入 metrics
+        （emit 线程安全，可在投票工作线程中调用）。
+        """
+        round_index = self.round_index
+
+        def record(call):
+            self.emit("call", record={
+                "game_id": self.game_id, "round": round_index, "agent": agent_name, "phase": phase,
+                **call, "timestamp": time.time(),
+            })
+        return record
+
+    def prefix_cache_summary(self):
+        """
+        汇总本局请求的前缀缓存命中情况：
+        返回 {"calls", "prompt_tokens", "cache_hit_tokens", "hit_ratio"}。
+        """
+        totals = self.metrics.totals() or {"calls": 0, "prompt_tokens": 0, "cache_hit_tokens": 0}
+        prompt_tokens = totals["prompt_tokens"]
+        hit_tokens = totals["cache_hit_tokens"]
+        return {
+            "calls": totals["calls"],
+            "prompt_tokens": prompt_tokens,
+            "cache_hit_tokens": hit_tokens,
+            "hit_ratio": hit_tokens / prompt_tokens if prompt_tokens else 0.0,
+        }
+
+    def add_chat_record(self, speaker_name, public_text):
+        """
+        将一条公开消息追加到公共聊天记录中。
+        """
+        if public_text.strip():
+            self.public_chat_history.append((speaker_name, public_text))
+
+    def chat_records(self, round_no):
+        """
+        第 round_no 轮的公共聊天记录 [(speaker, public_text), ...]（与 add_chat_record 一样跳过空发言）。
+        """
+        return [(speaker, text) for speaker, text in self.transcripts.speeches(round_no) if text.strip()]
+
+    def is_round_finished(self, round_no):
+        """
+        第 round_no 轮是否已经结束（之后不会再有新的发言/对话追加到这一轮）。
+        第0轮为开局阶段。
+        """
+        if round_no < self.round_index:
+            return True
+        if round_no == 0:
+            return self.game_inited
+        return bool(self.vote_history) and self.vote_history[-1]["round"] == round_no
+
+    def outcome(self):
+        """
+        返回本局结果摘要（可JSON序列化），供批量模拟统计使用。
+        """
+        spy_name = self.agent_names[self.spy_index] if self.spy_index is not None else None
+        return {
+            "game_id": self.game_id,
+            "num_players": self.num_players,
+            "normal_word": self.normal_word,
+            "spy_word": self.spy_word,
+            "word_source": self.word_source,
+            "spy": spy_name,
+            "winner": self.winner,
+            "rounds": self.round_index,
+            "spy_survived": self.spy_index in self.active_players,
+            "votes": self.vote_history,
+            "context": self.context_savings(),
+            "prefix_cache": self.prefix_cache_summary(),
+            "performance": self.metrics.totals(),
+        }
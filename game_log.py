@@ -0,0 +1,171 @@
+"""
+对局事件日志（SQLite）：Game 的每一次状态变化都作为一条只追加的事件写入磁盘，
+按顺序重放事件即可重建整局状态（页面刷新、服务重启后继续对局）。
+
+- events ：(game_id, seq) 为主键的事件流，payload 为 JSON
+- blobs  ：消息正文按内容哈希只存一份（所有投票者共用的投票提示等不会重复存储），
+           重放时同一正文还原为同一个字符串对象
+- games  ：每局的摘要（人数、轮数、状态 setup/playing/finished、胜方、所有者），用于列出可恢复的对局；
+           owner 为创建该局的页面（浏览器）的标识，界面只列出和恢复自己的对局
+
+同一局的 (game_id, seq) 已被写入时（例如两个页面同时推进同一局），append 抛出 EventConflict。
+
+事件类型见 Game.apply_event。
+"""
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+
+
+class EventConflict(Exception):
+    """要写入的事件序号已被占用：另一个写入者已经推进了这一局，当前内存中的状态已过期。"""
+
+
+class GameLog:
+    """
+    基于SQLite的对局事件存储，可在多线程（并发投票）和多进程（批量模拟）中共用同一个文件。
+    """
+
+    def __init__(self, path="game_log.sqlite3"):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        # WAL 模式下 NORMAL 同步已能保证崩溃后数据库一致，每条事件提交一次的开销很小
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS events (
+                game_id TEXT NOT NULL,
+                seq INTEGER NOT NULL,
+                type TEXT NOT NULL,
+                round INTEGER NOT NULL,
+                payload TEXT NOT NULL,
+                content_ref TEXT,
+                ts REAL NOT NULL,
+                PRIMARY KEY (game_id, seq)
+            )
+        """)
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS blobs (
+                hash TEXT PRIMARY KEY,
+                text TEXT NOT NULL
+            )
+        """)
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS games (
+                game_id TEXT PRIMARY KEY,
+                created REAL NOT NULL,
+                updated REAL NOT NULL,
+                num_players INTEGER NOT NULL,
+                rounds INTEGER NOT NULL DEFAULT 0,
+                status TEXT NOT NULL,
+                winner TEXT,
+                owner TEXT
+            )
+        """)
+        # 旧版本创建的文件没有 owner 列（其中的对局没有所有者，界面上不再列出）
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(games)")}
+        if "owner" not in columns:
+            self._conn.execute("ALTER TABLE games ADD COLUMN owner TEXT")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS games_updated ON games (status, updated)")
+        self._conn.commit()
+
+    def append(self, game_id, seq, event_type, round_no, payload, owner=None):
+        """
+        追加一条事件；payload 中的 content（消息正文）存入 blobs 表，事件中只保留其哈希。
+        同时维护 games 表中的摘要（owner 在 setup 事件时记为该局的所有者）。
+        该序号已被写入时回滚并抛出 EventConflict。
+        """
+        now = time.time()
+        content_ref = None
+        if "content" in payload:
+            payload = dict(payload)
+            content = payload.pop("content")
+            content_ref = hashlib.sha1(content.encode("utf-8")).hexdigest()
+        with self._lock:
+            if content_ref is not None:
+                self._conn.execute("INSERT OR IGNORE INTO blobs (hash, text) VALUES (?, ?)", (content_ref, content))
+            try:
+                self._conn.execute(
+                    "INSERT INTO events (game_id, seq, type, round, payload, content_ref, ts) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (game_id, seq, event_type, round_no, json.dumps(payload, ensure_ascii=False), content_ref, now),
+                )
+            except sqlite3.IntegrityError as e:
+                self._conn.rollback()
+                raise EventConflict(f"对局 {game_id} 的事件 {seq} 已被其他写入者写入") from e
+            if event_type == "setup":
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO games (game_id, created, updated, num_players, status, owner) "
+                    "VALUES (?, ?, ?, ?, 'setup', ?)",
+                    (game_id, now, now, payload["num_players"], owner),
+                )
+            elif event_type == "ready":
+                self._conn.execute("UPDATE games SET status = 'playing', updated = ? WHERE game_id = ?", (now, game_id))
+            elif event_type == "round_start":
+                self._conn.execute("UPDATE games SET rounds = ?, updated = ? WHERE game_id = ?", (payload["round"], now, game_id))
+            elif event_type == "game_end":
+                self._conn.execute(
+                    "UPDATE games SET status = 'finished', winner = ?, updated = ? WHERE game_id = ?",
+                    (payload["winner"], now, game_id),
+                )
+            self._conn.commit()
+
+    def events(self, game_id):
+        """
+        按顺序返回一局的全部事件 [(seq, type, payload), ...]；
+        消息正文还原到 payload["content"]，相同正文共用同一个字符串对象。
+        """
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT e.seq, e.type, e.payload, e.content_ref, b.text FROM events e "
+                "LEFT JOIN blobs b ON b.hash = e.content_ref WHERE e.game_id = ? ORDER BY e.seq",
+                (game_id,),
+            ).fetchall()
+        contents = {}
+        events = []
+        for seq, event_type, payload, content_ref, text in rows:
+            payload = json.loads(payload)
+            if content_ref is not None:
+                payload["content"] = contents.setdefault(content_ref, text)
+            events.append((seq, event_type, payload))
+        return events
+
+    def list_games(self, status=None, limit=20, owner=None):
+        """最近更新的对局摘要列表（可按 status / owner 过滤，limit 为 None 时不限条数），每项为 dict。"""
+        query = "SELECT game_id, created, updated, num_players, rounds, status, winner FROM games"
+        clauses, args = [], []
+        if status is not None:
+            clauses.append("status = ?")
+            args.append(status)
+        if owner is not None:
+            clauses.append("owner = ?")
+            args.append(owner)
+        if clauses:
+            query += " WHERE " + " AND ".join(clauses)
+        query += " ORDER BY updated DESC"
+        if limit is not None:
+            query += " LIMIT ?"
+            args.append(limit)
+        with self._lock:
+            rows = self._conn.execute(query, args).fetchall()
+        keys = ("game_id", "created", "updated", "num_players", "rounds", "status", "winner")
+        return [dict(zip(keys, row)) for row in rows]
+
+    def owner(self, game_id):
+        """该局的所有者标识（没有该局或没有所有者时为 None）。"""
+        with self._lock:
+            row = self._conn.execute("SELECT owner FROM games WHERE game_id = ?", (game_id,)).fetchone()
+        return row[0] if row else None
+
+    def delete_game(self, game_id):
+        """删除一局的事件和摘要（blobs 中可能被其他对局共用的正文保留）。"""
+        with self._lock:
+            self._conn.execute("DELETE FROM events WHERE game_id = ?", (game_id,))
+            self._conn.execute("DELETE FROM games WHERE game_id = ?", (game_id,))
+            self._conn.commit()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
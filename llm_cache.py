@@ -0,0 +1,138 @@
+"""
+LLM回答的磁盘缓存（SQLite），用于零成本地重放整局游戏。
+
+模式：
+- "off"    ：不使用缓存
+- "record" ：命中则直接返回缓存，未命中才请求接口并写入缓存
+- "replay" ：只读缓存，从不访问网络；未命中抛出 CacheMiss
+
+缓存键是 (model, messages, temperature, top_p, presence_penalty, frequency_penalty[, max_tokens]) 的哈希；
+总大小超过 max_bytes 时按最近访问时间淘汰（LRU）。
+"""
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+
+from llm_client import LLMError
+
+CACHE_MODES = ("off", "record", "replay")
+
+# 缓存键中包含的生成参数
+KEY_PARAMS = ("temperature", "top_p", "presence_penalty", "frequency_penalty")
+# 只在给出时才加入缓存键的生成参数（不影响已录制的缓存键）
+OPTIONAL_KEY_PARAMS = ("max_tokens",)
+
+
+class CacheMiss(LLMError):
+    """replay 模式下请求的回答不在缓存中（与其他请求失败一样处理）。"""
+
+
+class LLMCache:
+    """
+    基于SQLite的LLM回答缓存，可在多线程（并发投票）和多进程（批量模拟）中共用同一个文件。
+    总字节数在打开时统计一次，之后随本进程的写入/淘汰累加，写入不必每次扫描全表
+    （其他进程同时写入的部分在下次打开时才计入）。
+    """
+
+    def __init__(self, path="llm_cache.sqlite3", mode="record", max_bytes=256 * 1024 * 1024):
+        if mode not in CACHE_MODES:
+            raise ValueError(f"未知的缓存模式: {mode}，可选 {CACHE_MODES}")
+        self.path = path
+        self.mode = mode
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY,
+                response TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                last_access REAL NOT NULL
+            )
+        """)
+        self._conn.execute("CREATE INDEX IF NOT EXISTS responses_last_access ON responses (last_access)")
+        self._conn.commit()
+        self._total_bytes = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+
+    @property
+    def enabled(self):
+        return self.mode != "off"
+
+    @staticmethod
+    def make_key(model, messages, params):
+        """
+        计算缓存键：只取消息的 role/content，参数按固定顺序序列化，保证同一请求得到同一个键。
+        """
+        payload = {
+            "model": model,
+            "messages": [{"role": m["role"], "content": m["content"]} for m in messages],
+            "params": {name: params.get(name) for name in KEY_PARAMS},
+        }
+        for name in OPTIONAL_KEY_PARAMS:
+            if params.get(name) is not None:
+                payload["params"][name] = params[name]
+        raw = json.dumps(payload, ensure_ascii=False, sort_keys=True, separators=(",", ":"))
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def get(self, key):
+        """
+        读取缓存；命中时刷新访问时间并返回回答文本，否则返回 None。
+        """
+        with self._lock:
+            row = self._conn.execute("SELECT response FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._conn.execute("UPDATE responses SET last_access = ? WHERE key = ?", (time.time(), key))
+            self._conn.commit()
+            return row[0]
+
+    def put(self, key, response):
+        """
+        写入缓存，并在总大小超出 max_bytes 时淘汰最久未访问的条目。
+        """
+        size = len(response.encode("utf-8"))
+        with self._lock:
+            row = self._conn.execute("SELECT size FROM responses WHERE key = ?", (key,)).fetchone()
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses (key, response, size, last_access) VALUES (?, ?, ?, ?)",
+                (key, response, size, time.time()),
+            )
+            self._total_bytes += size - (row[0] if row else 0)
+            if self._total_bytes > self.max_bytes:
+                self._evict()
+            self._conn.commit()
+
+    def _evict(self):
+        """按访问时间从旧到新删除条目，直到总大小不超过 max_bytes（调用方持有锁）。"""
+        stale = []
+        for key, size in self._conn.execute("SELECT key, size FROM responses ORDER BY last_access"):
+            if self._total_bytes <= self.max_bytes:
+                break
+            stale.append((key,))
+            self._total_bytes -= size
+        self._conn.executemany("DELETE FROM responses WHERE key = ?", stale)
+
+    def stats(self):
+        """
+        返回条目数、总字节数以及本进程内的命中/未命中次数。
+        """
+        with self._lock:
+            count, total = self._conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses").fetchone()
+        return {"entries": count, "bytes": total, "hits": self.hits, "misses": self.misses}
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM responses")
+            self._conn.commit()
+            self._total_bytes = 0
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
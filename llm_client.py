@@ -0,0 +1,266 @@
+"""
+LLM接口的请求层：连接池复用、带抖动的指数退避重试、读取限流响应头、
+所有角色共用的令牌桶限速，以及每次调用的总截止时间。
+
+失败时抛出带类型的 LLMError，而不是把 "[ERROR]: ..." 当作玩家发言返回。
+
+openai（连带 aiohttp、numpy 等）和 requests 的导入要几百毫秒，本模块在第一次真正请求接口时才导入它们，
+缓存回放、只读日志等不联网的场景完全不需要加载。
+"""
+import email.utils
+import random
+import re
+import threading
+import time
+
+_openai = None
+_openai_lock = threading.Lock()
+# install() 指定的客户端：openai 导入后让它的请求走该客户端的连接池
+_installed_client = None
+
+
+def load_openai():
+    """导入并返回 openai 模块（只在第一次调用时真正导入）。"""
+    global _openai
+    if _openai is None:
+        with _openai_lock:
+            if _openai is None:
+                import openai
+                if _installed_client is not None:
+                    openai.requestssession = _installed_client.session
+                _openai = openai
+    return _openai
+
+
+# ========== 错误类型 ==========
+
+class LLMError(Exception):
+    """LLM请求失败的基类。retries 为放弃前已重试的次数。"""
+
+    retryable = False
+
+    def __init__(self, message, retries=0, status=None):
+        super().__init__(message)
+        self.retries = retries
+        self.status = status
+
+
+class LLMRateLimitError(LLMError):
+    """被接口限流（HTTP 429），重试耗尽或超过截止时间。"""
+
+    retryable = True
+
+
+class LLMTimeoutError(LLMError):
+    """请求超时，或整个调用超过了截止时间。"""
+
+    retryable = True
+
+
+class LLMUnavailableError(LLMError):
+    """连接失败或服务端错误（5xx）。"""
+
+    retryable = True
+
+
+class LLMRequestError(LLMError):
+    """请求本身有问题（参数错误、鉴权失败等），重试无意义。"""
+
+
+def classify_error(exc):
+    """
+    把 openai / requests 抛出的异常转换为对应的 LLMError 子类实例。
+    """
+    if isinstance(exc, LLMError):
+        return exc
+    openai = load_openai()
+    import requests
+    status = getattr(exc, "http_status", None)
+    # openai 的异常在 str() 中会附带响应体和响应头，这里只取错误信息
+    message = getattr(exc, "user_message", None) or str(exc) or exc.__class__.__name__
+    if isinstance(exc, openai.error.RateLimitError) or status == 429:
+        return LLMRateLimitError(message, status=status)
+    if isinstance(exc, (openai.error.Timeout, requests.exceptions.Timeout)):
+        return LLMTimeoutError(message, status=status)
+    if isinstance(exc, (openai.error.APIConnectionError, openai.error.ServiceUnavailableError,
+                        openai.error.TryAgain, requests.exceptions.ConnectionError)):
+        return LLMUnavailableError(message, status=status)
+    if isinstance(exc, openai.error.APIError) and (status is None or status >= 500):
+        return LLMUnavailableError(message, status=status)
+    return LLMRequestError(message, status=status)
+
+
+# ========== 限流响应头 ==========
+
+_DURATION_PATTERN = re.compile(r"(\d+(?:\.\d+)?)(ms|s|m|h)")
+_DURATION_UNITS = {"ms": 0.001, "s": 1.0, "m": 60.0, "h": 3600.0}
+
+
+def parse_duration(value):
+    """
+    解析时长：纯数字（秒）、"1s"、"20ms"、"6m0s" 或 HTTP 日期。无法解析时返回 None。
+    """
+    if value is None:
+        return None
+    value = str(value).strip()
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    parts = _DURATION_PATTERN.findall(value)
+    if parts:
+        return sum(float(number) * _DURATION_UNITS[unit] for number, unit in parts)
+    try:
+        return max(0.0, email.utils.parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def retry_after_from_headers(headers):
+    """
+    从响应头中读出需要等待的秒数：
+    优先 Retry-After；其次当剩余请求数为0时使用 x-ratelimit-reset-requests。
+    """
+    if not headers:
+        return None
+    headers = {str(key).lower(): value for key, value in dict(headers).items()}
+    wait = parse_duration(headers.get("retry-after"))
+    if wait is not None:
+        return wait
+    if str(headers.get("x-ratelimit-remaining-requests", "")).strip() == "0":
+        return parse_duration(headers.get("x-ratelimit-reset-requests"))
+    return None
+
+
+# ========== 令牌桶 ==========
+
+class TokenBucket:
+    """
+    所有角色共用的令牌桶：rate 为每秒补充的请求数，capacity 为最大突发数。
+    rate 为 None 时不限速，但仍会遵守 pause_until 设置的全局暂停（收到429时）。
+    """
+
+    def __init__(self, rate=None, capacity=None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(1.0, rate or 1.0)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def pause_until(self, until):
+        """在 until（time.monotonic 时间）之前暂停发放令牌。"""
+        with self._lock:
+            self._paused_until = max(self._paused_until, until)
+
+    def acquire(self, deadline=None):
+        """
+        取一个令牌，必要时等待；等待会超过 deadline（time.monotonic 时间）时返回 False。
+        """
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                wait = max(0.0, self._paused_until - now)
+                if wait == 0.0:
+                    if self.rate is None:
+                        return True
+                    self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                    self._updated = now
+                    if self._tokens >= 1.0:
+                        self._tokens -= 1.0
+                        return True
+                    wait = (1.0 - self._tokens) / self.rate
+            if deadline is not None and now + wait > deadline:
+                return False
+            time.sleep(wait)
+
+
+# ========== 客户端 ==========
+
+class LLMClient:
+    """
+    带连接池、重试和限速的 ChatCompletion 客户端。
+
+    - pool_size         ：keep-alive 连接池大小（所有线程共用一个 requests.Session）
+    - max_retries       ：可重试错误（429/超时/5xx/连接失败）的最大重试次数
+    - backoff_base/max  ：指数退避的基数和上限（秒），实际等待在 [0, 上限] 内随机（full jitter）
+    - request_timeout   ：单次HTTP请求的超时（秒）
+    - call_deadline     ：一次调用（含全部重试和排队）的总时限（秒）
+    - rate / burst      ：令牌桶限速（每秒请求数 / 突发数），None 表示不限速
+    """
+
+    def __init__(self, pool_size=32, max_retries=4, backoff_base=0.5, backoff_max=20.0,
+                 request_timeout=60.0, call_deadline=180.0, rate=None, burst=None):
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.request_timeout = request_timeout
+        self.call_deadline = call_deadline
+        self.bucket = TokenBucket(rate, burst)
+        self.pool_size = pool_size
+        self._session = None
+        self._session_lock = threading.Lock()
+
+    @property
+    def session(self):
+        """共用的 requests.Session（第一次使用时才创建）。"""
+        if self._session is None:
+            with self._session_lock:
+                if self._session is None:
+                    import requests
+                    from requests.adapters import HTTPAdapter
+                    session = requests.Session()
+                    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=self.pool_size, max_retries=0)
+                    session.mount("https://", adapter)
+                    session.mount("http://", adapter)
+                    self._session = session
+        return self._session
+
+    def install(self):
+        """让 openai 库的全部请求都走本客户端的连接池（openai 尚未导入时，在导入时生效）。"""
+        global _installed_client
+        _installed_client = self
+        if _openai is not None:
+            _openai.requestssession = self.session
+        return self
+
+    def backoff(self, attempt):
+        """第 attempt 次重试前的等待秒数（full jitter）。"""
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt)))
+
+    def create(self, deadline=None, **request_kwargs):
+        """
+        调用 openai.ChatCompletion.create，失败时按规则重试。
+        deadline 为本次调用的截止时间（time.monotonic 时间），默认 now + call_deadline。
+        返回 (response, retries)；最终失败时抛出 LLMError（retries 记录已重试次数）。
+        """
+        if deadline is None:
+            deadline = time.monotonic() + self.call_deadline
+        retries = 0
+        while True:
+            if not self.bucket.acquire(deadline):
+                raise LLMTimeoutError("等待限流令牌超过了调用截止时间", retries=retries)
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise LLMTimeoutError("调用超过截止时间", retries=retries)
+            try:
+                response = load_openai().ChatCompletion.create(
+                    request_timeout=min(self.request_timeout, remaining),
+                    **request_kwargs,
+                )
+                return response, retries
+            except Exception as exc:
+                error = classify_error(exc)
+                error.retries = retries
+                if not error.retryable or retries >= self.max_retries:
+                    raise error from exc
+                wait = self.backoff(retries)
+                retry_after = retry_after_from_headers(getattr(exc, "headers", None))
+                if retry_after is not None:
+                    # 限流提示对所有角色生效：暂停共享令牌桶
+                    self.bucket.pause_until(time.monotonic() + retry_after)
+                    wait = max(wait, retry_after)
+                if time.monotonic() + wait >= deadline:
+                    raise error from exc
+                time.sleep(wait)
+                retries += 1
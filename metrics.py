@@ -0,0 +1,221 @@
+"""
+LLM调用的性能指标：每次 generate_reply 调用记录一条，包括
+墙钟耗时、首token耗时(ttft)、调度排队时间、输入/输出token、前缀缓存命中token、重试次数、状态，
+并带上 game_id / round / agent / phase(word-gen/speak/vote) 标签。
+
+MetricsCollector 负责收集与汇总；导出器（exporter）可插拔：
+- JsonlExporter      ：每条记录追加一行JSON
+- PrometheusExporter ：按 Prometheus 文本格式输出累计指标（可写入 node_exporter 的 textfile 目录）；
+                       进程级累计，只按 phase/status 和角色类别（gm/player）分组，不带每局随机生成的角色名
+用 add_exporter 注册的全局导出器会收到所有对局的记录。
+"""
+import json
+import threading
+
+# 每条记录的字段
+RECORD_FIELDS = (
+    "game_id", "round", "agent", "phase", "status", "latency", "ttft",
+    "prompt_tokens", "completion_tokens", "cache_hit_tokens", "retries", "queue_wait", "timestamp",
+)
+
+# 延迟直方图的分桶上界（秒）
+LATENCY_BUCKETS = (0.25, 0.5, 1.0, 2.0, 4.0, 8.0, 16.0, 32.0, 64.0)
+
+_global_exporters = []
+_global_lock = threading.Lock()
+
+
+def add_exporter(exporter):
+    """注册一个全局导出器，所有 MetricsCollector 的新记录都会转发给它。"""
+    with _global_lock:
+        _global_exporters.append(exporter)
+    return exporter
+
+
+def remove_exporter(exporter):
+    with _global_lock:
+        if exporter in _global_exporters:
+            _global_exporters.remove(exporter)
+
+
+def agent_role(agent):
+    """角色名对应的角色类别：GM_* 为 gm，Player_* 为 player，其他（如后台请求没有角色）为 other。"""
+    agent = agent or ""
+    if agent.startswith("GM_"):
+        return "gm"
+    if agent.startswith("Player_"):
+        return "player"
+    return "other"
+
+
+def percentile(values, pct):
+    """最近秩法求百分位数（values 为空时返回 0.0）。"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(0, min(len(ordered) - 1, int(round(pct / 100.0 * len(ordered) + 0.5)) - 1))
+    return ordered[rank]
+
+
+class MetricsCollector:
+    """
+    线程安全的调用记录收集器（一局游戏一个），可按任意标签组合汇总。
+    """
+
+    def __init__(self, exporters=None):
+        self.records = []
+        self.exporters = list(exporters or [])
+        self._lock = threading.Lock()
+
+    def add(self, record, export=True):
+        """记录一次调用；export=False 时不转发给导出器（如从事件日志重放）。"""
+        with self._lock:
+            self.records.append(record)
+        if not export:
+            return
+        with _global_lock:
+            exporters = self.exporters + _global_exporters
+        for exporter in exporters:
+            exporter.export(record)
+
+    def summary(self, by=("phase",)):
+        """
+        按 by 中的标签分组汇总，返回列表，每组包含：
+        calls / errors / retries / latency_total / latency_mean / latency_p50 / latency_p95 /
+        ttft_mean / queue_wait_mean / prompt_tokens / completion_tokens / cache_hit_tokens
+        """
+        with self._lock:
+            records = list(self.records)
+        groups = {}
+        for record in records:
+            groups.setdefault(tuple(record.get(key) for key in by), []).append(record)
+        rows = []
+        for key, items in groups.items():
+            latencies = [r["latency"] for r in items]
+            row = dict(zip(by, key))
+            row.update({
+                "calls": len(items),
+                "errors": sum(1 for r in items if r["status"] == "error"),
+                "retries": sum(r["retries"] for r in items),
+                "latency_total": sum(latencies),
+                "latency_mean": sum(latencies) / len(latencies),
+                "latency_p50": percentile(latencies, 50),
+                "latency_p95": percentile(latencies, 95),
+                "ttft_mean": sum(r["ttft"] for r in items) / len(items),
+                "queue_wait_mean": sum(r.get("queue_wait", 0.0) for r in items) / len(items),
+                "prompt_tokens": sum(r["prompt_tokens"] for r in items),
+                "completion_tokens": sum(r["completion_tokens"] for r in items),
+                "cache_hit_tokens": sum(r["cache_hit_tokens"] for r in items),
+            })
+            rows.append(row)
+        rows.sort(key=lambda row: row["latency_total"], reverse=True)
+        return rows
+
+    def totals(self):
+        """全部记录的汇总（一行）。"""
+        rows = self.summary(by=())
+        return rows[0] if rows else None
+
+
+# ========== 导出器 ==========
+
+class JsonlExporter:
+    """每条记录追加为一行JSON（多进程追加写同一文件时每行一次写入）。"""
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._file = open(path, "a", encoding="utf-8")
+
+    def export(self, record):
+        line = json.dumps(record, ensure_ascii=False) + "\n"
+        with self._lock:
+            self._file.write(line)
+            self._file.flush()
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+
+class PrometheusExporter:
+    """
+    在内存中累计 Prometheus 指标，render() 输出文本格式，write(path) 写入文件：
+    - who_is_spy_llm_calls_total{phase,role,status}
+    - who_is_spy_llm_retries_total{phase,role}
+    - who_is_spy_llm_tokens_total{phase,role,kind}    kind = prompt/completion/cache_hit
+    - who_is_spy_llm_latency_seconds{phase}           直方图
+    - who_is_spy_llm_ttft_seconds{phase}              直方图
+    role 为 agent_role 得到的角色类别：角色名每局随机生成，作为标签会让序列数随服务运行无限增长；
+    按角色名的明细见 JSONL 记录和页面侧栏。
+    """
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = tuple(buckets)
+        self._calls = {}
+        self._retries = {}
+        self._tokens = {}
+        self._histograms = {"latency": {}, "ttft": {}}
+        self._lock = threading.Lock()
+
+    def export(self, record):
+        phase, role = record.get("phase"), agent_role(record.get("agent"))
+        with self._lock:
+            key = (phase, role, record["status"])
+            self._calls[key] = self._calls.get(key, 0) + 1
+            self._retries[(phase, role)] = self._retries.get((phase, role), 0) + record["retries"]
+            for kind in ("prompt", "completion", "cache_hit"):
+                token_key = (phase, role, kind)
+                self._tokens[token_key] = self._tokens.get(token_key, 0) + record[f"{kind}_tokens"]
+            for name in ("latency", "ttft"):
+                histogram = self._histograms[name].setdefault(phase, {"counts": [0] * len(self.buckets), "sum": 0.0, "count": 0})
+                value = record[name]
+                for i, bound in enumerate(self.buckets):
+                    if value <= bound:
+                        histogram["counts"][i] += 1
+                histogram["sum"] += value
+                histogram["count"] += 1
+
+    def render(self):
+        with self._lock:
+            lines = [
+                "# HELP who_is_spy_llm_calls_total LLM calls by phase, role and status.",
+                "# TYPE who_is_spy_llm_calls_total counter",
+            ]
+            for (phase, role, status), value in sorted(self._calls.items(), key=str):
+                lines.append(f"who_is_spy_llm_calls_total{_labels(phase=phase, role=role, status=status)} {value}")
+            lines += [
+                "# HELP who_is_spy_llm_retries_total Retries spent by LLM calls.",
+                "# TYPE who_is_spy_llm_retries_total counter",
+            ]
+            for (phase, role), value in sorted(self._retries.items(), key=str):
+                lines.append(f"who_is_spy_llm_retries_total{_labels(phase=phase, role=role)} {value}")
+            lines += [
+                "# HELP who_is_spy_llm_tokens_total Tokens used by LLM calls.",
+                "# TYPE who_is_spy_llm_tokens_total counter",
+            ]
+            for (phase, role, kind), value in sorted(self._tokens.items(), key=str):
+                lines.append(f"who_is_spy_llm_tokens_total{_labels(phase=phase, role=role, kind=kind)} {value}")
+            for name, help_text in (("latency", "Wall-clock latency of LLM calls."), ("ttft", "Time to first token of LLM calls.")):
+                metric = f"who_is_spy_llm_{name}_seconds"
+                lines += [f"# HELP {metric} {help_text}", f"# TYPE {metric} histogram"]
+                for phase, histogram in sorted(self._histograms[name].items(), key=str):
+                    for bound, count in zip(self.buckets, histogram["counts"]):
+                        lines.append(f"{metric}_bucket{_labels(phase=phase, le=repr(float(bound)))} {count}")
+                    lines.append(f"{metric}_bucket{_labels(phase=phase, le='+Inf')} {histogram['count']}")
+                    lines.append(f"{metric}_sum{_labels(phase=phase)} {histogram['sum']:.6f}")
+                    lines.append(f"{metric}_count{_labels(phase=phase)} {histogram['count']}")
+        return "\n".join(lines) + "\n"
+
+    def write(self, path):
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(self.render())
+
+
+def _labels(**labels):
+    parts = []
+    for key, value in labels.items():
+        value = "" if value is None else str(value)
+        value = value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+        parts.append(f'{key}="{value}"')
+    return "{" + ",".join(parts) + "}"
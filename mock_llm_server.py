@@ -0,0 +1,343 @@
+"""
+本地的 ChatCompletion 模拟服务，用于在没有真实API Key的情况下离线测试和压测。
+
+- 兼容 POST /v1/chat/completions（普通与 stream=True 的SSE流式返回）
+- 可配置首token延迟分布、生成速度(token/秒)、错误注入（429/500等）
+- 按请求内容返回预置回答：GM生词返回 normal_word=..., spy_word=...；词库批量生词返回多行 普通词|卧底词|类别|难度；
+  发言返回 <think>...</think> + 描述；投票返回 <think>...</think> + `###Vote: 某玩家`（结构化投票时为 {"vote": "某玩家"}）
+- 可按 --bad-vote-rate 注入不规范的投票（缺少投票行、姓名写错或带多余文字），用于测试投票解析和追问
+- 模拟前缀缓存：按消息边界记录见过的前缀，在 usage.prompt_cache_hit_tokens 中返回命中数
+- GET /stats 返回请求计数
+
+用法示例：
+    python mock_llm_server.py --port 8765 --latency lognormal:-0.7,0.4 --token-rate 60 --error-rate 0.02 --bad-vote-rate 0.2
+    OPENAI_API_BASE=http://127.0.0.1:8765/v1 streamlit run who_is_spy.py
+"""
+import argparse
+import hashlib
+import json
+import random
+import re
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from context_policy import estimate_tokens
+
+# (普通词, 卧底词, 类别)
+WORD_PAIRS = [
+    ("苹果", "梨子", "食物"), ("牛奶", "豆浆", "食物"), ("饺子", "包子", "食物"), ("眼镜", "墨镜", "日常用品"),
+    ("蝴蝶", "蜜蜂", "动物"), ("钢琴", "电子琴", "娱乐"), ("口红", "唇膏", "日常用品"), ("警察", "保安", "职业"),
+    ("火锅", "麻辣烫", "食物"), ("地铁", "公交", "交通"),
+]
+
+SPEECHES = [
+    "这个东西很常见，很多人每天都会接触到。",
+    "它有好几种颜色，大小也不太一样。",
+    "我小时候就很喜欢它。",
+    "一般在家里或者商店都能找到。",
+    "它的价格不算贵，大部分人都买得起。",
+    "用的时候需要稍微注意一下。",
+]
+
+
+def parse_latency(spec):
+    """
+    解析延迟分布描述，返回一个无参采样函数（单位：秒）：
+    - "fixed:0.5"
+    - "uniform:0.2,0.8"
+    - "lognormal:mu,sigma"（ln秒）
+    - "normal:mean,std"（截断到0以上）
+    """
+    kind, _, args = spec.partition(":")
+    values = [float(v) for v in args.split(",")] if args else []
+    if kind == "fixed":
+        return lambda: values[0]
+    if kind == "uniform":
+        return lambda: random.uniform(values[0], values[1])
+    if kind == "lognormal":
+        return lambda: random.lognormvariate(values[0], values[1])
+    if kind == "normal":
+        return lambda: max(0.0, random.gauss(values[0], values[1]))
+    raise ValueError(f"未知的延迟分布: {spec}")
+
+
+class PrefixCacheSimulator:
+    """
+    模拟接口侧的前缀缓存：以消息为单位计算累计哈希，命中数为最长已见前缀的token数。
+    """
+
+    def __init__(self, max_entries=100000):
+        self.max_entries = max_entries
+        self._seen = OrderedDict()
+        self._lock = threading.Lock()
+
+    def lookup_and_store(self, messages):
+        digest = hashlib.sha256()
+        tokens = 0
+        hit_tokens = 0
+        prefixes = []
+        for message in messages:
+            digest.update(json.dumps([message.get("role"), message.get("content")], ensure_ascii=False).encode("utf-8"))
+            tokens += estimate_tokens(message.get("content") or "") + 4
+            prefixes.append((digest.hexdigest(), tokens))
+        with self._lock:
+            for key, prefix_tokens in prefixes:
+                if key in self._seen:
+                    hit_tokens = prefix_tokens
+                    self._seen.move_to_end(key)
+                self._seen[key] = True
+            while len(self._seen) > self.max_entries:
+                self._seen.popitem(last=False)
+        return tokens, hit_tokens
+
+
+class MockLLM:
+    """
+    模拟服务的行为配置与统计。
+    """
+
+    def __init__(self, latency="fixed:0.2", token_rate=50.0, error_rate=0.0, error_codes=(429, 500), think_chars=60,
+                 bad_vote_rate=0.0):
+        self.sample_latency = parse_latency(latency)
+        self.token_rate = token_rate
+        self.error_rate = error_rate
+        self.error_codes = tuple(error_codes)
+        self.bad_vote_rate = bad_vote_rate
+        self.think_chars = think_chars
+        self.prefix_cache = PrefixCacheSimulator()
+        self._lock = threading.Lock()
+        self.stats = {"requests": 0, "errors": 0, "in_flight": 0, "max_in_flight": 0, "by_phase": {}}
+
+    def count(self, phase=None, error=False, in_flight_delta=0):
+        with self._lock:
+            if phase is not None:
+                self.stats["requests"] += 1
+                self.stats["by_phase"][phase] = self.stats["by_phase"].get(phase, 0) + 1
+            if error:
+                self.stats["errors"] += 1
+            self.stats["in_flight"] += in_flight_delta
+            self.stats["max_in_flight"] = max(self.stats["max_in_flight"], self.stats["in_flight"])
+
+    def snapshot(self):
+        with self._lock:
+            return json.loads(json.dumps(self.stats))
+
+    def compose_reply(self, messages):
+        """
+        根据最后一条User消息判断阶段并生成预置回答，返回 (phase, text)。
+        """
+        last_user = next((m.get("content") or "" for m in reversed(messages) if m.get("role") == "user"), "")
+        system_text = "\n".join(m.get("content") or "" for m in messages if m.get("role") == "system")
+        think = "<think>" + ("我需要想一想。" * 20)[:self.think_chars] + "</think>\n"
+
+        if "普通词|卧底词" in system_text:
+            match = re.search(r"(\d+)组", last_user)
+            count = int(match.group(1)) if match else 10
+            lines = [
+                f"{normal}|{spy}|{category}|{random.choice(('easy', 'medium', 'hard'))}"
+                for normal, spy, category in random.sample(WORD_PAIRS, min(count, len(WORD_PAIRS)))
+            ]
+            return "word-pool", "\n".join(lines)
+
+        if "normal_word=" in system_text and "生成" in last_user:
+            normal, spy, _ = random.choice(WORD_PAIRS)
+            return "word-gen", f"{think}好的。\nnormal_word={normal}, spy_word={spy}"
+
+        if "只回复一行JSON" in last_user:
+            match = re.search(r"选择：(.+?)；", last_user)
+            candidates = match.group(1).split("、") if match else []
+            target = json.dumps(random.choice(candidates), ensure_ascii=False) if candidates else "null"
+            return "vote-reask", f'{{"vote": {target}}}'
+
+        if "投票" in last_user or "###Vote" in last_user:
+            self_name = _find_self_name(system_text)
+            candidates = [name for name in re.findall(r"^(\S[^:\n{]*): ", last_user, re.MULTILINE) if name != self_name]
+            target = random.choice(candidates) if candidates else "None"
+            if self.bad_vote_rate and random.random() < self.bad_vote_rate:
+                # 不规范的投票：没有投票行 / 姓名前后带多余文字 / 投给不存在的人
+                target = random.choice((None, f"我觉得是{target}吧", "某某"))
+                if target is None:
+                    return "vote", think + random.choice(SPEECHES)
+            if '{"vote"' in last_user:
+                vote = json.dumps(target, ensure_ascii=False) if target != "None" else "null"
+                return "vote", f'{think}{random.choice(SPEECHES)}\n{{"vote": {vote}}}'
+            return "vote", f"{think}{random.choice(SPEECHES)}\n###Vote: {target}"
+
+        return "speak", think + random.choice(SPEECHES)
+
+
+def _find_self_name(system_text):
+    match = re.search(r"名字叫“(.+?)”", system_text)
+    return match.group(1) if match else None
+
+
+class MockHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    mock = None  # 由 MockLLMServer 设置为 MockLLM 实例
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        if self.path.rstrip("/").endswith("/stats"):
+            self._send_json(200, self.mock.snapshot())
+        else:
+            self._send_json(404, {"error": {"message": "not found", "type": "invalid_request_error"}})
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        body = json.loads(self.rfile.read(length) or b"{}")
+        if not self.path.rstrip("/").endswith("/chat/completions"):
+            self._send_json(404, {"error": {"message": "not found", "type": "invalid_request_error"}})
+            return
+
+        mock = self.mock
+        mock.count(in_flight_delta=1)
+        try:
+            messages = body.get("messages", [])
+            phase, text = mock.compose_reply(messages)
+            mock.count(phase=phase)
+            time.sleep(mock.sample_latency())
+
+            if mock.error_rate and random.random() < mock.error_rate:
+                code = random.choice(mock.error_codes)
+                mock.count(error=True)
+                headers = {"Retry-After": "1"} if code == 429 else {}
+                self._send_json(code, {"error": {"message": f"injected error {code}", "type": "mock_error"}}, headers)
+                return
+
+            prompt_tokens, hit_tokens = mock.prefix_cache.lookup_and_store(messages)
+            completion_tokens = estimate_tokens(text)
+            usage = {
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": completion_tokens,
+                "total_tokens": prompt_tokens + completion_tokens,
+                "prompt_cache_hit_tokens": hit_tokens,
+                "prompt_cache_miss_tokens": prompt_tokens - hit_tokens,
+            }
+            if body.get("stream"):
+                self._stream(body.get("model"), text, usage)
+            else:
+                time.sleep(completion_tokens / mock.token_rate if mock.token_rate else 0)
+                self._send_json(200, {
+                    "id": "chatcmpl-" + uuid.uuid4().hex,
+                    "object": "chat.completion",
+                    "created": int(time.time()),
+                    "model": body.get("model"),
+                    "choices": [{"index": 0, "message": {"role": "assistant", "content": text}, "finish_reason": "stop"}],
+                    "usage": usage,
+                })
+        finally:
+            mock.count(in_flight_delta=-1)
+
+    def _stream(self, model, text, usage):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        self.close_connection = True
+        chunk_id = "chatcmpl-" + uuid.uuid4().hex
+        # 每个分片约1个token（中文按字计）
+        delay = 1.0 / self.mock.token_rate if self.mock.token_rate else 0
+        try:
+            for piece in re.findall(r"<[^>]*>|[^\x00-\x7f]|[\x00-\x7f]{1,4}", text):
+                self._send_event({"id": chunk_id, "object": "chat.completion.chunk", "model": model,
+                                  "choices": [{"index": 0, "delta": {"content": piece}, "finish_reason": None}]})
+                time.sleep(delay)
+            self._send_event({"id": chunk_id, "object": "chat.completion.chunk", "model": model,
+                              "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}]})
+            self._send_event({"id": chunk_id, "object": "chat.completion.chunk", "model": model,
+                              "choices": [], "usage": usage})
+            self.wfile.write(b"data: [DONE]\n\n")
+            self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            # 客户端提前结束接收（如解析到投票行后停止）
+            pass
+
+    def _send_event(self, payload):
+        self.wfile.write(b"data: " + json.dumps(payload, ensure_ascii=False).encode("utf-8") + b"\n\n")
+        self.wfile.flush()
+
+    def _send_json(self, code, payload, headers=None):
+        data = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+
+class MockLLMServer:
+    """
+    在后台线程中运行的模拟服务，供压测脚本直接启动：
+        with MockLLMServer(MockLLM(latency="fixed:0.1")) as server:
+            game_engine.configure_api(api_base=server.api_base)
+    """
+
+    def __init__(self, mock=None, host="127.0.0.1", port=0):
+        self.mock = mock or MockLLM()
+        handler = type("BoundMockHandler", (MockHandler,), {"mock": self.mock})
+        self.httpd = ThreadingHTTPServer((host, port), handler)
+        self.httpd.daemon_threads = True
+        self._thread = None
+
+    @property
+    def api_base(self):
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def start(self):
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="本地 ChatCompletion 模拟服务")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", default="fixed:0.2", help="首token延迟分布，如 fixed:0.2 / uniform:0.1,0.5 / lognormal:-1,0.5")
+    parser.add_argument("--token-rate", type=float, default=50.0, help="生成速度(token/秒)，0表示不限")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="错误注入概率")
+    parser.add_argument("--error-codes", default="429,500", help="注入的HTTP错误码，逗号分隔")
+    parser.add_argument("--bad-vote-rate", type=float, default=0.0, help="不规范投票的注入概率")
+    parser.add_argument("--seed", type=int, help="随机种子")
+    args = parser.parse_args(argv)
+
+    if args.seed is not None:
+        random.seed(args.seed)
+    mock = MockLLM(
+        latency=args.latency,
+        token_rate=args.token_rate,
+        error_rate=args.error_rate,
+        error_codes=[int(code) for code in args.error_codes.split(",") if code],
+        bad_vote_rate=args.bad_vote_rate,
+    )
+    server = MockLLMServer(mock, host=args.host, port=args.port)
+    print(f"mock LLM server listening on {server.api_base}")
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.httpd.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+"""
+角色名字：默认从预先整理好的紧凑名字表（名 × 姓，共 4096 种组合）中抽取，
+导入只是两个元组常量，不需要在启动时加载 Faker（导入和构造 Faker 都要几十毫秒）。
+
+名字来源由环境变量 PLAYER_NAME_SOURCE 或 configure_names 设置：
+- "pool"  ：名字表（默认）
+- "faker" ：Faker（首次使用时才导入；未安装时退回名字表）。
+            种子模式下与早先版本生成的名字一致，可继续回放用旧版本录制的缓存
+"""
+import os
+import random
+import threading
+
+FIRST_NAMES = (
+    "James", "Mary", "John", "Linda", "Robert", "Susan", "Michael", "Karen", "David", "Nancy", "William", "Lisa",
+    "Richard", "Betty", "Joseph", "Sandra", "Thomas", "Ashley", "Charles", "Emily", "Daniel", "Donna", "Matthew",
+    "Michelle", "Anthony", "Carol", "Mark", "Amanda", "Steven", "Melissa", "Paul", "Deborah", "Andrew", "Laura",
+    "Joshua", "Rebecca", "Kevin", "Sharon", "Brian", "Cynthia", "George", "Kathleen", "Edward", "Amy", "Ryan",
+    "Angela", "Jacob", "Helen", "Gary", "Anna", "Nicholas", "Brenda", "Eric", "Pamela", "Jonathan", "Emma",
+    "Stephen", "Nicole", "Larry", "Samantha", "Justin", "Katherine", "Scott", "Christine",
+)
+
+LAST_NAMES = (
+    "Smith", "Johnson", "Williams", "Brown", "Jones", "Garcia", "Miller", "Davis", "Rodriguez", "Martinez",
+    "Hernandez", "Lopez", "Gonzalez", "Wilson", "Anderson", "Thomas", "Taylor", "Moore", "Jackson", "Martin", "Lee",
+    "Perez", "Thompson", "White", "Harris", "Sanchez", "Clark", "Ramirez", "Lewis", "Robinson", "Walker", "Young",
+    "Allen", "King", "Wright", "Scott", "Torres", "Nguyen", "Hill", "Flores", "Green", "Adams", "Nelson", "Baker",
+    "Hall", "Rivera", "Campbell", "Mitchell", "Carter", "Roberts", "Gomez", "Phillips", "Evans", "Turner", "Diaz",
+    "Parker", "Cruz", "Edwards", "Collins", "Reyes", "Stewart", "Morris", "Morales", "Murphy",
+)
+
+NAME_SOURCES = ("pool", "faker")
+
+_source = os.getenv("PLAYER_NAME_SOURCE", "pool")
+_faker = None
+_faker_lock = threading.Lock()
+
+
+def configure_names(source):
+    """设置名字来源（见 NAME_SOURCES）。"""
+    global _source
+    if source not in NAME_SOURCES:
+        raise ValueError(f"未知的名字来源: {source}，可选 {NAME_SOURCES}")
+    _source = source
+
+
+def _get_faker():
+    """首次使用时才导入并构造 Faker；未安装时返回 None。"""
+    global _faker
+    with _faker_lock:
+        if _faker is None:
+            try:
+                from faker import Faker
+            except ImportError:
+                return None
+            _faker = Faker()
+        return _faker
+
+
+def _faker_names(count, rng):
+    faker = _get_faker()
+    if faker is None:
+        return None
+    names = []
+    with _faker_lock:
+        while len(names) < count:
+            faker.seed_instance((rng or random).getrandbits(64))
+            name = faker.name()
+            if name not in names:
+                names.append(name)
+    return names
+
+
+def sample_names(count, rng=None):
+    """
+    抽取 count 个互不相同的名字。传入 rng (random.Random) 时，名字完全由 rng 决定，用于可复现的种子模式。
+    """
+    if _source == "faker":
+        names = _faker_names(count, rng)
+        if names is not None:
+            return names
+    combos = len(FIRST_NAMES) * len(LAST_NAMES)
+    picks = (rng or random).sample(range(combos), count)
+    return [f"{FIRST_NAMES[i // len(LAST_NAMES)]} {LAST_NAMES[i % len(LAST_NAMES)]}" for i in picks]
@@ -0,0 +1,171 @@
+"""
+提示词模板与每轮公开发言记录。
+
+消息布局按“共享的、不变的内容在前，角色专属内容在后”排列，
+使同一局内各玩家的请求共享尽可能长的前缀，便于命中接口（DeepSeek）的前缀缓存：
+1) PLAYER_RULES_PROMPT：同一局所有玩家完全相同
+2) SPY_PROMPT / NORMAL_PROMPT：角色名、身份和词
+3) 之后各轮的对话只追加、不插入，历史前缀保持不变
+"""
+
+# ========== GM ==========
+
+GM_WORD_PROMPT = """你是游戏主持人(GM)，名字叫 {agent_name}。
+请想出两个相似但不同的词汇：一个给普通玩家，一个给卧底玩家。
+必须在公开部分最后一行写：normal_word=XXX, spy_word=YYY
+可用 <think>...</think> 表示私有思考。
+"""
+
+GM_WORD_REQUEST = "请生成两个相似的词，并按格式输出。"
+
+GM_PROMPT = """你是游戏主持人(GM)，名字叫{agent_name}。
+本局共 {num_players} 位玩家 + 你（GM）。
+有1位卧底，卧底拿到的词是“{spy_word}”，普通玩家拿到的词是“{normal_word}”。
+你的职责：引导玩家依次发言并统一收集投票。
+请在回答中使用 <think>...</think> 写私有思考。
+"""
+
+# 词库批量生词（word_pool.WordPoolFiller 使用，一次请求生成多组词）
+WORD_POOL_PROMPT = """你是“谁是卧底”游戏的出题人。
+请一次想出 {count} 组词，每组两个词相似但不同：一个给普通玩家，一个给卧底。
+每个词2~6个字，不要带标点或解释。
+每组一行，格式严格为：普通词|卧底词|类别|难度
+类别从以下选择：{categories}
+难度为 easy（差别明显）、medium 或 hard（非常接近）之一。
+只输出词表，不要其他内容。
+"""
+
+WORD_POOL_REQUEST = "请批量生成{count}组词{category_hint}。"
+WORD_POOL_AVOID = "以下词对已经有了，不要重复：{pairs}"
+
+# ========== 玩家 ==========
+
+# 所有玩家共用的规则（同一局内完全相同）
+PLAYER_RULES_PROMPT = """这是一局“谁是卧底”游戏，共 {num_players} 位玩家，其中1位是卧底，卧底拿到的词与其他人相似但不同。
+每轮存活玩家依次发言描述自己的词，然后统一投票，得票最高者被淘汰。
+你要确保不能泄漏自己的词汇，让其他人猜到。
+实际上你要让自己的表述尽可能模糊，也更难让别人猜到。回答尽可能简短，越来简单越好
+{vote_format}
+"""
+
+# 投票格式（Game.vote_mode）："text" 为 `###Vote:` 行；"json" 为结构化投票，公开部分最后一行只写一个JSON对象
+VOTE_FORMATS = {
+    "text": "投票时请使用 `###Vote: 某某玩家` 或 `###Vote: None`。",
+    "json": '投票时请在公开部分最后一行只写一个JSON：{"vote": "某某玩家"}，弃权写 {"vote": null}。',
+}
+
+SPY_PROMPT = """你是一名玩家，名字叫“{agent_name}”。
+你是**卧底**！你的词是“{word}”。
+请隐藏真实身份，不要直说“我是卧底”，描述时要与他人区分。
+你需要学会欺骗，如果你决定你可能猜到了他们的词汇，你可以尝试加入其中，让他们认为你和他们词汇一样。
+也就是说你不能说出{word}
+"""
+
+NORMAL_PROMPT = """你是一名玩家，名字叫“{agent_name}”。
+你是**普通玩家**！你的词是“{word}”。
+你的目标是揪出拿到不同词汇的卧底。
+你不能在你的叙述中出现{word}
+"""
+
+# 提示词变体（锦标赛中按座位选用，对比不同提示词的效果）：{变体名: {"spy": 模板, "normal": 模板}}
+# 模板字段与 SPY_PROMPT / NORMAL_PROMPT 相同：agent_name, word
+PROMPT_VARIANTS = {
+    "default": {"spy": SPY_PROMPT, "normal": NORMAL_PROMPT},
+    "cautious": {
+        "spy": """你是一名玩家，名字叫“{agent_name}”。
+你是**卧底**！你的词是“{word}”。
+先仔细听别人的描述，只说所有相近事物都符合的特征，绝不说出{word}，也不要第一个给出具体细节。
+""",
+        "normal": """你是一名玩家，名字叫“{agent_name}”。
+你是**普通玩家**！你的词是“{word}”。
+描述要笼统但真实，不能出现{word}；重点留意谁的描述和大家对不上。
+""",
+    },
+    "bold": {
+        "spy": """你是一名玩家，名字叫“{agent_name}”。
+你是**卧底**！你的词是“{word}”。
+大胆猜测其他人的词并主动贴近它，必要时把怀疑引向别人。不能说出{word}。
+""",
+        "normal": """你是一名玩家，名字叫“{agent_name}”。
+你是**普通玩家**！你的词是“{word}”。
+给出具体、有辨识度的描述帮助同伴确认身份，不能出现{word}；投票时果断。
+""",
+    },
+}
+
+# ========== 每轮的User消息 ==========
+
+SPEAK_HEADER = "【本轮前面玩家的公开发言】\n"
+SPEAK_EMPTY = "(本轮暂无其他发言)\n"
+SPEAK_SIMULTANEOUS = "(本轮所有玩家同时发言，你看不到其他玩家本轮的发言)\n"
+SPEAK_INSTRUCTION = "\n请你做本轮发言，用<think>...</think>写出私有思考。"
+
+VOTE_HEADER = "【本轮全部公开发言】\n"
+VOTE_INSTRUCTION = "\n请进行投票。使用 `###Vote: 某某玩家` 或 `###Vote: None` 表达你的投票。"
+VOTE_INSTRUCTION_JSON = '\n请进行投票。公开部分最后一行只写JSON：{{"vote": "玩家姓名"}}，弃权写 {{"vote": null}}。可投：{candidates}'
+
+# 结构化投票解析失败时的追问（只追问一次，要求只回复JSON，回答很短）
+VOTE_REASK = '你的上一条回答中{problem}。不要思考，只回复一行JSON：{{"vote": "玩家姓名"}}，只能从以下玩家中选择：{candidates}；弃权回复 {{"vote": null}}。'
+VOTE_REASK_MISSING = "没有找到投票"
+VOTE_REASK_UNKNOWN = "投票对象“{target}”不是存活的玩家"
+
+
+class RoundTranscripts:
+    """
+    一局游戏共享的、只追加的每轮公开发言记录。
+    每条发言只格式化一次；发言/投票提示按 (类型, 轮次, 发言条数) 只渲染一次，
+    所有玩家的对话引用同一个字符串对象，而不是各自拼接一份副本。
+    """
+
+    def __init__(self):
+        self._speeches = {}   # {round: [(speaker, public_text), ...]}
+        self._lines = {}      # {round: ["speaker: text\n", ...]}
+        self._rendered = {}   # {(kind, round, count): str}
+
+    def start_round(self, round_no):
+        self._speeches[round_no] = []
+        self._lines[round_no] = []
+
+    def add(self, round_no, speaker, public_text):
+        self._speeches[round_no].append((speaker, public_text))
+        self._lines[round_no].append(f"{speaker}: {public_text}\n")
+
+    def speeches(self, round_no):
+        """返回某一轮的 [(speaker, public_text), ...]（不存在时返回空列表）。"""
+        return self._speeches.get(round_no, [])
+
+    def speak_prompt(self, round_no, count=None):
+        """
+        第 round_no 轮、已有 count 条发言时的发言提示（count 默认为当前条数）。
+        """
+        lines = self._lines[round_no]
+        count = len(lines) if count is None else count
+        key = ("speak", round_no, count)
+        if key not in self._rendered:
+            body = "".join(lines[:count]) if count else SPEAK_EMPTY
+            self._rendered[key] = SPEAK_HEADER + body + SPEAK_INSTRUCTION
+        return self._rendered[key]
+
+    def simultaneous_speak_prompt(self, round_no):
+        """
+        同时发言时第 round_no 轮的发言提示（不含本轮任何发言，所有玩家共用同一个字符串）。
+        """
+        key = ("simultaneous", round_no)
+        if key not in self._rendered:
+            self._rendered[key] = SPEAK_HEADER + SPEAK_SIMULTANEOUS + SPEAK_INSTRUCTION
+        return self._rendered[key]
+
+    def vote_prompt(self, round_no, candidates=None):
+        """
+        第 round_no 轮全部发言结束后的投票提示（所有投票者共用同一个字符串）。
+        给出 candidates（存活玩家姓名列表）时使用结构化（JSON）投票的说明，并列出可投的玩家。
+        """
+        lines = self._lines[round_no]
+        key = ("vote", round_no, len(lines), tuple(candidates or ()))
+        if key not in self._rendered:
+            if candidates:
+                instruction = VOTE_INSTRUCTION_JSON.format(candidates="、".join(candidates))
+            else:
+                instruction = VOTE_INSTRUCTION
+            self._rendered[key] = VOTE_HEADER + "".join(lines) + instruction
+        return self._rendered[key]
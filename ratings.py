@@ -0,0 +1,128 @@
+"""
+锦标赛评分：TrueSkill 风格的贝叶斯评分，每个参赛者的技能为高斯分布 mu ± sigma，
+每局按“卧底队 vs 平民队”做一次更新（矩匹配，可逐局增量更新）。
+
+- 队伍表现：卧底队 = 卧底 + 角色偏置；平民队 = 平民技能的平均（人数不同也可比较）
+- 角色偏置 ROLE_SPY 作为虚拟参赛者加入卧底队，吸收“卧底本身更容易/更难赢”的差异，
+  参赛者不会因为多当几次卧底而评分偏高或偏低
+- 同一参赛者可以占多个座位（甚至两队都有），按其在两队的权重之差参与更新
+- 95% 置信区间 = mu ± 1.96·sigma；排行榜按保守分 mu - 3·sigma 排序
+另外统计每个参赛者按座位计的胜率（Wilson 置信区间），以及当卧底时的胜率。
+"""
+import math
+
+MU = 25.0
+SIGMA = MU / 3
+BETA = SIGMA / 2
+TAU = SIGMA / 100
+
+# 角色偏置的虚拟参赛者名
+ROLE_SPY = "<卧底角色偏置>"
+
+
+def _pdf(x):
+    return math.exp(-x * x / 2) / math.sqrt(2 * math.pi)
+
+
+def _cdf(x):
+    return 0.5 * (1 + math.erf(x / math.sqrt(2)))
+
+
+def wilson_interval(wins, games, z=1.96):
+    """胜率的 Wilson 置信区间 (low, high)；games 为0时返回 (0.0, 1.0)。"""
+    if games == 0:
+        return 0.0, 1.0
+    p = wins / games
+    denom = 1 + z * z / games
+    center = (p + z * z / (2 * games)) / denom
+    half = z * math.sqrt(p * (1 - p) / games + z * z / (4 * games * games)) / denom
+    return max(0.0, center - half), min(1.0, center + half)
+
+
+class RatingTable:
+    """
+    参赛者评分表：update() 每局调用一次，leaderboard() 随时给出当前排行。
+    """
+
+    def __init__(self, mu=MU, sigma=SIGMA, beta=BETA, tau=TAU):
+        self.mu = mu
+        self.sigma = sigma
+        self.beta = beta
+        self.tau = tau
+        self.games = 0
+        # {name: {"mu", "sigma"}}；角色偏置从0开始（先验为卧底与平民机会均等）
+        self.ratings = {ROLE_SPY: {"mu": 0.0, "sigma": sigma}}
+        self.records = {}   # {name: {"seats", "wins", "spy_seats", "spy_wins"}}
+
+    def rating(self, name):
+        return self.ratings.setdefault(name, {"mu": self.mu, "sigma": self.sigma})
+
+    def update(self, spy, civilians, spy_won):
+        """
+        记录一局结果：spy 为卧底座位的参赛者，civilians 为各平民座位的参赛者列表（可重复）。
+        """
+        self.games += 1
+        # 每个参赛者在表现差（胜方 - 负方）中的系数
+        weights = {spy: 1.0, ROLE_SPY: 1.0}
+        for name in civilians:
+            weights[name] = weights.get(name, 0.0) - 1.0 / len(civilians)
+        if not spy_won:
+            weights = {name: -w for name, w in weights.items()}
+        weights = {name: w for name, w in weights.items() if w != 0.0}
+
+        for name in weights:
+            rating = self.rating(name)
+            rating["sigma"] = math.sqrt(rating["sigma"] ** 2 + self.tau ** 2)
+        c2 = 2 * self.beta ** 2 + sum(w * w * self.rating(name)["sigma"] ** 2 for name, w in weights.items())
+        c = math.sqrt(c2)
+        t = sum(w * self.rating(name)["mu"] for name, w in weights.items()) / c
+        v = _pdf(t) / max(_cdf(t), 1e-12)
+        w_factor = v * (v + t)
+        for name, w in weights.items():
+            rating = self.rating(name)
+            var = rating["sigma"] ** 2
+            rating["mu"] += w * var / c * v
+            rating["sigma"] = math.sqrt(var * max(1 - w * w * var / c2 * w_factor, 1e-6))
+
+        self._count(spy, spy_won, is_spy=True)
+        for name in civilians:
+            self._count(name, not spy_won, is_spy=False)
+
+    def _count(self, name, won, is_spy):
+        record = self.records.setdefault(name, {"seats": 0, "wins": 0, "spy_seats": 0, "spy_wins": 0})
+        record["seats"] += 1
+        record["wins"] += int(won)
+        if is_spy:
+            record["spy_seats"] += 1
+            record["spy_wins"] += int(won)
+
+    def leaderboard(self):
+        """
+        按保守分 mu - 3·sigma 从高到低返回每个参赛者的：
+        name / mu / sigma / ci_low / ci_high / conservative / seats / win_rate / win_ci_low / win_ci_high /
+        spy_seats / spy_win_rate
+        """
+        rows = []
+        for name, record in self.records.items():
+            rating = self.rating(name)
+            win_low, win_high = wilson_interval(record["wins"], record["seats"])
+            rows.append({
+                "name": name,
+                "mu": rating["mu"],
+                "sigma": rating["sigma"],
+                "ci_low": rating["mu"] - 1.96 * rating["sigma"],
+                "ci_high": rating["mu"] + 1.96 * rating["sigma"],
+                "conservative": rating["mu"] - 3 * rating["sigma"],
+                "seats": record["seats"],
+                "win_rate": record["wins"] / record["seats"],
+                "win_ci_low": win_low,
+                "win_ci_high": win_high,
+                "spy_seats": record["spy_seats"],
+                "spy_win_rate": record["spy_wins"] / record["spy_seats"] if record["spy_seats"] else None,
+            })
+        rows.sort(key=lambda row: row["conservative"], reverse=True)
+        return rows
+
+    def role_bias(self):
+        """角色偏置的当前估计（正值表示卧底方更容易赢）。"""
+        return dict(self.ratings[ROLE_SPY])
@@ -0,0 +1,195 @@
+"""
+进程级的LLM请求调度器：同一个 Streamlit 服务上的所有会话共用，
+- 全局并发上限 max_concurrency（同时进行中的请求数）
+- 会话之间轮询（round-robin）放行，一个会话的一大批投票请求不会饿死其他会话
+- 统计排队深度、等待时间
+- 页面关闭/断开的会话：排队中的请求被取消（已发出的请求照常完成）
+
+generate_reply 在真正请求接口前调用 acquire，拿到名额后才发出请求，结束后 release；
+排队时间计入调用的截止时间（LLMClient.call_deadline），到期仍未拿到名额时抛出 LLMTimeoutError。
+"""
+import threading
+import time
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+
+from llm_client import LLMError, LLMTimeoutError
+from metrics import percentile
+
+
+class RequestCancelled(LLMError):
+    """会话已被取消（页面关闭或断开），排队中的请求不再发送。"""
+
+
+class _Ticket:
+    __slots__ = ("session_id", "enqueued", "granted", "state")
+
+    def __init__(self, session_id):
+        self.session_id = session_id
+        self.enqueued = time.monotonic()
+        self.granted = None
+        self.state = "queued"   # queued / granted / cancelled
+
+
+class RequestScheduler:
+    """
+    - max_concurrency ：全局同时进行中的请求数上限
+    - is_alive        ：session_id -> bool，判断会话是否仍然在线；排队等待期间（无论是否有请求被放行）
+                        每 reap_interval 秒检查一次，不在线的会话其排队请求全部取消，之后的新请求直接拒绝。
+                        None 表示不检查
+    - wait_window     ：统计等待时间分位数时保留的最近样本数
+    session_id 为 None 的请求（如后台预取词库）作为一个单独的会话参与轮询。
+    """
+
+    def __init__(self, max_concurrency=8, is_alive=None, reap_interval=2.0, wait_window=1000):
+        self.max_concurrency = max_concurrency
+        self.is_alive = is_alive
+        self.reap_interval = reap_interval
+        self._cond = threading.Condition()
+        self._queues = OrderedDict()   # {session_id: deque[_Ticket]}，顺序即轮询顺序
+        self._in_flight = {}           # {session_id: 进行中的请求数}
+        self._cancelled = set()
+        self._last_reap = time.monotonic()
+        self._waits = deque(maxlen=wait_window)
+        self.granted = 0
+        self.cancelled = 0
+        self.timed_out = 0
+        self.max_queue_depth = 0
+
+    def acquire(self, session_id=None, deadline=None):
+        """
+        排队等待一个请求名额，返回凭据（交给 release）；会话被取消时抛出 RequestCancelled。
+        deadline 为截止时间（time.monotonic 时间），到期仍未拿到名额时撤出队列并抛出 LLMTimeoutError。
+        """
+        with self._cond:
+            if session_id in self._cancelled or not self._alive(session_id):
+                self.cancelled += 1
+                raise RequestCancelled("会话已取消，请求未发送")
+            ticket = _Ticket(session_id)
+            self._queues.setdefault(session_id, deque()).append(ticket)
+            self.max_queue_depth = max(self.max_queue_depth, self._queue_depth())
+            self._dispatch()
+            while ticket.state == "queued":
+                # 每次放行都会唤醒全部等待者，繁忙时等待不会超时：按时间间隔检查断开的会话，而不是只在超时后检查
+                now = time.monotonic()
+                if now - self._last_reap >= self.reap_interval:
+                    self._reap()
+                    if ticket.state != "queued":
+                        break
+                timeout = self._last_reap + self.reap_interval - now
+                if deadline is not None:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self._withdraw(ticket)
+                        self.timed_out += 1
+                        raise LLMTimeoutError("排队等待请求名额超过了调用截止时间")
+                    timeout = min(timeout, remaining)
+                self._cond.wait(max(0.0, timeout))
+            if ticket.state == "cancelled":
+                raise RequestCancelled("会话已取消，排队中的请求未发送")
+            self._waits.append(ticket.granted - ticket.enqueued)
+            return ticket
+
+    def release(self, ticket):
+        with self._cond:
+            session_id = ticket.session_id
+            self._in_flight[session_id] -= 1
+            if not self._in_flight[session_id]:
+                del self._in_flight[session_id]
+            self._dispatch()
+
+    @contextmanager
+    def slot(self, session_id=None):
+        ticket = self.acquire(session_id)
+        try:
+            yield ticket
+        finally:
+            self.release(ticket)
+
+    def touch(self, session_id):
+        """会话仍然在线（如页面rerun）：清除取消标记，之后的请求正常排队。"""
+        with self._cond:
+            self._cancelled.discard(session_id)
+
+    def cancel_session(self, session_id):
+        """取消会话排队中的全部请求，并拒绝它之后的新请求（直到 touch）。返回取消的请求数。"""
+        with self._cond:
+            return self._cancel_locked(session_id)
+
+    def stats(self):
+        """
+        返回 in_flight / queue_depth / max_queue_depth / sessions / granted / cancelled / timed_out /
+        wait_mean / wait_p50 / wait_p95（秒，最近 wait_window 次放行）。
+        """
+        with self._cond:
+            waits = list(self._waits)
+            return {
+                "max_concurrency": self.max_concurrency,
+                "in_flight": sum(self._in_flight.values()),
+                "queue_depth": self._queue_depth(),
+                "max_queue_depth": self.max_queue_depth,
+                "sessions": len(set(self._queues) | set(self._in_flight)),
+                "granted": self.granted,
+                "cancelled": self.cancelled,
+                "timed_out": self.timed_out,
+                "wait_mean": sum(waits) / len(waits) if waits else 0.0,
+                "wait_p50": percentile(waits, 50),
+                "wait_p95": percentile(waits, 95),
+            }
+
+    def _queue_depth(self):
+        return sum(len(queue) for queue in self._queues.values())
+
+    def _dispatch(self):
+        """在并发上限内按会话轮询放行排队的请求（调用方持有锁）。"""
+        granted = False
+        while sum(self._in_flight.values()) < self.max_concurrency and self._queues:
+            session_id, queue = next(iter(self._queues.items()))
+            ticket = queue.popleft()
+            # 被放行的会话移到队尾，下一个名额让给其他会话
+            del self._queues[session_id]
+            if queue:
+                self._queues[session_id] = queue
+            ticket.state = "granted"
+            ticket.granted = time.monotonic()
+            self._in_flight[session_id] = self._in_flight.get(session_id, 0) + 1
+            self.granted += 1
+            granted = True
+        if granted:
+            self._cond.notify_all()
+
+    def _withdraw(self, ticket):
+        """把排队中的凭据撤出队列（调用方持有锁）。"""
+        queue = self._queues.get(ticket.session_id)
+        if queue is not None and ticket in queue:
+            queue.remove(ticket)
+            if not queue:
+                del self._queues[ticket.session_id]
+        ticket.state = "cancelled"
+
+    def _cancel_locked(self, session_id):
+        self._cancelled.add(session_id)
+        queue = self._queues.pop(session_id, None) or ()
+        for ticket in queue:
+            ticket.state = "cancelled"
+        self.cancelled += len(queue)
+        if queue:
+            self._cond.notify_all()
+        return len(queue)
+
+    def _alive(self, session_id):
+        return self.is_alive is None or session_id is None or self.is_alive(session_id)
+
+    def _reap(self):
+        """
+        取消已不在线的会话的排队请求（调用方持有锁）。
+        已不在线的会话不再保留取消标记：刷新页面会得到新的 session_id，旧的不会再 touch，
+        它之后的请求由 acquire 中的在线检查拒绝。
+        """
+        self._last_reap = time.monotonic()
+        if self.is_alive is None:
+            return
+        for session_id in list(self._queues):
+            if not self._alive(session_id):
+                self._cancel_locked(session_id)
+        self._cancelled = {session_id for session_id in self._cancelled if self._alive(session_id)}
@@ -0,0 +1,126 @@
+"""
+启动耗时压测：用 `python -X importtime` 在子进程中导入各模块，统计导入耗时，防止启动变慢。
+- 每个模块先预热一次（写入字节码缓存），再跑 runs 次取中位数
+- 列出导入最慢的依赖（按累计耗时）
+- 检查不联网的导入路径上没有加载重型依赖（openai / faker / streamlit 等）
+- 可与基线结果比较：导入耗时超过 基线 × (1 + tolerance) 时视为退化
+有检查未通过时以退出码 1 结束，可直接放进CI。
+
+用法示例：
+    python startup_bench.py
+    python startup_bench.py --modules game_engine,batch_sim --runs 10 --output startup.json
+    python startup_bench.py --baseline startup.json --tolerance 0.3
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+# 默认测量的模块（批量模拟/锦标赛的工作进程和各命令行工具的导入路径）
+DEFAULT_MODULES = ("game_engine", "batch_sim", "tournament", "word_pool", "game_log", "ratings", "transcript_export")
+# 这些模块的导入路径上不应出现的重型依赖（只在真正请求接口或打开界面时才加载）
+HEAVY_MODULES = ("openai", "faker", "streamlit", "requests", "aiohttp", "numpy", "pandas", "pyarrow")
+DEFAULT_BUDGET_MS = 150.0
+
+
+def parse_importtime(stderr):
+    """
+    解析 -X importtime 的输出，返回 [(模块名, 自身微秒, 累计微秒, 层级), ...]（按输出顺序）。
+    """
+    entries = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|", 2)
+        depth = (len(name) - len(name.lstrip())) // 2
+        entries.append((name.strip(), int(self_us), int(cumulative_us), depth))
+    return entries
+
+
+def measure_import(module, runs=5, python=sys.executable, cwd=None):
+    """
+    在子进程中导入 module，返回：
+    module / import_ms（该模块累计导入耗时的中位数）/ wall_ms（子进程总耗时中位数，含解释器启动）/
+    loaded（导入的全部顶层包名）/ slowest（累计耗时最高的若干依赖 [(名, 毫秒)]）
+    """
+    env = dict(os.environ)
+    # 预热一次写入字节码缓存，之后测到的是正常启动（不含编译源码）的耗时
+    env.pop("PYTHONDONTWRITEBYTECODE", None)
+    command = [python, "-X", "importtime", "-c", f"import {module}"]
+    subprocess.run(command, cwd=cwd, env=env, capture_output=True, text=True, check=True)
+    import_times, wall_times = [], []
+    entries = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        result = subprocess.run(command, cwd=cwd, env=env, capture_output=True, text=True, check=True)
+        wall_times.append(time.perf_counter() - start)
+        entries = parse_importtime(result.stderr)
+        # 子模块先于父模块输出，最后一条就是 module 本身
+        import_times.append(entries[-1][2])
+    # 上一个顶层条目之后的都是 module 的依赖（之前的是解释器启动时 site 等导入的模块）
+    first = next((i + 1 for i in range(len(entries) - 2, -1, -1) if entries[i][3] == 0), 0)
+    own = entries[first:]
+    slowest = sorted(((name, cumulative / 1000) for name, _, cumulative, _ in own[:-1]),
+                     key=lambda item: item[1], reverse=True)[:8]
+    return {
+        "module": module,
+        "import_ms": statistics.median(import_times) / 1000,
+        "wall_ms": statistics.median(wall_times) * 1000,
+        "loaded": sorted({name.split(".")[0] for name, _, _, _ in own}),
+        "slowest": slowest,
+    }
+
+
+def check(result, budget_ms, baseline=None, tolerance=0.3):
+    """返回该模块未通过的检查项（字符串列表）。"""
+    problems = []
+    heavy = [name for name in HEAVY_MODULES if name in result["loaded"]]
+    if heavy:
+        problems.append(f"导入了重型依赖: {', '.join(heavy)}")
+    if result["import_ms"] > budget_ms:
+        problems.append(f"导入耗时 {result['import_ms']:.1f}ms 超过预算 {budget_ms:.0f}ms")
+    if baseline is not None and result["import_ms"] > baseline * (1 + tolerance):
+        problems.append(f"导入耗时 {result['import_ms']:.1f}ms 比基线 {baseline:.1f}ms 慢了超过 {tolerance:.0%}")
+    return problems
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="谁是卧底 启动耗时压测（python -X importtime）")
+    parser.add_argument("--modules", default=",".join(DEFAULT_MODULES), help="要测量的模块，逗号分隔")
+    parser.add_argument("--runs", type=int, default=5, help="每个模块测量的次数（取中位数）")
+    parser.add_argument("--budget-ms", type=float, default=DEFAULT_BUDGET_MS, help="每个模块的导入耗时预算（毫秒）")
+    parser.add_argument("--baseline", help="基线结果JSON（之前 --output 的输出）")
+    parser.add_argument("--tolerance", type=float, default=0.3, help="相对基线允许变慢的比例")
+    parser.add_argument("--output", help="结果JSON输出路径")
+    args = parser.parse_args(argv)
+
+    cwd = os.path.dirname(os.path.abspath(__file__))
+    baseline = {}
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = {row["module"]: row["import_ms"] for row in json.load(f)["results"]}
+
+    rows = []
+    failed = False
+    print(f"{'module':<14} {'import ms':>9} {'wall ms':>8}  slowest")
+    for module in filter(None, (name.strip() for name in args.modules.split(","))):
+        row = measure_import(module, args.runs, cwd=cwd)
+        row["problems"] = check(row, args.budget_ms, baseline.get(module), args.tolerance)
+        rows.append(row)
+        slowest = ", ".join(f"{name} {ms:.1f}" for name, ms in row["slowest"][:4])
+        print(f"{module:<14} {row['import_ms']:>9.1f} {row['wall_ms']:>8.1f}  {slowest}")
+        for problem in row["problems"]:
+            failed = True
+            print(f"  !! {problem}")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({"config": vars(args), "results": rows}, f, ensure_ascii=False, indent=2)
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+"""
+流式解析器 ThinkStreamParser：标签被拆在片段之间时的暂存、</think> 之后的处理，
+以及投票行的检测（含 close 时没有换行结尾的最后一行）。
+"""
+import pytest
+
+from game_engine import ThinkStreamParser, parse_vote_json
+
+
+class Collector:
+    def __init__(self, **kwargs):
+        self.private = []
+        self.public = []
+        self.votes = []
+        self.parser = ThinkStreamParser(on_private=self.private.append, on_public=self.public.append,
+                                        on_vote=self.votes.append, **kwargs)
+
+    def feed_all(self, chunks):
+        return [self.parser.feed(chunk) for chunk in chunks]
+
+    @property
+    def private_text(self):
+        return "".join(self.private)
+
+    @property
+    def public_text(self):
+        return "".join(self.public)
+
+
+@pytest.mark.parametrize("chunks", [
+    ["<think>想一想</think>大家好"],
+    ["<th", "ink>想一想</think>大家好"],
+    ["<", "t", "h", "i", "n", "k", ">想一想<", "/", "think>大家好"],
+    ["<think>想一想</thi", "nk>大家好"],
+    ["<think>想一想<", "/think>大", "家好"],
+])
+def test_tags_split_across_chunks(chunks):
+    c = Collector()
+    c.feed_all(chunks)
+    c.parser.close()
+    assert c.private_text == "想一想"
+    assert c.public_text == "大家好"
+    assert c.parser.text == "".join(chunks)
+
+
+def test_tag_prefix_is_held_back_until_resolved():
+    c = Collector()
+    c.parser.feed("<think>想一想</thi")
+    # "</thi" 可能是结束标签的开头，暂不输出
+    assert c.private_text == "想一想"
+    c.parser.feed("nk>说")
+    assert c.private_text == "想一想"
+    assert c.public_text == "说"
+
+
+def test_reply_without_think():
+    c = Collector()
+    c.feed_all(["我觉得这个东西", "很常见 a < b", "，大家都用过<"])
+    c.parser.close()
+    assert c.private == []
+    assert c.public_text == "我觉得这个东西很常见 a < b，大家都用过<"
+
+
+def test_text_after_think_is_public_even_if_it_looks_like_a_tag():
+    c = Collector()
+    c.feed_all(["<think>嗯</think>", "我会写<think>标签"])
+    c.parser.close()
+    assert c.private_text == "嗯"
+    assert c.public_text == "我会写<think>标签"
+
+
+def test_vote_line_detected_when_newline_arrives():
+    c = Collector(stop_on_vote=True)
+    stops = c.feed_all(["<think>嗯</think>发言\n###Vo", "te: Player_A", "\n后面的内容"])
+    assert stops == [False, False, True]
+    assert c.votes == ["Player_A"]
+    assert c.parser.vote == "Player_A"
+
+
+def test_vote_on_last_line_without_newline_found_at_close():
+    c = Collector(stop_on_vote=True)
+    stops = c.feed_all(["<think>嗯</think>我投给他\n", "###Vote: Player_B"])
+    # 没有换行时还不能确定这一行已经结束
+    assert stops == [False, False]
+    assert c.votes == []
+    c.parser.close()
+    assert c.votes == ["Player_B"]
+
+
+def test_vote_inside_think_is_ignored():
+    c = Collector()
+    c.feed_all(["<think>###Vote: Player_A\n</think>", "###Vote: Player_B"])
+    c.parser.close()
+    assert c.votes == ["Player_B"]
+
+
+def test_only_first_vote_line_counts():
+    c = Collector()
+    c.feed_all(["###Vote: Player_A\n###Vote: Player_B\n"])
+    c.parser.close()
+    assert c.votes == ["Player_A"]
+
+
+def test_json_vote_line():
+    c = Collector(stop_on_vote=True, parse_vote=parse_vote_json)
+    stops = c.feed_all(['<think>嗯</think>理由……\n{"vote": ', '"Player_C"}\n'])
+    assert stops == [False, True]
+    assert c.votes == ["Player_C"]
@@ -0,0 +1,119 @@
+"""
+结构化投票的纯函数：parse_vote_json / resolve_vote_target / is_abstain_vote，
+以及提前结束收集投票的条件 Game.votes_decided。
+"""
+import pytest
+
+from game_engine import Game, is_abstain_vote, parse_vote_json, resolve_vote_target
+
+CANDIDATES = ["Player_John Smith", "Player_Mary Jones", "Player_Mary Brown", "Player_李娜"]
+
+
+@pytest.mark.parametrize("raw, expected", [
+    # 精确匹配（忽略大小写、空白、引号、Markdown标记和末尾标点）
+    ("Player_John Smith", "Player_John Smith"),
+    ("**player_john  smith**。", "Player_John Smith"),
+    ("“Player_李娜”", "Player_李娜"),
+    # 候选姓名出现在投票文本中
+    ("我投给 Player_John Smith", "Player_John Smith"),
+    # 投票文本是唯一一个候选姓名的一部分
+    ("John", "Player_John Smith"),
+    ("Jones", "Player_Mary Jones"),
+    # 拼写错误
+    ("Player_Jon Smith", "Player_John Smith"),
+    ("Player_Mary Jnoes", "Player_Mary Jones"),
+    ("Mary Jnoes", "Player_Mary Jones"),
+    # 同时是多个候选的一部分：不猜
+    ("Mary", None),
+    # 太短的片段不做部分匹配
+    ("J", None),
+    # 不在候选中
+    ("Player_Zed", None),
+    # 弃权与空值
+    ("None", None),
+    ("弃权", None),
+    ("", None),
+    (None, None),
+])
+def test_resolve_vote_target(raw, expected):
+    assert resolve_vote_target(raw, CANDIDATES) == expected
+
+
+def test_resolve_vote_target_only_considers_candidates():
+    # 已淘汰的玩家不在候选中，只能匹配到存活的玩家
+    assert resolve_vote_target("Player_Mary Jones", ["Player_Mary Brown"]) is None
+
+
+@pytest.mark.parametrize("text, expected", [
+    ('{"vote": "Player_John Smith"}', "Player_John Smith"),
+    ('我的理由如下。\n{"reason": "描述太笼统", "vote": "Player_李娜"}', "Player_李娜"),
+    ('{"Vote": " Player_John Smith "}', "Player_John Smith"),
+    # 多个对象时以最后一个含 vote 的为准
+    ('{"vote": "A"}\n改主意了：{"vote": "B"}\n{"note": "x"}', "B"),
+    # null 表示弃权（与 `###Vote: None` 一致），不是解析失败
+    ('{"vote": null}', "None"),
+    # JSON不合法时宽松匹配
+    ("{'vote': 'Player_John Smith'}", "Player_John Smith"),
+    ("{vote: Player_李娜}", "Player_李娜"),
+    ("{'vote'：“Player_李娜”}", "Player_李娜"),
+    ("{'vote': ''}", "None"),
+    # 没有投票
+    ('{"reason": "还没想好"}', None),
+    ("我投给 Player_John Smith", None),
+    ("", None),
+])
+def test_parse_vote_json(text, expected):
+    assert parse_vote_json(text) == expected
+
+
+@pytest.mark.parametrize("raw, expected", [
+    ("None", True),
+    ("null", True),
+    ("`None`", True),
+    ("弃权", True),
+    ("", True),
+    # 解析失败不是弃权：collect_vote 会追问一次
+    (None, False),
+    ("Player_John Smith", False),
+])
+def test_is_abstain_vote(raw, expected):
+    assert is_abstain_vote(raw) is expected
+
+
+def make_game(alive=(1, 2, 3, 4, 5)):
+    game = Game()
+    game.agent_names = ["GM_X", "Player_A", "Player_B", "Player_C", "Player_D", "Player_E"]
+    game.active_players = list(alive)
+    return game
+
+
+def votes(*targets):
+    """按座位 1、2、… 的顺序构造 collect_vote 的结果；None 表示请求失败或未投票。"""
+    return {idx: {"target": target} for idx, target in enumerate(targets, start=1)}
+
+
+@pytest.mark.parametrize("results, total, expected", [
+    # 领先票数多于未收到的票数：剩余的票全投给第二名也追不上
+    (votes("Player_A", "Player_A", "Player_A"), 5, True),
+    (votes("Player_A", "Player_A", "Player_A", "Player_B"), 5, True),
+    # 领先票数 == 未收到的票数：剩余的票可以追平，不能提前结束
+    (votes("Player_A", "Player_A"), 4, False),
+    (votes("Player_A", "Player_A", "Player_B"), 4, False),
+    (votes("Player_A", "Player_A", "Player_A", "Player_B"), 6, False),
+    # 全部收到时，平票不算已决定（领先 0 不多于剩余 0），有领先者才算
+    (votes("Player_A", "Player_B"), 2, False),
+    (votes("Player_A", "Player_A", "Player_B"), 3, True),
+    # 弃权/失败的票不计入任何人
+    (votes(None, None, "Player_A"), 3, True),
+    (votes(None, None), 3, False),
+    ({1: None, 2: {"target": "Player_A"}}, 2, True),
+    ({}, 5, False),
+])
+def test_votes_decided(results, total, expected):
+    assert make_game().votes_decided(results, total) is expected
+
+
+def test_votes_decided_ignores_eliminated_targets():
+    # 投给已淘汰玩家的票不计入
+    game = make_game(alive=(1, 2, 3))
+    assert not game.votes_decided(votes("Player_E", "Player_E", "Player_E"), 3)
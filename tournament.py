@@ -0,0 +1,248 @@
+"""
+锦标赛：让不同的模型 / 采样参数 / 提示词变体（参赛者）在大量对局中同场竞技，
+按座位轮换、按词对轮换，多局并行（共享一个全局并发预算），每局结束后增量更新评分并输出排行榜。
+
+参赛者写法（--entrant 可重复）：名称:键=值,键=值
+    键：model、variant（prompts.PROMPT_VARIANTS 中的变体名）、temperature、top_p、presence_penalty、frequency_penalty
+或在 --config 指定的JSON文件中给出：
+    {"entrants": [{"name": "...", "model": "...", "params": {...}, "prompt_variant": "..."}],
+     "word_pairs": [["苹果", "梨子"], ...]}
+
+用法示例：
+    python tournament.py --games 200 --players 5 --parallel 8 --api-budget 16 \\
+        --entrant "稳健:temperature=0.3,variant=cautious" --entrant "激进:temperature=1.0,variant=bold" \\
+        --entrant "默认:temperature=0.7" --word-pairs 苹果/梨子,牛奶/豆浆,饺子/包子 \\
+        --output tournament.jsonl --ratings ratings.json --transcripts transcripts/
+"""
+import argparse
+import json
+import random
+import sys
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import game_engine
+import prompts
+from game_engine import DEFAULT_GENERATION_PARAMS, SPEECH_MODES, VOTE_MODES, Game
+from llm_cache import LLMCache
+from llm_client import LLMClient
+from ratings import RatingTable
+from scheduler import RequestScheduler
+from transcript_export import FORMATS, TranscriptWriter
+from word_pool import WordPool
+
+# 单局最多进行的轮数（连续平票/无效投票时防止死循环）
+DEFAULT_MAX_ROUNDS = 20
+
+
+def parse_entrant(spec):
+    """
+    解析 "名称:键=值,键=值" → {"name", "model", "params", "prompt_variant"}。
+    """
+    name, _, options = spec.partition(":")
+    entrant = {"name": name.strip(), "model": None, "params": {}, "prompt_variant": "default"}
+    for option in filter(None, (part.strip() for part in options.split(","))):
+        key, _, value = option.partition("=")
+        key, value = key.strip(), value.strip()
+        if key == "model":
+            entrant["model"] = value
+        elif key == "variant":
+            entrant["prompt_variant"] = value
+        elif key in DEFAULT_GENERATION_PARAMS:
+            entrant["params"][key] = float(value)
+        else:
+            raise ValueError(f"未知的参赛者设置: {key}")
+    if entrant["prompt_variant"] not in prompts.PROMPT_VARIANTS:
+        raise ValueError(f"未知的提示词变体: {entrant['prompt_variant']}，可选 {list(prompts.PROMPT_VARIANTS)}")
+    return entrant
+
+
+def parse_word_pairs(spec):
+    """'苹果/梨子,牛奶/豆浆' → [("苹果", "梨子"), ("牛奶", "豆浆")]"""
+    pairs = []
+    for item in filter(None, (part.strip() for part in spec.split(","))):
+        normal_word, _, spy_word = item.partition("/")
+        pairs.append((normal_word.strip(), spy_word.strip()))
+    return pairs
+
+
+def schedule_games(entrants, num_games, num_players, word_pairs=None, seed=0):
+    """
+    生成对局安排：每局 {"index", "seed", "seats": [参赛者名, ...], "words": (普通词, 卧底词) 或 None}。
+    座位从打乱的参赛者袋子中不放回地抽取、抽完再补，各参赛者出场次数均衡；
+    卧底座位由每局的种子决定，因此各参赛者当卧底的机会也均衡。词对按顺序轮换。
+    """
+    rng = random.Random(seed)
+    names = [entrant["name"] for entrant in entrants]
+    bag = []
+    games = []
+    for i in range(num_games):
+        seats = []
+        while len(seats) < num_players:
+            if not bag:
+                bag = names[:]
+                rng.shuffle(bag)
+            seats.append(bag.pop())
+        words = word_pairs[i % len(word_pairs)] if word_pairs else None
+        games.append({"index": i, "seed": seed + i, "seats": seats, "words": words})
+    return games
+
+
+def play_tournament_game(spec, entrants_by_name, game_kwargs, word_pool=None, max_rounds=DEFAULT_MAX_ROUNDS,
+                         transcripts=None):
+    """
+    跑完一局锦标赛对局，返回 Game.outcome() 加上座位安排：
+    "seats" {玩家名: 参赛者名}、"spy_entrant"、"civilian_entrants"。
+    给出 transcripts（TranscriptWriter）时，同时写出本局的列式记录。
+    """
+    seat_configs = {}
+    for idx, entrant_name in enumerate(spec["seats"], start=1):
+        entrant = entrants_by_name[entrant_name]
+        seat_configs[idx] = {"model": entrant["model"], "params": entrant["params"], "prompt_variant": entrant["prompt_variant"]}
+    game = Game(seed=spec["seed"], seat_configs=seat_configs, word_pool=word_pool, **game_kwargs)
+    # 每局在调度器中是一个独立会话，各局之间轮询分配并发名额
+    game.session_id = game.game_id
+    if spec["words"]:
+        game.setup_game(len(spec["seats"]), "用户提供", *spec["words"])
+    else:
+        game.setup_game(len(spec["seats"]), "AI GM自动")
+    while not game.game_over and game.round_index < max_rounds:
+        game.run_one_round()
+    if transcripts is not None:
+        transcripts.add_game(game)
+    outcome = game.outcome()
+    outcome["seats"] = {game.agent_names[idx]: name for idx, name in enumerate(spec["seats"], start=1)}
+    outcome["spy_entrant"] = spec["seats"][game.spy_index - 1]
+    outcome["civilian_entrants"] = [name for idx, name in enumerate(spec["seats"], start=1) if idx != game.spy_index]
+    return outcome
+
+
+def run_tournament(entrants, schedule, parallel=4, game_kwargs=None, word_pool=None, max_rounds=DEFAULT_MAX_ROUNDS,
+                   on_result=None, transcripts=None):
+    """
+    在线程池中并行跑完 schedule 中的全部对局，按完成顺序逐局更新评分。
+    on_result(outcome, table) 在每局结束（评分更新后）调用；单局异常记录为 {"error": ...}。
+    返回 (RatingTable, 全部结果列表)。
+    """
+    entrants_by_name = {entrant["name"]: entrant for entrant in entrants}
+    table = RatingTable()
+    results = []
+    with ThreadPoolExecutor(max_workers=parallel) as executor:
+        futures = {
+            executor.submit(play_tournament_game, spec, entrants_by_name, game_kwargs or {}, word_pool, max_rounds,
+                            transcripts): spec
+            for spec in schedule
+        }
+        for future in as_completed(futures):
+            spec = futures[future]
+            try:
+                outcome = future.result()
+            except Exception as e:
+                outcome = {"index": spec["index"], "seats": spec["seats"], "error": f"{e.__class__.__name__}: {e}"}
+            # 未分胜负（超过最大轮数）或出错的对局不计入评分
+            if outcome.get("winner"):
+                table.update(outcome["spy_entrant"], outcome["civilian_entrants"], outcome["winner"] == "卧底")
+            results.append(outcome)
+            if on_result is not None:
+                on_result(outcome, table)
+    return table, results
+
+
+def print_leaderboard(table, out=sys.stdout):
+    print(f"已评分 {table.games} 局", file=out)
+    print(f"{'参赛者':<12} {'评分':>6} {'95%区间':>15} {'座位':>5} {'胜率':>6} {'胜率95%区间':>13} {'卧底胜率':>8}", file=out)
+    for row in table.leaderboard():
+        spy_rate = f"{row['spy_win_rate']:.0%}" if row["spy_win_rate"] is not None else "-"
+        print(
+            f"{row['name']:<12} {row['mu']:>6.1f} {row['ci_low']:>7.1f}~{row['ci_high']:<7.1f} {row['seats']:>5} "
+            f"{row['win_rate']:>6.0%} {row['win_ci_low']:>6.0%}~{row['win_ci_high']:<6.0%} {spy_rate:>8}",
+            file=out,
+        )
+    bias = table.role_bias()
+    print(f"卧底角色偏置：{bias['mu']:+.1f} ± {1.96 * bias['sigma']:.1f}（正值表示卧底方更容易赢）", file=out)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="谁是卧底 锦标赛（模型/参数/提示词变体对比）")
+    parser.add_argument("--config", help="参赛者与词对的JSON配置文件")
+    parser.add_argument("--entrant", action="append", default=[], help="参赛者，如 '稳健:temperature=0.3,variant=cautious'")
+    parser.add_argument("--games", type=int, default=50, help="总局数")
+    parser.add_argument("--players", type=int, default=5, help="每局玩家数")
+    parser.add_argument("--parallel", type=int, default=4, help="同时进行的对局数")
+    parser.add_argument("--api-budget", type=int, default=8, help="所有对局共用的同时请求数上限")
+    parser.add_argument("--rate-limit", type=float, help="所有对局共用的每秒请求数上限")
+    parser.add_argument("--vote-concurrency", type=int, default=5)
+    parser.add_argument("--vote-mode", default="text", choices=VOTE_MODES, help="投票方式：text(###Vote行) / json(结构化+追问)")
+    parser.add_argument("--vote-short-circuit", action="store_true", help="本轮结果确定后停止收集剩余投票")
+    parser.add_argument("--speech-mode", default="sequential", choices=SPEECH_MODES,
+                        help="发言方式：sequential(依次) / pipelined(依次，流水线请求) / simultaneous(同时发言规则)")
+    parser.add_argument("--max-rounds", type=int, default=DEFAULT_MAX_ROUNDS)
+    parser.add_argument("--word-pairs", help="轮换使用的词对，如 苹果/梨子,牛奶/豆浆（不给出时由AI GM或词库出词）")
+    parser.add_argument("--word-pool", help="预取词库文件(SQLite)路径，未给出 --word-pairs 时从中取词")
+    parser.add_argument("--seed", type=int, default=0, help="对局安排的随机种子（第i局使用 seed+i）")
+    parser.add_argument("--cache", help="LLM回答缓存文件(SQLite)路径")
+    parser.add_argument("--cache-mode", default="record", choices=["record", "replay"])
+    parser.add_argument("--api-base", help="接口地址（默认读取 OPENAI_API_BASE）")
+    parser.add_argument("--model", help="参赛者未指定模型时使用的模型（默认读取 OPENAI_MODEL）")
+    parser.add_argument("--output", help="逐局结果输出的JSONL文件路径")
+    parser.add_argument("--ratings", help="每局结束后重写的排行榜JSON文件路径")
+    parser.add_argument("--transcripts", help="列式对局记录的数据集目录（每次运行追加一个分片）")
+    parser.add_argument("--transcript-format", default="parquet", choices=list(FORMATS))
+    parser.add_argument("--report-every", type=int, default=10, help="每完成多少局打印一次排行榜")
+    args = parser.parse_args(argv)
+
+    entrants = []
+    word_pairs = parse_word_pairs(args.word_pairs) if args.word_pairs else []
+    if args.config:
+        with open(args.config, encoding="utf-8") as f:
+            config = json.load(f)
+        for item in config.get("entrants", []):
+            entrants.append({"model": None, "params": {}, "prompt_variant": "default", **item})
+        word_pairs = word_pairs or [tuple(pair) for pair in config.get("word_pairs", [])]
+    entrants += [parse_entrant(spec) for spec in args.entrant]
+    if len(entrants) < 2:
+        parser.error("至少需要2个参赛者（--entrant 或 --config）")
+
+    game_engine.configure_api(api_base=args.api_base, model=args.model)
+    game_engine.configure_scheduler(RequestScheduler(args.api_budget))
+    if args.rate_limit:
+        game_engine.configure_client(LLMClient(rate=args.rate_limit))
+    if args.cache:
+        game_engine.configure_cache(LLMCache(args.cache, mode=args.cache_mode))
+    word_pool = WordPool(args.word_pool) if args.word_pool and not word_pairs else None
+
+    schedule = schedule_games(entrants, args.games, args.players, word_pairs, args.seed)
+    output = open(args.output, "w", encoding="utf-8") if args.output else None
+    transcripts = TranscriptWriter(args.transcripts, format=args.transcript_format) if args.transcripts else None
+
+    def on_result(outcome, table):
+        if output is not None:
+            output.write(json.dumps(outcome, ensure_ascii=False) + "\n")
+            output.flush()
+        if args.ratings:
+            with open(args.ratings, "w", encoding="utf-8") as f:
+                json.dump({"games": table.games, "role_bias": table.role_bias(), "leaderboard": table.leaderboard()},
+                          f, ensure_ascii=False, indent=2)
+        if table.games and table.games % args.report_every == 0 and outcome.get("winner"):
+            print_leaderboard(table, out=sys.stderr)
+
+    try:
+        table, results = run_tournament(
+            entrants, schedule, parallel=args.parallel,
+            game_kwargs={"vote_concurrency": args.vote_concurrency, "vote_mode": args.vote_mode,
+                         "vote_short_circuit": args.vote_short_circuit, "speech_mode": args.speech_mode},
+            word_pool=word_pool,
+            max_rounds=args.max_rounds, on_result=on_result, transcripts=transcripts,
+        )
+    finally:
+        if output is not None:
+            output.close()
+        if transcripts is not None:
+            transcripts.close()
+    errors = sum(1 for r in results if "error" in r)
+    if errors:
+        print(f"{errors} 局出错，未计入评分", file=sys.stderr)
+    print_leaderboard(table)
+
+
+if __name__ == "__main__":
+    main()
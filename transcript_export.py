@@ -0,0 +1,367 @@
+"""
+对局记录的列式导出（Parquet / Arrow IPC），用于离线分析大量对局（如调整提示词）。
+
+每局展开为若干行，kind 为：
+- speech     ：公开发言（text）
+- think      ：<think> 私有思考（phase 为 word-gen / speak / vote / vote-reask）
+- vote       ：投票，player 投给 target，target_role 为被投者的身份；无效投票 target 为空，原始投票写在 text
+- eliminated ：被淘汰的玩家
+- outcome    ：每局一行，player 为卧底，round 为总轮数
+每行都带上整局的 normal_word / spy_word / word_source / num_players / rounds / winner，分组统计时不需要再关联。
+player / role / kind / phase / target / 词等低基数列为字典编码（int32 索引 + 字典），game_id 和 text 为普通字符串。
+
+数据集是一个目录：每个 TranscriptWriter 写一个新的分片文件（part-*.parquet 或 part-*.arrow），只追加、不改写已有文件。
+行先缓存在内存里，每满 batch_rows 行写出一个批次（Parquet 行组 / IPC 记录批），内存占用有上限；
+字典列的取值只追加（IPC 中以字典增量写出），某一列的不同取值超过 max_dictionary 时换一个新分片。
+分片写完（close）后才改成正式文件名，读取时不会读到写了一半的文件。
+pyarrow 只在真正写出或查询时才导入。
+
+用法示例：
+    python transcript_export.py export --game-log game_log.sqlite3 --out transcripts/
+    python transcript_export.py query --path transcripts/ --report spy-win-rate --by normal_word,spy_word,rounds
+    python transcript_export.py query --path transcripts/ --report vote-accuracy --by round
+    python batch_sim.py --games 1000 --transcripts transcripts/
+"""
+import argparse
+import glob
+import json
+import os
+import sys
+import threading
+import time
+import uuid
+
+import prompts
+from game_engine import extract_think_and_public
+
+# (列名, 类型)：dict 为字典编码的字符串列
+COLUMNS = (
+    ("game_id", "string"),
+    ("round", "int16"),
+    ("kind", "dict"),
+    ("phase", "dict"),
+    ("player", "dict"),
+    ("role", "dict"),
+    ("target", "dict"),
+    ("target_role", "dict"),
+    ("text", "string"),
+    ("normal_word", "dict"),
+    ("spy_word", "dict"),
+    ("word_source", "dict"),
+    ("num_players", "int8"),
+    ("rounds", "int16"),
+    ("winner", "dict"),
+)
+FORMATS = {"parquet": ".parquet", "arrow": ".arrow"}
+REPORTS = ("spy-win-rate", "vote-accuracy")
+
+_REASK_PREFIX = prompts.VOTE_REASK[:prompts.VOTE_REASK.index("{")]
+
+
+def _pyarrow():
+    try:
+        import pyarrow
+    except ImportError as e:
+        raise ImportError("导出/查询对局记录需要 pyarrow：pip install pyarrow") from e
+    return pyarrow
+
+
+def arrow_schema():
+    pa = _pyarrow()
+    types = {
+        "string": pa.string(), "int8": pa.int8(), "int16": pa.int16(),
+        "dict": pa.dictionary(pa.int32(), pa.string()),
+    }
+    return pa.schema([(name, types[kind]) for name, kind in COLUMNS])
+
+
+def _message_phase(previous_user):
+    """根据回答前的一条User消息判断这条回答属于哪个阶段。"""
+    if previous_user is None:
+        return "word-gen"
+    if previous_user.startswith(prompts.SPEAK_HEADER):
+        return "speak"
+    if previous_user.startswith(prompts.VOTE_HEADER):
+        return "vote"
+    if previous_user.startswith(_REASK_PREFIX):
+        return "vote-reask"
+    return "word-gen"
+
+
+def game_rows(game):
+    """
+    把一局游戏（Game，实时运行或从事件日志重放均可）展开为行的列表 [{列名: 值}, ...]，按轮次排序。
+    """
+    role_of = {}
+    for idx, name in enumerate(game.agent_names):
+        role_of[name] = "gm" if idx == 0 else ("spy" if idx == game.spy_index else "civilian")
+    base = {
+        "game_id": game.game_id, "normal_word": game.normal_word, "spy_word": game.spy_word,
+        "word_source": game.word_source, "num_players": game.num_players, "rounds": game.round_index,
+        "winner": game.winner,
+    }
+    rows = []
+
+    def add(**fields):
+        rows.append({**base, **fields})
+
+    for name in game.agent_names:
+        previous_user = None
+        for message in game.conversations[name]:
+            if message["role"] == "user":
+                previous_user = message["content"]
+            elif message["role"] == "assistant":
+                thoughts, _ = extract_think_and_public(message["content"])
+                if thoughts:
+                    add(round=message["round"], kind="think", phase=_message_phase(previous_user),
+                        player=name, role=role_of[name], text=thoughts)
+    for round_no in range(1, game.round_index + 1):
+        for speaker, text in game.transcripts.speeches(round_no):
+            add(round=round_no, kind="speech", phase="speak", player=speaker, role=role_of[speaker], text=text)
+    for record in game.vote_history:
+        for voter, target in record["votes"].items():
+            valid = target in role_of
+            add(round=record["round"], kind="vote", phase="vote", player=voter, role=role_of[voter],
+                target=target if valid else None, target_role=role_of[target] if valid else None,
+                text=None if valid else target)
+        eliminated = record["eliminated"]
+        if eliminated is not None:
+            add(round=record["round"], kind="eliminated", player=eliminated, role=role_of[eliminated])
+    if game.spy_index is not None:
+        add(round=game.round_index, kind="outcome", player=game.agent_names[game.spy_index], role="spy")
+    # 稳定排序：同一轮内依次为 思考、发言、投票、淘汰
+    rows.sort(key=lambda row: row["round"])
+    return rows
+
+
+class TranscriptWriter:
+    """
+    只追加的列式写出器（线程安全）：add_game / add_rows 写入，close 结束当前分片。
+    - path           ：数据集目录
+    - format         ："parquet" 或 "arrow"（Arrow IPC 文件）
+    - batch_rows     ：每个批次的行数（内存中最多缓存这么多行）
+    - max_dictionary ：单个字典列最多的不同取值数，超过时换新分片
+    - compression    ：压缩算法（parquet / arrow 均支持 zstd、lz4 等；None 不压缩）
+    """
+
+    def __init__(self, path, format="parquet", batch_rows=10000, max_dictionary=65536, compression="zstd"):
+        if format not in FORMATS:
+            raise ValueError(f"未知的导出格式: {format}，可选 {list(FORMATS)}")
+        self.path = path
+        self.format = format
+        self.batch_rows = batch_rows
+        self.max_dictionary = max_dictionary
+        self.compression = compression
+        self.rows = 0
+        self.batches = 0
+        self.files = []
+        self._lock = threading.Lock()
+        self._pending = {name: [] for name, _ in COLUMNS}
+        self._pending_rows = 0
+        self._writer = None
+        self._part_path = None
+        self._dictionaries = {}
+        os.makedirs(path, exist_ok=True)
+
+    def add_game(self, game):
+        self.add_rows(game_rows(game))
+
+    def add_rows(self, rows):
+        with self._lock:
+            for row in rows:
+                for name, _ in COLUMNS:
+                    self._pending[name].append(row.get(name))
+            self._pending_rows += len(rows)
+            if self._pending_rows >= self.batch_rows:
+                self._flush()
+
+    def flush(self):
+        with self._lock:
+            self._flush()
+
+    def close(self):
+        """写出缓存的行并结束当前分片（之后再写入会开一个新分片）。"""
+        with self._lock:
+            self._flush()
+            self._close_part()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _flush(self):
+        if not self._pending_rows:
+            return
+        pa = _pyarrow()
+        schema = arrow_schema()
+        # 新取值会让某个字典超过上限时，先结束当前分片（字典随分片重新开始）
+        for name, kind in COLUMNS:
+            if kind == "dict":
+                known = self._dictionaries.get(name, {})
+                new_values = {v for v in self._pending[name] if v is not None and v not in known}
+                if known and len(known) + len(new_values) > self.max_dictionary:
+                    self._close_part()
+                    break
+        arrays = []
+        for name, kind in COLUMNS:
+            values = self._pending[name]
+            if kind == "dict":
+                index = self._dictionaries.setdefault(name, {})
+                indices = [None if v is None else index.setdefault(v, len(index)) for v in values]
+                arrays.append(pa.DictionaryArray.from_arrays(pa.array(indices, pa.int32()), pa.array(list(index), pa.string())))
+            else:
+                arrays.append(pa.array(values, schema.field(name).type))
+        batch = pa.record_batch(arrays, schema=schema)
+        if self._writer is None:
+            self._open_part(schema)
+        self._writer.write_batch(batch)
+        self.rows += self._pending_rows
+        self.batches += 1
+        self._pending = {name: [] for name, _ in COLUMNS}
+        self._pending_rows = 0
+
+    def _open_part(self, schema):
+        pa = _pyarrow()
+        name = f"part-{time.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:8]}{FORMATS[self.format]}"
+        self._part_path = os.path.join(self.path, name)
+        # 写入期间使用点号开头的临时名（读取数据集时会被忽略）
+        temp_path = os.path.join(self.path, "." + name + ".inprogress")
+        if self.format == "parquet":
+            import pyarrow.parquet as pq
+            self._writer = pq.ParquetWriter(temp_path, schema, compression=self.compression)
+        else:
+            options = pa.ipc.IpcWriteOptions(emit_dictionary_deltas=True, compression=self.compression)
+            self._writer = pa.ipc.new_file(temp_path, schema, options=options)
+
+    def _close_part(self):
+        if self._writer is None:
+            return
+        self._writer.close()
+        temp_path = os.path.join(self.path, "." + os.path.basename(self._part_path) + ".inprogress")
+        os.replace(temp_path, self._part_path)
+        self.files.append(self._part_path)
+        self._writer = None
+        self._part_path = None
+        self._dictionaries = {}
+
+
+# ========== 查询 ==========
+
+def load_transcripts(path, columns=None, kinds=None):
+    """
+    读取数据集目录下的全部分片（Parquet 和 Arrow 可混合），返回 pyarrow.Table（各分片的字典已统一）。
+    columns 为要读取的列（默认全部），kinds 为只保留的行类型（如 ["outcome"]）。
+    """
+    _pyarrow()
+    import pyarrow.dataset as ds
+    parts = []
+    for format, ext in FORMATS.items():
+        files = sorted(glob.glob(os.path.join(path, f"part-*{ext}")))
+        if files:
+            parts.append(ds.dataset(files, format="parquet" if format == "parquet" else "ipc"))
+    if not parts:
+        return arrow_schema().empty_table().select(columns or [name for name, _ in COLUMNS])
+    dataset = parts[0] if len(parts) == 1 else ds.dataset(parts)
+    row_filter = ds.field("kind").isin(list(kinds)) if kinds else None
+    return dataset.to_table(columns=columns, filter=row_filter).unify_dictionaries()
+
+
+def _group_rates(table, by, flag_column, total_name, hits_name, rate_name, count_column=None):
+    """按 by 分组，统计 flag_column（0/1）的总数和命中数，返回按总数从多到少排序的 dict 列表。"""
+    aggregates = [(flag_column, "sum"), (count_column or flag_column, "count")]
+    grouped = table.group_by(list(by)).aggregate(aggregates)
+    rows = []
+    for row in grouped.to_pylist():
+        total = row[f"{count_column or flag_column}_count"]
+        hits = row[f"{flag_column}_sum"] or 0
+        rows.append({**{key: row[key] for key in by}, total_name: total, hits_name: hits,
+                     rate_name: hits / total if total else None})
+    rows.sort(key=lambda item: (-item[total_name], [str(item[key]) for key in by]))
+    return rows
+
+
+def spy_win_rate(path, by=("normal_word", "spy_word")):
+    """
+    卧底胜率：按 by（outcome 行的任意列，如 normal_word / spy_word / rounds / num_players）分组，
+    返回 [{...分组列, "games", "spy_wins", "spy_win_rate"}, ...]。未分胜负的对局不计入。
+    """
+    pa = _pyarrow()
+    import pyarrow.compute as pc
+    table = load_transcripts(path, columns=sorted(set(by) | {"winner"}), kinds=["outcome"])
+    table = table.filter(pc.is_valid(table["winner"]))
+    spy_won = pc.cast(pc.equal(pc.cast(table["winner"], pa.string()), "卧底"), pa.int32())
+    return _group_rates(table.append_column("spy_won", spy_won), by, "spy_won", "games", "spy_wins", "spy_win_rate")
+
+
+def vote_accuracy(path, by=("round",)):
+    """
+    投票命中率：按 by 分组，返回 [{...分组列, "votes", "on_spy", "accuracy", "invalid"}, ...]；
+    accuracy 为投给卧底的票数 / 有效票数，invalid 为无效票（未投或投给不存在的人）数。
+    """
+    pa = _pyarrow()
+    import pyarrow.compute as pc
+    table = load_transcripts(path, columns=sorted(set(by) | {"target", "target_role"}), kinds=["vote"])
+    valid = pc.is_valid(table["target"])
+    on_spy = pc.cast(pc.equal(pc.cast(table["target_role"], pa.string()), "spy"), pa.int32())
+    invalid = pc.cast(pc.invert(valid), pa.int32())
+    rows = _group_rates(table.filter(valid).append_column("on_spy", pc.filter(on_spy, valid)),
+                        by, "on_spy", "votes", "on_spy", "accuracy")
+    invalid_counts = table.append_column("invalid", invalid).group_by(list(by)).aggregate([("invalid", "sum")])
+    invalid_by_key = {tuple(row[key] for key in by): row["invalid_sum"] for row in invalid_counts.to_pylist()}
+    for row in rows:
+        row["invalid"] = invalid_by_key.get(tuple(row[key] for key in by), 0)
+    return rows
+
+
+# ========== 命令行 ==========
+
+def export_game_log(game_log_path, out, format="parquet", status="finished", batch_rows=10000):
+    """把事件日志中的对局逐局重放并导出，返回 TranscriptWriter（已关闭）。"""
+    from game_engine import Game
+    from game_log import GameLog
+    log = GameLog(game_log_path)
+    with TranscriptWriter(out, format=format, batch_rows=batch_rows) as writer:
+        for summary in log.list_games(status=status, limit=None):
+            game = Game.load(log, summary["game_id"])
+            if game is not None:
+                writer.add_game(game)
+    log.close()
+    return writer
+
+
+def print_report(rows, out=sys.stdout):
+    for row in rows:
+        print(json.dumps(row, ensure_ascii=False), file=out)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="谁是卧底 对局记录列式导出与查询")
+    commands = parser.add_subparsers(dest="command", required=True)
+    export = commands.add_parser("export", help="从对局事件日志导出")
+    export.add_argument("--game-log", required=True, help="对局事件日志文件(SQLite)路径")
+    export.add_argument("--out", required=True, help="数据集目录")
+    export.add_argument("--format", default="parquet", choices=list(FORMATS))
+    export.add_argument("--status", default="finished", help="只导出该状态的对局（all 为全部）")
+    export.add_argument("--batch-rows", type=int, default=10000)
+    query = commands.add_parser("query", help="常用统计")
+    query.add_argument("--path", required=True, help="数据集目录")
+    query.add_argument("--report", default="spy-win-rate", choices=REPORTS)
+    query.add_argument("--by", help="分组列，逗号分隔（默认 spy-win-rate 按词对，vote-accuracy 按轮次）")
+    args = parser.parse_args(argv)
+
+    if args.command == "export":
+        writer = export_game_log(args.game_log, args.out, args.format, None if args.status == "all" else args.status,
+                                 args.batch_rows)
+        print(f"导出 {writer.rows} 行（{writer.batches} 个批次）到 {', '.join(writer.files) or '(无对局)'}")
+        return
+    by = tuple(filter(None, (key.strip() for key in args.by.split(",")))) if args.by else None
+    if args.report == "spy-win-rate":
+        print_report(spy_win_rate(args.path, by or ("normal_word", "spy_word")))
+    else:
+        print_report(vote_accuracy(args.path, by or ("round",)))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,72 +1,92 @@
-import streamlit as st
-import openai
+import argparse
 import os
-import re
-import random
-from faker import Faker
-
-fake = Faker()
-
-# 如果你在环境变量里设了OPENAI_API_KEY，此处留空或省略即可
-openai.api_key = os.getenv("OPENAI_API_KEY", "xxxxxxx")
-# (可选) 如果需要走代理/自定义 Endpoint，在此修改：
-openai.api_base = "https://api.deepseek.com/v1"
-
-# ========== 全局工具函数 ==========
-
-def generate_reply(messages):
-    """
-    调用OpenAI ChatCompletion接口，返回生成文本。
-    这里会读取若干生成参数: temperature, top_p, presence_penalty, frequency_penalty
-    """
-    temp = st.session_state.get("temperature", 0.7)
-    top_p = st.session_state.get("top_p", 1.0)
-    presence_pen = st.session_state.get("presence_penalty", 0.0)
-    freq_pen = st.session_state.get("frequency_penalty", 0.0)
-    try:
-        response = openai.ChatCompletion.create(
-            model="deepseek-chat",
-            messages=messages,
-            temperature=temp,
-            top_p=top_p,
-            presence_penalty=presence_pen,
-            frequency_penalty=freq_pen,
-        )
-        return response.choices[0].message.content.strip()
-    except Exception as e:
-        return f"[ERROR]: {str(e)}"
-
-def extract_think_and_public(text):
-    """
-    从文本中提取 <think>...</think> (私有思考) 和公开部分。
-    若未匹配到<think>，则返回 (None, text)。
-    """
-    pattern = r"<think>(.*?)</think>"
-    match = re.search(pattern, text, re.DOTALL)
-    if match:
-        private_thoughts = match.group(1).strip()
-        public_text = re.sub(pattern, "", text, count=1, flags=re.DOTALL).strip()
-        return private_thoughts, public_text
-    else:
-        return None, text
-
-def parse_vote_from_text(public_text):
-    """
-    固定投票格式: 在公开文本中使用 `###Vote: 某某玩家` 或 `###Vote: None`
-    若没找到则返回 None
-    """
-    pattern = r"^###Vote:\s*(.+)$"
-    lines = public_text.splitlines()
-    for line in lines:
-        line = line.strip()
-        m = re.match(pattern, line, re.IGNORECASE)
-        if m:
-            return m.group(1)
-    return None
-
-def generate_random_name():
-    """使用Faker生成一个随机人名"""
-    return fake.name()
+import json
+import sys
+import time
+import uuid
+import streamlit as st
+from streamlit import runtime
+from streamlit.runtime.scriptrunner import get_script_run_ctx
+import game_engine
+import metrics
+from game_engine import Game
+from game_log import EventConflict, GameLog
+from llm_cache import LLMCache
+from scheduler import RequestCancelled, RequestScheduler
+from word_pool import CATEGORIES, WordPool, WordPoolFiller
+from context_policy import FullHistoryPolicy, WindowPolicy
+
+# 回答缓存文件
+CACHE_PATH = "llm_cache.sqlite3"
+# 对局事件日志文件（刷新页面/重启服务后可恢复对局）
+GAME_LOG_PATH = "game_log.sqlite3"
+CACHE_MODE_LABELS = {"关闭": "off", "记录": "record", "回放(不联网)": "replay"}
+CONTEXT_POLICY_LABELS = {"完整历史": "full", "最近N轮+早前摘要": "digest", "最近N轮(丢弃更早)": "drop"}
+VOTE_MODE_LABELS = {"文本(###Vote)": "text", "结构化(JSON+追问)": "json"}
+SPEECH_MODE_LABELS = {"依次发言": "sequential", "依次发言(流水线请求)": "pipelined", "同时发言(只看之前轮次)": "simultaneous"}
+# 所有会话共用的同时请求数上限
+MAX_CONCURRENT_REQUESTS = int(os.getenv("LLM_MAX_CONCURRENCY", "8"))
+# 预取词库文件
+WORD_POOL_PATH = "word_pool.sqlite3"
+DIFFICULTY_LABELS = {"任意": None, "简单": "easy", "中等": "medium", "困难": "hard"}
+# 聊天记录/对话记录每页显示的轮数
+HISTORY_ROUNDS_PER_PAGE = 3
+# 已结束轮次渲染结果的进程级缓存：最多保留的条目数、保留秒数
+RENDER_CACHE_MAX_ENTRIES = 512
+RENDER_CACHE_TTL = 3600
+
+# ========== Streamlit 界面回调 ==========
+
+class StreamlitReporter:
+    """
+    把游戏引擎的输出渲染到Streamlit页面上（只能在Streamlit主线程中使用）。
+    """
+
+    def reply(self, title, text):
+        with st.expander(title):
+            st.write(text)
+
+    def stream_reply(self, title):
+        return StreamlitStreamSink(title)
+
+    def markdown(self, text):
+        st.markdown(text)
+
+    def info(self, text):
+        st.info(text)
+
+    def warning(self, text):
+        st.warning(text)
+
+    def success(self, text):
+        st.success(text)
+
+class StreamlitStreamSink:
+    """
+    流式回答的展示：私有思考实时写入折叠的 expander，公开发言实时显示在页面上。
+    """
+
+    def __init__(self, title):
+        self.private_text = ""
+        self.public_text = ""
+        with st.expander(title):
+            self.private_box = st.empty()
+        self.public_box = st.empty()
+
+    def private(self, text):
+        self.private_text += text
+        self.private_box.markdown(self.private_text)
+
+    def public(self, text):
+        self.public_text += text
+        self.public_box.markdown(self.public_text)
+
+    def vote(self, target):
+        pass
+
+    def close(self, full_text):
+        # 结束后expander中展示完整回答（与非流式模式一致）
+        self.private_box.write(full_text)
 
 # ========== 初始化/重置 SessionState ==========
 
@@ -77,28 +97,13 @@ def init_session_state():
     if "initialized" not in st.session_state:
         st.session_state.initialized = True
 
-        # 游戏控制
-        st.session_state.game_inited = False
-        st.session_state.game_over = False
-        st.session_state.num_players = 0
-
-        # 人员 & 对话
-        st.session_state.agent_names = []
-        st.session_state.conversations = {}      # {name: [ {role, content}, ...], ...}
-        st.session_state.public_messages = {}     # {name: "上一轮公开发言"}
-        st.session_state.active_players = []      # 当前存活玩家（仅玩家，下标 1~N）
-        st.session_state.round_index = 0
-
-        # 卧底/词汇
-        st.session_state.spy_index = None
-        st.session_state.normal_word = ""
-        st.session_state.spy_word = ""
+        # 本页面的所有者标识：只能列出和恢复自己创建的对局（写在URL参数 ?owner=... 中，刷新页面后不变）
+        st.session_state.owner = st.query_params.get("owner") or uuid.uuid4().hex
+        st.query_params["owner"] = st.session_state.owner
 
-        # 结果
-        st.session_state.winner = None
-
-        # 公共聊天记录（跨轮累积，列表[(speaker, public_text), ...]）
-        st.session_state.public_chat_history = []
+        # 当前游戏的ID（游戏状态保存在事件日志中，每次rerun从日志重建）
+        # 页面刷新后从URL参数 ?game=... 恢复
+        st.session_state.game_id = st.query_params.get("game")
 
         # 默认OpenAI生成参数
         st.session_state.temperature = 0.7
@@ -106,278 +111,287 @@ def init_session_state():
         st.session_state.presence_penalty = 0.0
         st.session_state.frequency_penalty = 0.0
 
-# ========== 主要游戏流程函数 ==========
-
-def setup_game(num_players, word_option, user_normal_word="", user_spy_word=""):
-    """
-    初始化游戏逻辑：
-    1) 重置状态
-    2) 根据 word_option 使用用户提供词汇或让AI GM生成(含<think>)，解析后存入session_state
-    3) 随机指定1位玩家为卧底（注意：active_players只包含玩家，下标 1~num_players）
-    4) 给GM、卧底玩家、普通玩家分别下发 system prompt
-    5) 初始化 active_players
-    """
-    # 重置状态
-    st.session_state.game_inited = True
-    st.session_state.game_over = False
-    st.session_state.round_index = 0
-    st.session_state.num_players = num_players
-    st.session_state.winner = None
-    st.session_state.public_chat_history = []
-
-    # 清空旧数据
-    st.session_state.agent_names = []
-    st.session_state.conversations = {}
-    st.session_state.public_messages = {}
-    st.session_state.spy_index = None
-    st.session_state.normal_word = ""
-    st.session_state.spy_word = ""
-    st.session_state.active_players = []
-
-    # 生成角色：GM + num_players个玩家
-    gm_name = "GM_" + generate_random_name()
-    player_names = ["Player_" + generate_random_name() for _ in range(num_players)]
-    st.session_state.agent_names = [gm_name] + player_names
-
-    # 初始化每个角色的对话列表
-    for name in st.session_state.agent_names:
-        st.session_state.conversations[name] = []
-        st.session_state.public_messages[name] = ""
-
-    # 处理词汇来源
-    if word_option == "用户提供":
-        st.session_state.normal_word = user_normal_word.strip()
-        st.session_state.spy_word = user_spy_word.strip()
-        GM_SYSTEM_PROMPT = f"""你是游戏主持人(GM)，名字叫{{agent_name}}。
-本局单词由用户指定：
-- 普通玩家：{st.session_state.normal_word}
-- 卧底：{st.session_state.spy_word}
-你的职责：引导游戏继续。
-在回答中使用<think>...</think>写私有思考。
-"""
-        st.session_state.conversations[gm_name].append({"role": "system", "content": GM_SYSTEM_PROMPT.format(agent_name=gm_name)})
-    else:
-        # AI GM自动生成词汇
-        gm_init_system_prompt = f"""你是游戏主持人(GM)，名字叫 {gm_name}。
-请想出两个相似但不同的词汇：一个给普通玩家，一个给卧底玩家。
-必须在公开部分最后一行写：normal_word=XXX, spy_word=YYY
-可用 <think>...</think> 表示私有思考。
-"""
-        st.session_state.conversations[gm_name].append({"role": "system", "content": gm_init_system_prompt})
-        st.session_state.conversations[gm_name].append({"role": "user", "content": "请生成两个相似的词，并按格式输出。"})
-        gm_reply_text = generate_reply(st.session_state.conversations[gm_name])
-        st.session_state.conversations[gm_name].append({"role": "assistant", "content": gm_reply_text})
-        with st.expander("[GM自动生成词] 完整回答(含<think>)"):
-            st.write(gm_reply_text)
-        _, gm_public_text = extract_think_and_public(gm_reply_text)
-        pattern = r"normal_word\s*=\s*(.*?),\s*spy_word\s*=\s*(.*)$"
-        match = re.search(pattern, gm_public_text, re.IGNORECASE)
-        if match:
-            st.session_state.normal_word = match.group(1).strip()
-            st.session_state.spy_word = match.group(2).strip()
-        else:
-            st.warning("未能解析出normal_word/spy_word，使用默认示例：苹果/梨子。")
-            st.session_state.normal_word = "苹果"
-            st.session_state.spy_word = "梨子"
-
-    # 随机指定一位玩家为卧底（注意：active_players只包含玩家，下标 1~num_players）
-    st.session_state.spy_index = random.randint(1, num_players)
-
-    # 下发各角色的最终 system prompt
-    GM_PROMPT = f"""你是游戏主持人(GM)，名字叫{{agent_name}}。
-本局共 {num_players} 位玩家 + 你（GM）。
-有1位卧底，卧底拿到的词是“{st.session_state.spy_word}”，普通玩家拿到的词是“{st.session_state.normal_word}”。
-你的职责：引导玩家依次发言并统一收集投票。
-请在回答中使用 <think>...</think> 写私有思考。
-"""
-    SPY_PROMPT = f"""你是一名玩家，名字叫“{{agent_name}}”。
-你是**卧底**！你的词是“{st.session_state.spy_word}”。
-请隐藏真实身份，不要直说“我是卧底”，描述时要与他人区分。
-你需要学会欺骗，如果你决定你可能猜到了他们的词汇，你可以尝试加入其中，让他们认为你和他们词汇一样。
-实际上你要让自己的表述尽可能模糊，也更难让别人猜到。回答尽可能简短，越来简单越好
-你要确保不能泄漏自己的词汇，让其他人猜到。
-也就是说你不能说出{st.session_state.spy_word}
-投票时请使用 `###Vote: 某某玩家` 或 `###Vote: None`。
-"""
-    NORMAL_PROMPT = f"""你是一名玩家，名字叫“{{agent_name}}”。
-你是**普通玩家**！你的词是“{st.session_state.normal_word}”。
-你的目标是揪出拿到不同词汇的卧底。
-你要确保不能泄漏自己的词汇，让其他人猜到。
-实际上你要让自己的表述尽可能模糊，也更难让别人猜到。回答尽可能简短，越来简单越好
-你不能在你的叙述中出现{st.session_state.normal_word}
-投票时请使用 `###Vote: 某某玩家` 或 `###Vote: None`。
-"""
-
-    for idx, name in enumerate(st.session_state.agent_names):
-        if idx == 0:
-            st.session_state.conversations[name].insert(0, {"role": "system", "content": GM_PROMPT.format(agent_name=name)})
-        else:
-            if idx == st.session_state.spy_index:
-                st.session_state.conversations[name].append({"role": "system", "content": SPY_PROMPT.format(agent_name=name)})
-            else:
-                st.session_state.conversations[name].append({"role": "system", "content": NORMAL_PROMPT.format(agent_name=name)})
+        # 投票阶段的最大并发请求数
+        st.session_state.vote_concurrency = 5
+
+        # 投票方式 & 结果确定后是否停止收集剩余投票
+        st.session_state.vote_mode = "text"
+        st.session_state.vote_short_circuit = False
+
+        # 发言方式（见 game_engine.SPEECH_MODES）
+        st.session_state.speech_mode = "sequential"
 
-    # 初始化 active_players（仅玩家，下标 1~num_players）
-    st.session_state.active_players = list(range(1, num_players+1))
+        # 流式输出（边生成边展示）
+        st.session_state.stream = True
 
-    st.success(f"游戏已创建：1位GM + {num_players}位玩家，其中1位是卧底。")
+        # 模型（接口地址只能在启动服务时设置，见 configure_server）
+        st.session_state.model = game_engine.MODEL
 
-def run_one_round():
+        # 回答缓存模式 & 种子（0 表示不固定种子）
+        st.session_state.cache_mode = "off"
+        st.session_state.seed = 0
+
+        # 上下文策略 & 保留的最近轮数
+        st.session_state.context_policy = "full"
+        st.session_state.context_keep_rounds = 2
+
+        # 预取词库：后台补充开关 & 取词的类别/难度（None 表示不限）
+        st.session_state.word_pool_prefetch = True
+        st.session_state.word_category = None
+        st.session_state.word_difficulty = None
+
+def get_generation_params():
     """
-    每一轮游戏流程：
-    1) 存活玩家依次发言（本轮发言的上下文累积）
-    2) 存活玩家统一投票（基于本轮所有发言）
-    3) 根据投票结果淘汰一人，并检查游戏是否结束
+    从session_state读取生成参数: temperature, top_p, presence_penalty, frequency_penalty
     """
-    if not st.session_state.game_inited:
-        st.warning("游戏尚未初始化，请先点击“开始游戏(重置)”")
-        return
-    if st.session_state.game_over:
-        st.warning("游戏已结束，请点击“开始游戏(重置)”重新开始")
-        return
+    return {
+        "temperature": st.session_state.temperature,
+        "top_p": st.session_state.top_p,
+        "presence_penalty": st.session_state.presence_penalty,
+        "frequency_penalty": st.session_state.frequency_penalty,
+    }
+
+@st.cache_resource
+def configure_server():
+    """
+    进程启动时设置一次接口地址和默认模型：
+        streamlit run who_is_spy.py -- --api-base http://127.0.0.1:8765/v1 --model deepseek-chat
+    未给出时使用环境变量 OPENAI_API_BASE / OPENAI_MODEL。
+    接口地址不在页面上提供修改：服务端的API Key会发往该地址，且所有会话共用。
+    """
+    parser = argparse.ArgumentParser(description="谁是卧底 Streamlit 服务")
+    parser.add_argument("--api-base", help="接口地址（默认读取 OPENAI_API_BASE）")
+    parser.add_argument("--model", help="默认模型（默认读取 OPENAI_MODEL）")
+    args, _ = parser.parse_known_args(sys.argv[1:])
+    game_engine.configure_api(api_base=args.api_base, model=args.model)
+    return args
+
+@st.cache_resource
+def get_llm_cache(mode):
+    """
+    每个缓存模式在进程内只打开一次缓存文件，所有会话共用。
+    """
+    return LLMCache(CACHE_PATH, mode=mode)
 
-    st.session_state.round_index += 1
-
-    # 本轮发言上下文，保存为列表[(speaker, public_text), ...]
-    current_round_context = []
-
-    # 让所有存活玩家依次发言
-    for idx in st.session_state.active_players:
-        # 对每个玩家传入本轮已经发言的上下文
-        public_msg = do_speak(idx, current_round_context)
-        # 保存该玩家的发言到本轮上下文
-        speaker = st.session_state.agent_names[idx]
-        current_round_context.append((speaker, public_msg))
-        # 同时更新该玩家的最新公开发言和公共聊天记录
-        st.session_state.public_messages[speaker] = public_msg
-        add_chat_record(speaker, public_msg)
-
-    # 更新所有玩家的上下文：此时，每个玩家在投票时可看到完整本轮发言
-    # 这里我们构造一个字符串，将本轮所有发言拼接起来
-    full_round_context = "【本轮全部公开发言】\n"
-    for speaker, msg in current_round_context:
-        full_round_context += f"{speaker}: {msg}\n"
-
-    # 让所有存活玩家依次投票，传入完整本轮上下文
-    votes_map = {}
-    for idx in st.session_state.active_players:
-        vote = do_vote(idx, full_round_context)
-        votes_map[idx] = vote
-
-    # 根据投票结果进行淘汰
-    eliminated = do_elimination(votes_map)
-    check_game_end(eliminated)
-
-def do_speak(player_idx, current_context):
-    """
-    让编号 player_idx 的角色发言 (含<think>)。
-    其User消息中包含本轮已发言的上下文 current_context（列表形式）。
-    """
-    name = st.session_state.agent_names[player_idx]
-    user_content = "【本轮前面玩家的公开发言】\n"
-    if current_context:
-        for speaker, msg in current_context:
-            user_content += f"{speaker}: {msg}\n"
-    else:
-        user_content += "(本轮暂无其他发言)\n"
-    user_content += "\n请你做本轮发言，用<think>...</think>写出私有思考。"
-
-    st.session_state.conversations[name].append({"role": "user", "content": user_content})
-    reply_text = generate_reply(st.session_state.conversations[name])
-    st.session_state.conversations[name].append({"role": "assistant", "content": reply_text})
-
-    private_thoughts, public_text = extract_think_and_public(reply_text)
-    with st.expander(f"{name} 发言 (含<think>) - 第{st.session_state.round_index}轮"):
-        st.write(reply_text)
-    return public_text
-
-def do_vote(player_idx, round_context):
-    """
-    让存活玩家投票 (含<think>)。
-    传入 round_context (字符串形式的本轮全部公开发言)，作为投票前的上下文。
-    返回投票目标（玩家姓名），若未解析到则返回 None。
-    """
-    name = st.session_state.agent_names[player_idx]
-    user_content = "【本轮全部公开发言】\n" + round_context
-    user_content += "\n请进行投票。使用 `###Vote: 某某玩家` 或 `###Vote: None` 表达你的投票。"
-
-    st.session_state.conversations[name].append({"role": "user", "content": user_content})
-    reply_text = generate_reply(st.session_state.conversations[name])
-    st.session_state.conversations[name].append({"role": "assistant", "content": reply_text})
-
-    private_thoughts, public_text = extract_think_and_public(reply_text)
-    with st.expander(f"{name} 投票 (含<think>) - 第{st.session_state.round_index}轮"):
-        st.write(reply_text)
-    vote_target = parse_vote_from_text(public_text)
-    if vote_target:
-        st.markdown(f"**{name} 投给了：{vote_target}**")
-    else:
-        st.markdown(f"**{name} 未给出有效投票**")
-    return vote_target
-
-def do_elimination(votes_map):
-    """
-    根据 votes_map ( {player_idx: "投给了某某玩家" 或 None} ) 统计票数：
-    - 找到票数最高的玩家
-    - 若出现平票则无人淘汰
-    - 否则淘汰票数最高者
-    返回被淘汰的 player_idx（若无人淘汰则返回 None）。
-    """
-    # 将存活玩家姓名映射到下标
-    name_to_idx = {st.session_state.agent_names[i]: i for i in st.session_state.active_players}
-    count_map = {}
-    for voter_idx, target_name in votes_map.items():
-        if not target_name:
-            continue
-        if target_name in name_to_idx:
-            target_idx = name_to_idx[target_name]
-            count_map[target_idx] = count_map.get(target_idx, 0) + 1
+def session_is_alive(session_id):
+    """会话是否仍然连接着（不在 streamlit run 环境中运行时视为在线）。"""
+    if not runtime.exists():
+        return True
+    return runtime.get_instance().is_active_session(session_id)
 
-    if not count_map:
-        st.info("本轮无人有效投票 => 无人淘汰")
-        return None
+@st.cache_resource
+def get_scheduler():
+    """
+    进程级请求调度器（所有会话共用）：全局并发上限 + 会话间轮询，断开的会话排队中的请求被取消。
+    """
+    return RequestScheduler(MAX_CONCURRENT_REQUESTS, is_alive=session_is_alive)
+
+def current_session_id():
+    ctx = get_script_run_ctx()
+    return ctx.session_id if ctx is not None else None
+
+def render_scheduler_status(scheduler):
+    stats = scheduler.stats()
+    st.caption(
+        f"全局请求调度：进行中 {stats['in_flight']}/{stats['max_concurrency']}，排队 {stats['queue_depth']}"
+        f"（峰值 {stats['max_queue_depth']}），在线会话 {stats['sessions']}，"
+        f"排队等待 p50 {stats['wait_p50']:.2f}s / p95 {stats['wait_p95']:.2f}s，已取消 {stats['cancelled']}，排队超时 {stats['timed_out']}"
+    )
+
+@st.cache_resource
+def get_word_pool():
+    """
+    进程内只打开一次词库，并配一个后台补充线程（所有会话共用）。
+    """
+    pool = WordPool(WORD_POOL_PATH)
+    return pool, WordPoolFiller(pool)
 
-    sorted_items = sorted(count_map.items(), key=lambda x: x[1], reverse=True)
-    top_idx, top_votes = sorted_items[0]
-    if len(sorted_items) > 1 and sorted_items[1][1] == top_votes:
-        st.info(f"出现平票，最高票数 {top_votes} 不是唯一 => 无人淘汰")
-        return None
+@st.cache_resource
+def get_game_log():
+    """
+    进程内只打开一次事件日志文件，所有会话共用。
+    """
+    return GameLog(GAME_LOG_PATH)
 
-    eliminated_idx = top_idx
-    eliminated_name = st.session_state.agent_names[eliminated_idx]
-    st.warning(f"**{eliminated_name} 被淘汰** (获得最高票数 {top_votes})")
-    st.session_state.active_players.remove(eliminated_idx)
-    return eliminated_idx
+def set_current_game(game_id):
+    """切换当前游戏，并写入URL参数，刷新页面后仍能恢复。"""
+    st.session_state.game_id = game_id
+    st.query_params["game"] = game_id
 
-def check_game_end(eliminated_idx):
+def render_resume_panel(game_log):
+    """
+    侧边栏：列出本页面创建的未结束对局，选择后从事件日志恢复。
     """
-    检查游戏是否结束：
-    - 若淘汰者是卧底，则平民胜利；
-    - 若存活玩家只剩2人（且卧底仍在），则卧底胜利；
-    否则游戏继续。
+    games = [g for g in game_log.list_games(status="playing", owner=st.session_state.owner)
+             if g["game_id"] != st.session_state.game_id]
+    if not games:
+        return
+    st.subheader("恢复对局")
+    labels = {
+        f"{time.strftime('%m-%d %H:%M', time.localtime(g['updated']))} · {g['num_players']}人 · 第{g['rounds']}轮 · {g['game_id'][:8]}": g["game_id"]
+        for g in games
+    }
+    label = st.selectbox("未结束的对局", list(labels))
+    if st.button("恢复所选对局"):
+        set_current_game(labels[label])
+        st.rerun()
+
+@st.cache_resource
+def get_metrics_exporters():
+    """
+    进程级导出器（所有会话共用，只注册一次）：
+    - 环境变量 METRICS_JSONL：每次调用追加一行JSON
+    - 环境变量 METRICS_PROM ：Prometheus 文本格式文件，每次页面刷新时重写
+    """
+    exporters = {}
+    if os.getenv("METRICS_JSONL"):
+        exporters["jsonl"] = metrics.add_exporter(metrics.JsonlExporter(os.getenv("METRICS_JSONL")))
+    if os.getenv("METRICS_PROM"):
+        exporters["prometheus"] = metrics.add_exporter(metrics.PrometheusExporter())
+    return exporters
+
+def render_metrics_panel(game):
     """
-    if eliminated_idx is not None and eliminated_idx == st.session_state.spy_index:
-        st.success("卧底被淘汰！平民胜利！")
-        st.session_state.game_over = True
-        st.session_state.winner = "平民"
+    侧边栏性能面板：按阶段、按角色汇总耗时和token，并提供本局记录的导出。
+    """
+    st.subheader("性能统计")
+    totals = game.metrics.totals()
+    if totals is None:
+        st.caption("(暂无调用记录)")
         return
+    st.caption(
+        f"共 {totals['calls']} 次调用，累计耗时 {totals['latency_total']:.1f}s，"
+        f"输入 {totals['prompt_tokens']} / 输出 {totals['completion_tokens']} tokens，"
+        f"重试 {totals['retries']} 次，失败 {totals['errors']} 次"
+    )
+    columns = ["calls", "latency_total", "latency_p50", "latency_p95", "ttft_mean", "queue_wait_mean",
+               "prompt_tokens", "completion_tokens", "cache_hit_tokens", "retries", "errors"]
+    for label, by in (("按阶段", ("phase",)), ("按角色", ("agent",)), ("按轮次", ("round",))):
+        st.markdown(f"**{label}**")
+        rows = game.metrics.summary(by=by)
+        st.dataframe([{key: row[key] for key in by + tuple(columns)} for row in rows], hide_index=True)
+
+    exporter = metrics.PrometheusExporter()
+    for record in game.metrics.records:
+        exporter.export(record)
+    st.download_button(
+        "导出本局调用记录 (JSONL)",
+        "".join(json.dumps(record, ensure_ascii=False) + "\n" for record in game.metrics.records),
+        file_name=f"metrics_{game.game_id}.jsonl",
+    )
+    st.download_button("导出本局指标 (Prometheus)", exporter.render(), file_name=f"metrics_{game.game_id}.prom")
+
+# ========== 聊天记录/对话记录的分页渲染 ==========
+
+@st.cache_data(max_entries=RENDER_CACHE_MAX_ENTRIES, ttl=RENDER_CACHE_TTL, show_spinner=False)
+def build_finished_round(game_id, view, name, round_no, _build):
+    """
+    已结束轮次的渲染结果（markdown文本），按 (game_id, 视图, 角色名, 轮次) 缓存：
+    已结束的轮次内容不再变化，条目数和保留时间有上限，也不占用会话内存
+    （对话记录在事件日志中，不放回 session_state）。_build 不参与缓存键。
+    """
+    return _build(round_no)
 
-    if len(st.session_state.active_players) == 2:
-        if st.session_state.spy_index in st.session_state.active_players:
-            st.warning("只剩2人存活(含卧底)，卧底胜利！")
-            st.session_state.game_over = True
-            st.session_state.winner = "卧底"
-        else:
-            st.success("只剩2人存活(卧底已被淘汰)，平民胜利！")
-            st.session_state.game_over = True
-            st.session_state.winner = "平民"
+def render_round_cached(game, key, round_no, build):
+    """
+    返回某一轮的markdown文本：已结束的轮次只构造一次，之后的rerun直接复用；
+    未结束的轮次每次重新构造。
+    """
+    if not game.is_round_finished(round_no):
+        return build(round_no)
+    view, name = key
+    return build_finished_round(game.game_id, view, name, round_no, build)
+
+def select_round_page(rounds, key):
+    """
+    把轮次列表按 HISTORY_ROUNDS_PER_PAGE 分页（最新的一页在最后并默认选中），返回当前页的轮次。
+    """
+    pages = [rounds[i:i + HISTORY_ROUNDS_PER_PAGE] for i in range(0, len(rounds), HISTORY_ROUNDS_PER_PAGE)]
+    if len(pages) <= 1:
+        return rounds
+    labels = [f"第{page[0]}-{page[-1]}轮" if len(page) > 1 else f"第{page[0]}轮" for page in pages]
+    label = st.select_slider("翻页", labels, value=labels[-1], key=key)
+    return pages[labels.index(label)]
+
+def build_chat_round(game, round_no):
+    records = game.chat_records(round_no)
+    if not records:
+        return "(本轮无公开发言)"
+    return "\n\n".join(f"**{speaker}**: {msg}" for speaker, msg in records)
+
+def build_conversation_round(game, name, round_no):
+    lines = [f"**[{c['role']} {i}]**: {c['content']}"
+             for i, c in enumerate(game.conversations[name]) if c["round"] == round_no]
+    return "\n\n".join(lines) if lines else "(本轮无对话)"
+
+def render_public_chat(game):
+    """
+    公共聊天记录：按轮分页，每轮一个markdown元素。
+    """
+    rounds = list(range(1, game.round_index + 1))
+    if not game.public_chat_history:
+        st.write("(暂无公共发言)")
+        return
+    for round_no in select_round_page(rounds, key=f"chat_page_{game.game_id}"):
+        st.markdown(f"**—— 第{round_no}轮 ——**")
+        st.markdown(render_round_cached(game, ("chat", None), round_no, lambda r: build_chat_round(game, r)))
 
-def add_chat_record(speaker_name, public_text):
+def render_conversations(game):
+    """
+    各角色的完整对话：默认收起，只有打开开关的角色才会构造并分页渲染其对话内容
+    （st.expander 收起时内容依然会被构造并发送给浏览器）。
     """
-    将一条公开消息追加到公共聊天记录中。
+    for name in game.agent_names:
+        if not st.toggle(f"查看 {name} 的全部对话历史", key=f"show_conv_{game.game_id}_{name}"):
+            continue
+        with st.container(border=True):
+            rounds = list(range(0, game.round_index + 1))
+            for round_no in select_round_page(rounds, key=f"conv_page_{game.game_id}_{name}"):
+                st.markdown(f"**—— {'开局' if round_no == 0 else f'第{round_no}轮'} ——**")
+                st.markdown(render_round_cached(game, ("conversation", name), round_no,
+                                                lambda r: build_conversation_round(game, name, r)))
+
+def get_context_policy():
     """
-    if public_text.strip():
-        st.session_state.public_chat_history.append((speaker_name, public_text))
+    根据侧边栏设置构造上下文策略。
+    """
+    if st.session_state.context_policy == "full":
+        return FullHistoryPolicy()
+    return WindowPolicy(keep_rounds=st.session_state.context_keep_rounds, fold=st.session_state.context_policy)
+
+def sync_game(game):
+    """
+    把本次rerun的界面回调和侧边栏参数同步给游戏。
+    """
+    game.reporter = StreamlitReporter()
+    game.params = get_generation_params()
+    game.model = st.session_state.model or None
+    game.vote_concurrency = st.session_state.vote_concurrency
+    game.vote_mode = st.session_state.vote_mode
+    game.vote_short_circuit = st.session_state.vote_short_circuit
+    game.speech_mode = st.session_state.speech_mode
+    game.stream = st.session_state.stream
+    game.context_policy = get_context_policy()
+    game.session_id = current_session_id()
+    # 缓存模式是每个会话自己的设置，不影响其他会话的对局
+    game.cache = get_llm_cache(st.session_state.cache_mode) if st.session_state.cache_mode != "off" else None
+    return game
+
+def get_game():
+    """
+    从事件日志重建当前游戏（会话中只保存游戏ID，对话记录等都在磁盘上）。
+    不属于本页面的对局（含卧底词和各角色的思考）不会被加载。
+    """
+    if not st.session_state.game_id:
+        return None
+    game_log = get_game_log()
+    game = None
+    if game_log.owner(st.session_state.game_id) == st.session_state.owner:
+        game = Game.load(game_log, st.session_state.game_id)
+    if game is None:
+        st.session_state.game_id = None
+        return None
+    return sync_game(game)
 
 # ========== Streamlit 界面 ==========
 
@@ -397,6 +411,7 @@ def main():
     """)
 
     # 初始化 session_state
+    configure_server()
     init_session_state()
 
     # ========== 左侧：参数设置 ==========
@@ -409,51 +424,125 @@ def main():
         if word_option == "用户提供":
             user_normal_word = st.text_input("普通玩家的词", value="苹果")
             user_spy_word = st.text_input("卧底玩家的词", value="梨子")
+        else:
+            st.session_state.word_pool_prefetch = st.checkbox("后台预取词库(开局不等待GM生词)", value=st.session_state.word_pool_prefetch)
+            category_labels = ["任意"] + list(CATEGORIES)
+            category_label = st.selectbox("词库类别", category_labels, index=category_labels.index(st.session_state.word_category or "任意"))
+            st.session_state.word_category = None if category_label == "任意" else category_label
+            difficulty_labels = list(DIFFICULTY_LABELS)
+            difficulty_label = st.selectbox("词库难度", difficulty_labels, index=list(DIFFICULTY_LABELS.values()).index(st.session_state.word_difficulty))
+            st.session_state.word_difficulty = DIFFICULTY_LABELS[difficulty_label]
         st.markdown("---")
+        st.session_state.model = st.text_input("模型", value=st.session_state.model)
         st.session_state.temperature = st.slider("Temperature (随机度)", 0.0, 2.0, st.session_state.temperature, 0.1)
         st.session_state.top_p = st.slider("Top-p (核采样)", 0.1, 1.0, st.session_state.top_p, 0.05)
         st.session_state.presence_penalty = st.slider("Presence Penalty", 0.0, 2.0, st.session_state.presence_penalty, 0.1)
         st.session_state.frequency_penalty = st.slider("Frequency Penalty", 0.0, 2.0, st.session_state.frequency_penalty, 0.1)
+        st.session_state.vote_concurrency = st.number_input("投票并发请求数", min_value=1, max_value=10, value=st.session_state.vote_concurrency, step=1)
+        vote_mode_labels = list(VOTE_MODE_LABELS)
+        vote_mode_label = st.selectbox("投票方式", vote_mode_labels, index=list(VOTE_MODE_LABELS.values()).index(st.session_state.vote_mode))
+        st.session_state.vote_mode = VOTE_MODE_LABELS[vote_mode_label]
+        st.session_state.vote_short_circuit = st.checkbox("结果确定后停止收集投票", value=st.session_state.vote_short_circuit)
+        speech_mode_labels = list(SPEECH_MODE_LABELS)
+        speech_mode_label = st.selectbox("发言方式", speech_mode_labels, index=list(SPEECH_MODE_LABELS.values()).index(st.session_state.speech_mode))
+        st.session_state.speech_mode = SPEECH_MODE_LABELS[speech_mode_label]
+        st.session_state.stream = st.checkbox("流式输出(边生成边展示)", value=st.session_state.stream)
+        cache_labels = list(CACHE_MODE_LABELS)
+        cache_label = st.selectbox("回答缓存", cache_labels, index=list(CACHE_MODE_LABELS.values()).index(st.session_state.cache_mode))
+        st.session_state.cache_mode = CACHE_MODE_LABELS[cache_label]
+        st.session_state.seed = st.number_input("随机种子(0=不固定)", min_value=0, value=st.session_state.seed, step=1)
+        context_labels = list(CONTEXT_POLICY_LABELS)
+        context_label = st.selectbox("上下文策略", context_labels, index=list(CONTEXT_POLICY_LABELS.values()).index(st.session_state.context_policy))
+        st.session_state.context_policy = CONTEXT_POLICY_LABELS[context_label]
+        if st.session_state.context_policy != "full":
+            st.session_state.context_keep_rounds = st.number_input("保留最近轮数(N)", min_value=1, max_value=10, value=st.session_state.context_keep_rounds, step=1)
+    exporters = get_metrics_exporters()
+    scheduler = get_scheduler()
+    game_engine.configure_scheduler(scheduler)
+    scheduler.touch(current_session_id())
+    with st.sidebar:
+        render_scheduler_status(scheduler)
+    word_pool, word_pool_filler = get_word_pool()
+    # 固定种子时不使用词库（词库内容随使用变化，无法复现）
+    use_word_pool = word_option == "AI GM自动" and st.session_state.word_pool_prefetch and not st.session_state.seed
+    if use_word_pool:
+        # 补充线程所有会话共用：某个会话不用词库时不停止它（词库补足 low_water 后线程只是空闲等待，不发请求）
+        word_pool_filler.start()
+        with st.sidebar:
+            st.caption(
+                f"词库可用 {word_pool.available(st.session_state.word_category, st.session_state.word_difficulty)} 组"
+                f"（共 {word_pool.available()} 组未用）"
+            )
+
+    game_log = get_game_log()
+    with st.sidebar:
+        render_resume_panel(game_log)
 
+    game = None
     col1, col2 = st.columns(2)
     with col1:
         if st.button("开始游戏(重置)"):
-            setup_game(num_players, word_option, user_normal_word, user_spy_word)
+            game = Game(seed=st.session_state.seed or None, word_pool=word_pool if use_word_pool else None, event_log=game_log,
+                        owner=st.session_state.owner)
+            set_current_game(game.game_id)
+            sync_game(game).setup_game(num_players, word_option, user_normal_word, user_spy_word,
+                                       st.session_state.word_category, st.session_state.word_difficulty)
+    if game is None:
+        game = get_game()
     with col2:
-        if st.session_state.game_inited and not st.session_state.game_over:
-            if st.button("进行下一轮"):
-                run_one_round()
-
-    if st.session_state.game_inited:
+        if game is not None and game.game_inited and not game.game_over:
+            interrupted = game.round_index > 0 and not game.is_round_finished(game.round_index)
+            if st.button("继续中断的一轮" if interrupted else "进行下一轮"):
+                try:
+                    game.run_one_round()
+                except EventConflict:
+                    # 同一局在另一个页面中也在推进：本页面的状态已过期，从日志重新加载
+                    st.warning("这一局已在其他页面中继续进行，已重新加载最新进度")
+                    game = get_game()
+                except RequestCancelled:
+                    st.warning("本页面的请求已被取消，这一轮尚未完成，可点击“继续中断的一轮”从中断处继续")
+
+    if game is not None and game.game_inited:
         st.write("---")
-        st.write(f"**玩家(含GM)名单**: {st.session_state.agent_names}")
+        st.write(f"**玩家(含GM)名单**: {game.agent_names}")
         spy_name = "???"
-        if (st.session_state.spy_index is not None and 
-            st.session_state.spy_index < len(st.session_state.agent_names)):
-            spy_name = st.session_state.agent_names[st.session_state.spy_index]
+        if (game.spy_index is not None and 
+            game.spy_index < len(game.agent_names)):
+            spy_name = game.agent_names[game.spy_index]
 
-        if st.session_state.game_over:
+        if game.game_over:
             st.subheader("游戏结束!")
             st.write(f"本局卧底是：{spy_name}")
-            st.write(f"获胜方：{st.session_state.winner}")
+            st.write(f"获胜方：{game.winner}")
         else:
-            st.write(f"**已经进行了 {st.session_state.round_index} 轮**")
-            alive_names = [st.session_state.agent_names[i] for i in st.session_state.active_players]
+            st.write(f"**已经进行了 {game.round_index} 轮**")
+            alive_names = [game.agent_names[i] for i in game.active_players]
             st.write(f"当前存活玩家：{alive_names}")
 
+        savings = game.context_savings()
+        if savings["calls"]:
+            st.caption(
+                f"上下文策略累计节省约 {savings['saved']} tokens "
+                f"({savings['saved_ratio']:.0%}，完整历史 {savings['full_tokens']} → 实际发送 {savings['sent_tokens']}，共 {savings['calls']} 次请求)"
+            )
+
+        prefix_cache = game.prefix_cache_summary()
+        if prefix_cache["prompt_tokens"]:
+            st.caption(
+                f"接口前缀缓存命中 {prefix_cache['cache_hit_tokens']} / {prefix_cache['prompt_tokens']} 输入tokens "
+                f"({prefix_cache['hit_ratio']:.0%}，共 {prefix_cache['calls']} 次请求)"
+            )
+
         st.header("公共聊天记录 (仅公开内容)")
-        if not st.session_state.public_chat_history:
-            st.write("(暂无公共发言)")
-        else:
-            for speaker, msg in st.session_state.public_chat_history:
-                st.markdown(f"**{speaker}**: {msg}")
+        render_public_chat(game)
+
+        with st.sidebar:
+            render_metrics_panel(game)
+        if "prometheus" in exporters:
+            exporters["prometheus"].write(os.getenv("METRICS_PROM"))
 
         st.header("各AI完整对话记录 (含<think>)")
-        for name in st.session_state.agent_names:
-            with st.expander(f"查看 {name} 的全部对话历史"):
-                conversation = st.session_state.conversations[name]
-                for i, c in enumerate(conversation):
-                    st.write(f"**[{c['role']} {i}]**: {c['content']}")
+        render_conversations(game)
 
 if __name__ == "__main__":
     main()
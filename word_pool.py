@@ -0,0 +1,307 @@
+"""
+预取词库：后台批量生成“普通词/卧底词”词对，校验、去重后存入SQLite，按类别和难度建索引。
+
+- WordPool        ：磁盘上的词库，take() 取出一组未用过的词对（单条索引查找 + 标记已用）
+- WordPoolFiller  ：后台线程，可用词对少于 low_water 时一次请求批量生成 batch_size 组
+用过的词对不会删除，只标记使用时间，之后再生成相同的词对会被去重丢弃，避免反复出同一组词。
+
+用法示例（离线预填充）：
+    python word_pool.py --fill 200 --path word_pool.sqlite3
+    python word_pool.py --stats
+"""
+import argparse
+import re
+import sqlite3
+import threading
+import time
+
+import game_engine
+import prompts
+
+CATEGORIES = ("食物", "动物", "日常用品", "地点", "职业", "运动", "交通", "自然", "娱乐", "其他")
+DIFFICULTIES = ("easy", "medium", "hard")
+
+# 单个词：2~8个汉字/字母/数字，不含标点和空白
+_WORD_PATTERN = re.compile(r"^\w{2,8}$")
+# 行首的列表符号或序号，如 "- "、"1. "、"2、"
+_BULLET_PATTERN = re.compile(r"^\s*(?:[-*•]|\d+\s*[.、)）])\s*")
+
+
+def pair_key(normal_word, spy_word):
+    """去重键：与顺序无关（A/B 与 B/A 视为同一组）。"""
+    return "|".join(sorted((normal_word.lower(), spy_word.lower())))
+
+
+def validate_pair(normal_word, spy_word):
+    """两个词都是合法的短词且互不相同时返回 True。"""
+    return (
+        bool(_WORD_PATTERN.match(normal_word)) and bool(_WORD_PATTERN.match(spy_word))
+        and normal_word != spy_word
+    )
+
+
+def parse_pairs(text):
+    """
+    解析批量生词的回答（每行 普通词|卧底词|类别|难度），返回 (合法词对列表, 丢弃的行数)。
+    未知类别记为“其他”，未知难度记为 medium。
+    """
+    pairs = []
+    rejected = 0
+    for line in text.splitlines():
+        line = _BULLET_PATTERN.sub("", line.strip().replace("｜", "|"))
+        if not line:
+            continue
+        fields = [field.strip() for field in line.split("|")]
+        if len(fields) < 2 or not validate_pair(fields[0], fields[1]):
+            rejected += 1
+            continue
+        category = fields[2] if len(fields) > 2 and fields[2] in CATEGORIES else "其他"
+        difficulty = fields[3].lower() if len(fields) > 3 and fields[3].lower() in DIFFICULTIES else "medium"
+        pairs.append({"normal_word": fields[0], "spy_word": fields[1], "category": category, "difficulty": difficulty})
+    return pairs, rejected
+
+
+class WordPool:
+    """
+    基于SQLite的词库，可在多线程（后台预取）和多进程（批量模拟）中共用同一个文件。
+    on_take 为取词后的回调（WordPoolFiller 用它唤醒后台补充）。
+    """
+
+    def __init__(self, path="word_pool.sqlite3", on_take=None):
+        self.path = path
+        self.on_take = on_take
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS pairs (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                normal_word TEXT NOT NULL,
+                spy_word TEXT NOT NULL,
+                category TEXT NOT NULL,
+                difficulty TEXT NOT NULL,
+                pair_key TEXT NOT NULL UNIQUE,
+                created REAL NOT NULL,
+                used_at REAL
+            )
+        """)
+        # 未用词对按 (类别, 难度) 或只按难度查找时都走索引，取最早入库的一条
+        self._conn.execute("CREATE INDEX IF NOT EXISTS pairs_available ON pairs (used_at, category, difficulty, id)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS pairs_available_difficulty ON pairs (used_at, difficulty, id)")
+        self._conn.commit()
+
+    def add_pairs(self, pairs):
+        """写入词对，已存在（含已用过）的词对被忽略；返回新增条数。"""
+        now = time.time()
+        rows = [
+            (p["normal_word"], p["spy_word"], p.get("category", "其他"), p.get("difficulty", "medium"),
+             pair_key(p["normal_word"], p["spy_word"]), now)
+            for p in pairs
+        ]
+        with self._lock:
+            before = self._conn.total_changes
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO pairs (normal_word, spy_word, category, difficulty, pair_key, created) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                rows,
+            )
+            self._conn.commit()
+            return self._conn.total_changes - before
+
+    def take(self, category=None, difficulty=None):
+        """
+        取出一组未用过的词对并标记为已用，返回 {"normal_word", "spy_word", "category", "difficulty"}；
+        没有符合条件的词对时返回 None。
+        """
+        where, args = self._filter(category, difficulty)
+        with self._lock:
+            row = self._conn.execute(
+                "UPDATE pairs SET used_at = ? WHERE id = ("
+                f"SELECT id FROM pairs WHERE {where} ORDER BY id LIMIT 1"
+                ") RETURNING normal_word, spy_word, category, difficulty",
+                (time.time(), *args),
+            ).fetchone()
+            self._conn.commit()
+        if self.on_take is not None:
+            self.on_take()
+        if row is None:
+            return None
+        return dict(zip(("normal_word", "spy_word", "category", "difficulty"), row))
+
+    def available(self, category=None, difficulty=None):
+        """符合条件的未用词对数量。"""
+        where, args = self._filter(category, difficulty)
+        with self._lock:
+            return self._conn.execute(f"SELECT COUNT(*) FROM pairs WHERE {where}", args).fetchone()[0]
+
+    def recent_pairs(self, limit=30):
+        """最近入库的词对 [(normal_word, spy_word), ...]，用于提示模型不要重复。"""
+        with self._lock:
+            return self._conn.execute(
+                "SELECT normal_word, spy_word FROM pairs ORDER BY id DESC LIMIT ?", (limit,)
+            ).fetchall()
+
+    def stats(self):
+        """返回总数、可用数，以及按类别/难度统计的可用数。"""
+        with self._lock:
+            total, available = self._conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(used_at IS NULL), 0) FROM pairs"
+            ).fetchone()
+            groups = self._conn.execute(
+                "SELECT category, difficulty, COUNT(*) FROM pairs WHERE used_at IS NULL GROUP BY category, difficulty"
+            ).fetchall()
+        by_category = {}
+        by_difficulty = {}
+        for category, difficulty, count in groups:
+            by_category[category] = by_category.get(category, 0) + count
+            by_difficulty[difficulty] = by_difficulty.get(difficulty, 0) + count
+        return {"total": total, "available": available, "by_category": by_category, "by_difficulty": by_difficulty}
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    @staticmethod
+    def _filter(category, difficulty):
+        clauses, args = ["used_at IS NULL"], []
+        if category:
+            clauses.append("category = ?")
+            args.append(category)
+        if difficulty:
+            clauses.append("difficulty = ?")
+            args.append(difficulty)
+        return " AND ".join(clauses), args
+
+
+def build_fill_messages(pool, count, category=None, avoid=30):
+    """构造一次批量生词请求的消息（附上最近的词对，减少重复）。"""
+    category_hint = f"，类别都用“{category}”" if category else ""
+    request = prompts.WORD_POOL_REQUEST.format(count=count, category_hint=category_hint)
+    recent = pool.recent_pairs(avoid)
+    if recent:
+        request += "\n" + prompts.WORD_POOL_AVOID.format(pairs="、".join(f"{a}/{b}" for a, b in recent))
+    return [
+        {"role": "system", "content": prompts.WORD_POOL_PROMPT.format(count=count, categories="、".join(CATEGORIES))},
+        {"role": "user", "content": request},
+    ]
+
+
+class WordPoolFiller:
+    """
+    后台补充词库的守护线程：
+    - 可用词对少于 low_water 时，每次请求生成 batch_size 组，直到补足
+    - 取词后（WordPool.on_take）立即唤醒检查；否则每 idle_interval 秒检查一次
+    - 请求失败或一批全是重复/非法词对时，按指数退避（最长 max_backoff 秒）
+    generate 为 messages -> 回答文本 的函数，默认使用 game_engine.generate_reply。
+    """
+
+    def __init__(self, pool, generate=None, low_water=20, batch_size=20, category=None,
+                 params=None, idle_interval=30.0, max_backoff=300.0):
+        self.pool = pool
+        self.generate = generate or (lambda messages: game_engine.generate_reply(messages, params=self.params))
+        self.low_water = low_water
+        self.batch_size = batch_size
+        self.category = category
+        # 生词时用较高的温度，增加多样性
+        self.params = {**game_engine.DEFAULT_GENERATION_PARAMS, "temperature": 1.0, **(params or {})}
+        self.idle_interval = idle_interval
+        self.max_backoff = max_backoff
+        self.batches = 0
+        self.added = 0
+        self.rejected = 0
+        self.errors = 0
+        self.last_error = None
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def fill_once(self):
+        """请求一批词对并写入词库，返回新增条数。"""
+        text = self.generate(build_fill_messages(self.pool, self.batch_size, self.category))
+        _, public_text = game_engine.extract_think_and_public(text)
+        pairs, rejected = parse_pairs(public_text)
+        added = self.pool.add_pairs(pairs)
+        self.batches += 1
+        self.added += added
+        self.rejected += rejected + len(pairs) - added
+        return added
+
+    def start(self):
+        if self._thread is None or not self._thread.is_alive():
+            if self.pool.on_take is None:
+                self.pool.on_take = self.wake
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="word-pool-filler", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self, timeout=None):
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def wake(self):
+        self._wake.set()
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive() and not self._stop.is_set()
+
+    def stats(self):
+        return {
+            "running": self.running, "batches": self.batches, "added": self.added,
+            "rejected": self.rejected, "errors": self.errors,
+            "last_error": None if self.last_error is None else f"{self.last_error.__class__.__name__}: {self.last_error}",
+        }
+
+    def _run(self):
+        failures = 0
+        while not self._stop.is_set():
+            if self.pool.available() >= self.low_water:
+                self._sleep(self.idle_interval)
+                continue
+            try:
+                added = self.fill_once()
+            except Exception as e:
+                # 接口错误、回放模式缓存未命中等：记录后退避重试
+                self.errors += 1
+                self.last_error = e
+                added = 0
+            if added:
+                failures = 0
+                continue
+            failures += 1
+            self._sleep(min(self.max_backoff, self.idle_interval * 2 ** (failures - 1)))
+
+    def _sleep(self, seconds):
+        self._wake.wait(seconds)
+        self._wake.clear()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="谁是卧底 预取词库")
+    parser.add_argument("--path", default="word_pool.sqlite3", help="词库文件(SQLite)路径")
+    parser.add_argument("--fill", type=int, default=0, help="同步补充到至少这么多组可用词对")
+    parser.add_argument("--batch-size", type=int, default=20, help="每次请求生成的词对数")
+    parser.add_argument("--category", choices=CATEGORIES, help="只生成该类别的词对")
+    parser.add_argument("--max-batches", type=int, default=50, help="最多请求次数")
+    parser.add_argument("--api-base", help="接口地址（默认读取 OPENAI_API_BASE）")
+    parser.add_argument("--model", help="模型（默认读取 OPENAI_MODEL）")
+    parser.add_argument("--stats", action="store_true", help="只打印词库统计")
+    args = parser.parse_args(argv)
+
+    pool = WordPool(args.path)
+    if args.fill and not args.stats:
+        game_engine.configure_api(api_base=args.api_base, model=args.model)
+        filler = WordPoolFiller(pool, batch_size=args.batch_size, category=args.category)
+        for _ in range(args.max_batches):
+            if pool.available(category=args.category) >= args.fill:
+                break
+            added = filler.fill_once()
+            print(f"第{filler.batches}批：新增 {added} 组，当前可用 {pool.available()} 组")
+    print(pool.stats())
+
+
+if __name__ == "__main__":
+    main()